@@ -2,28 +2,37 @@
 
 import os
 import json
-import requests
 import sys
 from pathlib import Path
-from flask import Flask, request, jsonify, send_file, abort
+from urllib.parse import quote
+from flask import Flask, Response, request, jsonify, abort, stream_with_context
 
 # —— Paths —— 
 BASE_DIR     = Path(__file__).parent.resolve()
 FRONTEND_DIR = BASE_DIR / "frontend"
 BACKEND_DIR  = BASE_DIR / "backend"
 
-DFS_META     = BACKEND_DIR / "dfs" / "metadata"
-CHUNK_DIR    = BASE_DIR / BACKEND_DIR / "chunks"
-DOWNLOAD_DIR = BASE_DIR / "downloaded_files"
-for d in (CHUNK_DIR, DOWNLOAD_DIR):
-    d.mkdir(exist_ok=True)
-
 # Make sure we can import your backend modules
 sys.path.insert(0, str(BACKEND_DIR))
 
-from backend.dfs.client.delete import delete_file
-from backend.main import index_and_upload_pdf, search_query
-from backend.dfs.core.chunker import reconstruct_file
+from backend.main import index_and_upload_pdf, search_query, search_query_stages
+# the backend imports its modules as dfs.* and search_engine.* (BACKEND_DIR
+# is on sys.path); importing them the same way shares one module object, so
+# the transport stats, node latencies and caches cover every request
+from dfs.client.delete import delete_file
+from dfs.client.download import iter_file_chunks
+from dfs.core.ranges import parse_range, content_range
+from dfs.core.transport import pool_stats
+from search_engine.neighbors import get_related
+from dfs.core.metadata import load_metadata, content_version
+from dfs.core.cache import LRUCache
+
+# —— Reconstructed-file cache —— 
+# Recently served files, keyed by (file name, content version) so a file
+# uploaded again under the same name is never served stale. A cached view
+# or download is answered from memory without fetching any chunk.
+FILE_CACHE_MB = int(os.getenv("DFS_FILE_CACHE_MB", "256"))  # 0 disables
+FILE_CACHE    = LRUCache(FILE_CACHE_MB * 1024 * 1024)
 
 # —— Flask App Setup —— 
 app = Flask(
@@ -73,7 +82,14 @@ def api_upload():
     target = tmp_dir / filename
     f.save(target)
 
-    index_and_upload_pdf(str(target))
+    result = index_and_upload_pdf(str(target))
+    if result and result["status"] == "duplicate":
+        target.unlink(missing_ok=True)
+        return jsonify({
+            "error":        "Near-duplicate of an existing file",
+            "duplicate_of": result["duplicate_of"],
+            "similarity":   round(result["similarity"], 3)
+        }), 409
     return jsonify({"status": "ok"}), 200
 
 
@@ -116,43 +132,103 @@ def api_search():
         })
     return jsonify({"results": out})
 
-# 4) Download
-@app.route("/api/download/<filename>", methods=["GET"])
-def api_download(filename):
-    meta_file = DFS_META / f"{filename}.json"
-    if not meta_file.exists():
+# 3b) Progressive search (Server-Sent Events)
+@app.route("/api/search/stream", methods=["GET"])
+def api_search_stream():
+    """
+    Streams one SSE event per search stage: "lexical" (fast title/text hits),
+    "ranked" (after semantic re-ranking), "metadata" (snippets, chunk counts)
+    and finally "done".
+    """
+    q = request.args.get("query", "").strip()
+
+    def events():
+        if q:
+            try:
+                for stage, results in search_query_stages(q):
+                    yield f"event: {stage}\ndata: {json.dumps({'results': results})}\n\n"
+            except Exception as e:
+                yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+        yield "event: done\ndata: {}\n\n"
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# 4) Download / 5) View — chunks are fetched in parallel and streamed to
+# the client in order as they arrive, without staging files on disk.
+# A Range header only fetches the chunks covering the requested bytes.
+# Whole files small enough for FILE_CACHE are kept there as they stream
+# out, and served from memory afterwards.
+def _stream_file(filename, as_attachment):
+    metadata = load_metadata(filename)
+    if metadata is None:
         return abort(404)
 
-    metadata = json.loads(meta_file.read_text())
-    for chunk_id, node_url in metadata.items():
-        r = requests.get(f"{node_url}/chunk/{chunk_id}", timeout=5)
-        r.raise_for_status()
-        (CHUNK_DIR / chunk_id).write_bytes(r.content)
+    key     = (filename, content_version(metadata))
+    cached  = FILE_CACHE.get(key)
+    total   = len(cached) if cached is not None else metadata["size"]
+    headers = {}
+    status  = 200
+    byte_range = None
+    if total is not None:
+        headers["Accept-Ranges"] = "bytes"
+        try:
+            byte_range = parse_range(request.headers.get("Range"), total)
+        except ValueError:
+            return Response(status=416, headers={"Content-Range": f"bytes */{total}"})
+        if byte_range:
+            status = 206
+            headers["Content-Range"]  = content_range(*byte_range, total)
+            headers["Content-Length"] = str(byte_range[1] - byte_range[0] + 1)
+        else:
+            headers["Content-Length"] = str(total)
+
+    disposition = "attachment" if as_attachment else "inline"
+    headers["Content-Disposition"] = f"{disposition}; filename*=UTF-8''{quote(filename)}"
+    if cached is not None:
+        start, end = byte_range or (0, total - 1)
+        return Response(cached[start:end + 1], status=status, mimetype="application/pdf", headers=headers)
+
+    chunks = iter_file_chunks(metadata, byte_range=byte_range)
+    try:
+        # pull the first chunk before sending headers so a dead node is a 502
+        first = next(chunks, b"")
+    except Exception as e:
+        chunks.close()
+        return jsonify({"error": f"Failed to fetch chunks: {e}"}), 502
+
+    cacheable = byte_range is None and total is not None and total <= FILE_CACHE.max_item
+    since = FILE_CACHE.invalidations
+
+    def body():
+        parts = [first]
+        yield first
+        for part in chunks:
+            if cacheable:
+                parts.append(part)
+            yield part
+        # only a file streamed out in full is cached; it replaces any
+        # earlier version of the same file
+        if cacheable and FILE_CACHE.put(key, b"".join(parts), since=since):
+            FILE_CACHE.pop_matching(lambda k: k[0] == filename and k != key)
+
+    return Response(
+        stream_with_context(body()),
+        status=status,
+        mimetype="application/pdf",
+        headers=headers
+    )
 
-    out_path = DOWNLOAD_DIR / filename
-    reconstruct_file(list(metadata.keys()), str(out_path), input_dir=str(CHUNK_DIR))
-    return send_file(str(out_path), as_attachment=True)
+@app.route("/api/download/<filename>", methods=["GET"])
+def api_download(filename):
+    return _stream_file(filename, as_attachment=True)
 
-# 5) View in-browser
 @app.route("/api/view/<filename>", methods=["GET"])
 def api_view(filename):
-    meta_file = DFS_META / f"{filename}.json"
-    if not meta_file.exists():
-        return abort(404)
-    metadata = json.loads(meta_file.read_text())
-    for chunk_id, node in metadata.items():
-        r = requests.get(f"{node}/chunk/{chunk_id}", timeout=5)
-        r.raise_for_status()
-        (CHUNK_DIR / chunk_id).write_bytes(r.content)
-
-    out_path = DOWNLOAD_DIR / filename
-    reconstruct_file(list(metadata.keys()), str(out_path), input_dir=str(CHUNK_DIR))
-    return send_file(
-        str(out_path),
-        mimetype="application/pdf",
-        as_attachment=False,
-        download_name=filename
-    )
+    return _stream_file(filename, as_attachment=False)
 
 # 6) Snippet + metadata for hover preview
 @app.route("/api/snippet/<filename>", methods=["GET"])
@@ -180,11 +256,26 @@ def api_snippet(filename):
         "author":  entry.get("author","")
     })
 
-# 7) Delete
+# 7) Related documents ("more like this")
+@app.route("/api/related/<filename>", methods=["GET"])
+def api_related(filename):
+    related = get_related(filename)
+    return jsonify({
+        "file_name": filename,
+        "related": [{"file_name": name, "score": score} for name, score in related]
+    })
+
+# 8) DFS connection pool stats
+@app.route("/api/pool_stats", methods=["GET"])
+def api_pool_stats():
+    return jsonify(pool_stats())
+
+# 9) Delete
 @app.route("/api/delete/<filename>", methods=["DELETE"])
 def api_delete(filename):
     try:
         result = delete_file(filename)
+        FILE_CACHE.pop_matching(lambda key: key[0] == filename)
         if "error" in result:
             return jsonify(result), 500
         return jsonify(result), 200
@@ -193,5 +284,10 @@ def api_delete(filename):
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+# 10) Reconstructed-file cache stats
+@app.route("/api/cache_stats", methods=["GET"])
+def api_cache_stats():
+    return jsonify(FILE_CACHE.stats())
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=3000, debug=True)
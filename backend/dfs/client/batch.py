@@ -0,0 +1,75 @@
+# client/batch.py
+import io
+import requests
+from collections import defaultdict
+from dfs.core import transport
+from dfs.core.batch import batches, iter_frames
+
+BATCH_TIMEOUT = 30  # seconds per batch request
+
+
+def group_by_node(chunks):
+    """
+    {node_url: [chunk_id, ...]} over every replica of the chunk entries.
+    """
+    grouped = defaultdict(list)
+    for chunk in chunks:
+        for node_url in chunk["nodes"]:
+            if chunk["id"] not in grouped[node_url]:
+                grouped[node_url].append(chunk["id"])
+    return grouped
+
+
+def delete_chunks(chunks):
+    """
+    Deletes every replica of the chunk entries with one /delete_batch
+    request per node (and per MAX_BATCH ids). Chunks already gone count as
+    deleted. Returns the ids that could not be deleted.
+    """
+    failed = set()
+    for node_url, ids in group_by_node(chunks).items():
+        for batch in batches(ids):
+            try:
+                r = transport.post(f"{node_url}/delete_batch", json={"ids": batch}, timeout=BATCH_TIMEOUT)
+                r.raise_for_status()
+            except requests.RequestException as e:
+                print(f"[WARN] Batch delete of {len(batch)} chunk(s) on {node_url} failed: {e}")
+                failed.update(batch)
+    return sorted(failed)
+
+
+def fetch_chunks(node_url, chunk_ids):
+    """
+    Streams chunks from one node with /fetch_batch, yielding
+    (chunk_id, stored bytes or None) in request order.
+    """
+    for batch in batches(chunk_ids):
+        r = transport.post(f"{node_url}/fetch_batch", json={"ids": batch},
+                           stream=True, timeout=BATCH_TIMEOUT)
+        with r:
+            r.raise_for_status()
+            yield from iter_frames(r.raw.read)
+
+
+def pull_chunks(source_url, chunk_ids, checksums, put):
+    """
+    Node-to-node copy: streams `chunk_ids` from another node with
+    /fetch_batch and stores each with put(chunk_id, stream, checksum),
+    e.g. a storage engine's put. Returns (stored ids, {id: reason}).
+    """
+    stored, failed = [], {}
+    try:
+        for chunk_id, data in fetch_chunks(source_url, chunk_ids):
+            if data is None:
+                failed[chunk_id] = "not on source"
+                continue
+            try:
+                put(chunk_id, io.BytesIO(data), checksums.get(chunk_id))
+                stored.append(chunk_id)
+            except Exception as e:
+                failed[chunk_id] = str(e)
+    except (requests.RequestException, EOFError) as e:
+        for chunk_id in chunk_ids:
+            if chunk_id not in stored:
+                failed.setdefault(chunk_id, f"fetch from {source_url} failed: {e}")
+    return stored, failed
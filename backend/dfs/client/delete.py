@@ -1,7 +1,13 @@
 # backend/dfs/client/delete.py
 
-import json, requests
+import json, pickle
+import numpy as np
 from pathlib import Path
+from dfs.core.metadata import load_metadata, delete_metadata, unreferenced_chunks, all_chunks
+from dfs.client.batch import delete_chunks
+from search_engine.neighbors import remove_document
+from search_engine.dedup import remove_signature
+from search_engine.quantize import save_quantized
 
 # 1) project root
 PROJECT_ROOT  = Path(__file__).resolve().parents[3]
@@ -9,8 +15,7 @@ PROJECT_ROOT  = Path(__file__).resolve().parents[3]
 # 2) backend folder
 BACKEND_DIR   = PROJECT_ROOT / "backend"
 
-# 3) DFS metadata & chunks
-DFS_META_DIR = BACKEND_DIR / "dfs" / "metadata"
+# 3) DFS chunks
 CHUNK_DIR     = BACKEND_DIR / "dfs" / "chunks"
 
 # 4) Local download area
@@ -24,32 +29,30 @@ INDEX_DIR     = BACKEND_DIR / "search_engine" / "index"
 DOCS_FILE     = INDEX_DIR / "docs.json"
 BM25_FILE     = INDEX_DIR / "bm25_index.json"
 TFIDF_CACHE   = INDEX_DIR / "cached_tfidf_matrix.pkl"
+EMB_CACHE     = INDEX_DIR / "corpus_embeddings.pkl"
 
 def delete_file(filename: str) -> dict:
-    meta_path = DFS_META_DIR / f"{filename}.json"
-    if not meta_path.exists():
+    metadata = load_metadata(filename)
+    if metadata is None:
         raise FileNotFoundError(f"No metadata for {filename}")
 
-    metadata = json.loads(meta_path.read_text())
-
-    # 1) delete each chunk remotely
-    failed = []
-    for chunk_id, node_url in metadata.items():
-        try:
-            r = requests.delete(f"{node_url}/chunk/{chunk_id}", timeout=5)
-            if r.status_code != 200:
-                failed.append(chunk_id)
-        except Exception:
-            failed.append(chunk_id)
+    # 1) delete each chunk remotely; content-addressed chunks only once
+    #    no other file references them; erasure-coded files also lose
+    #    their parity shards
+    chunks = all_chunks(metadata)
+    if metadata.get("chunking") == "cdc":
+        chunks = unreferenced_chunks(chunks)
+    #    (one batch request per node)
+    failed = delete_chunks(chunks)
     if failed:
         return {"error":"couldn't delete chunks","failed":failed}
 
-    # 2) remove metadata file
-    meta_path.unlink(missing_ok=True)
+    # 2) remove metadata, dropping its chunk references in the same step
+    delete_metadata(filename)
 
     # 3) cleanup local chunk files
-    for chunk_id in metadata:
-        (CHUNK_DIR / chunk_id).unlink(missing_ok=True)
+    for chunk in metadata["chunks"]:
+        (CHUNK_DIR / chunk["id"]).unlink(missing_ok=True)
 
     # 4) remove reconstructed download
     (DOWNLOAD_DIR / filename).unlink(missing_ok=True)
@@ -57,7 +60,7 @@ def delete_file(filename: str) -> dict:
     # 5) remove original upload if present
     #(INPUT_DIR / filename).unlink(missing_ok=True)
 
-    # 6) update search index (docs.json & bm25_index.json)
+    # 6) update search index (docs.json, bm25_index.json, embeddings)
     try:
         docs = json.loads(DOCS_FILE.read_text())
         bm25 = json.loads(BM25_FILE.read_text()).get("corpus", [])
@@ -68,7 +71,25 @@ def delete_file(filename: str) -> dict:
             bm25.pop(idx)
             DOCS_FILE.write_text(json.dumps(docs, indent=2))
             BM25_FILE.write_text(json.dumps({"corpus":bm25}, indent=2))
+
+            # keep the embedding rows aligned with docs.json
+            embeddings = None
+            if EMB_CACHE.exists():
+                embeddings = pickle.loads(EMB_CACHE.read_bytes())
+                if len(embeddings) == len(docs) + 1:
+                    embeddings = np.delete(embeddings, idx, axis=0)
+                    EMB_CACHE.write_bytes(pickle.dumps(embeddings))
+                    save_quantized(embeddings)
+                else:
+                    embeddings = None
+
             TFIDF_CACHE.unlink(missing_ok=True)
+
+            # 7) drop it from the related-documents graph
+            remove_document(filename, docs, embeddings)
+
+        # 8) forget its near-duplicate signature
+        remove_signature(filename)
     except Exception as e:
         return {"warning":f"Index cleanup failed: {e}"}
 
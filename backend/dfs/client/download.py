@@ -1,22 +1,35 @@
 # client/download.py
 import os
 import sys
-import json
+import time
 import hashlib
-import re
+import threading
 import requests
-from dfs.core.chunker import reconstruct_file
+from collections import deque, defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dfs.core.metadata import load_metadata, all_chunks
+from dfs.core.ranges import chunk_slices
+from dfs.core.erasure import decode
+from dfs.core.codec import decoder, DecodeError
+from dfs.core import transport
+from dfs.client.batch import fetch_chunks
+from dfs.client.locate import locate_nodes
 
 # Base paths
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 METADATA_DIR = os.path.join(BASE_DIR, "metadata")
-CHUNK_DIR = os.path.join(BASE_DIR, "chunks")
 OUTPUT_DIR = os.path.join(BASE_DIR, "tests", "output_files")
 INPUT_DIR = os.path.join(BASE_DIR, "tests", "input_files")
 
-# Ensure dirs exist
-os.makedirs(CHUNK_DIR, exist_ok=True)
-os.makedirs(OUTPUT_DIR, exist_ok=True)
+FETCH_WINDOW = int(os.getenv("DFS_FETCH_WINDOW", "4"))  # chunks fetched ahead of the writer
+FETCH_TIMEOUT = 30                                      # seconds per chunk GET
+LATENCY_ALPHA = 0.3                                     # EWMA weight of the newest sample
+FAILURE_PENALTY = 60.0                                  # seconds charged to a failed replica
+READ_BLOCK_SIZE = 256 * 1024                            # bytes hashed per step while receiving
+
+# node_url → EWMA of observed fetch latency in seconds
+NODE_LATENCY = {}
+_latency_lock = threading.Lock()
 
 def calculate_sha256(file_path):
     hasher = hashlib.sha256()
@@ -28,38 +41,278 @@ def calculate_sha256(file_path):
     except FileNotFoundError:
         return None
 
-def extract_chunk_number(name):
-    match = re.search(r"_chunk(\d+)$", name)
-    return int(match.group(1)) if match else -1
+class ChecksumMismatch(requests.RequestException):
+    """
+    A replica returned bytes that do not match the chunk's recorded sha256.
+    """
 
-def download_and_reconstruct(file_basename):
-    metadata_file = os.path.join(METADATA_DIR, f"{file_basename}.json")
-    if not os.path.exists(metadata_file):
-        print(f"[ERROR] Metadata not found for {file_basename}")
-        return
+def record_latency(node_url, seconds):
+    with _latency_lock:
+        prev = NODE_LATENCY.get(node_url)
+        NODE_LATENCY[node_url] = seconds if prev is None else (
+            LATENCY_ALPHA * seconds + (1 - LATENCY_ALPHA) * prev)
 
-    with open(metadata_file, "r") as f:
-        metadata = json.load(f)
+def order_replicas(nodes):
+    """
+    Replicas fastest first by observed latency; nodes never measured go
+    first so their latency gets learned.
+    """
+    return sorted(nodes, key=lambda n: NODE_LATENCY.get(n, 0.0))
 
-    # Sort chunks using safe numeric key
-    chunk_names = sorted(metadata.keys(), key=extract_chunk_number)
+def _candidates(nodes, chunk_id):
+    """
+    The recorded replicas fastest first, then (with DFS_PLACEMENT=ring)
+    the nodes the hash ring puts the chunk on, in case metadata is stale.
+    Ring locations are only computed once every recorded replica failed.
+    """
+    yield from order_replicas(nodes)
+    for node_url in locate_nodes(chunk_id, replicas=len(nodes) or 1):
+        if node_url not in nodes:
+            yield node_url
 
-    for chunk_id in chunk_names:
-        node_url = metadata[chunk_id]
-        chunk_path = os.path.join(CHUNK_DIR, chunk_id)
+def _decode_blocks(blocks, checksum=None, codec=None, source="node"):
+    """
+    Hashes stored chunk bytes block by block as they arrive and decodes
+    them with the chunk's codec. Raises ChecksumMismatch if they do not
+    match `checksum` or cannot be decoded.
+    """
+    hasher = hashlib.sha256() if checksum else None
+    dec = decoder(codec)
+    out = []
+    try:
+        for block in blocks:
+            if hasher:
+                hasher.update(block)
+            out.append(dec.decompress(block))
+        out.append(dec.flush())
+    except DecodeError as e:
+        raise ChecksumMismatch(f"undecodable {codec} data from {source}: {e}")
+    if hasher and hasher.hexdigest() != checksum:
+        raise ChecksumMismatch(f"sha256 mismatch from {source}")
+    return b"".join(out)
+
+def _read_decoded(response, checksum=None, codec=None):
+    return _decode_blocks(response.iter_content(READ_BLOCK_SIZE), checksum, codec, response.url)
+
+def fetch_chunk(nodes, chunk_id, lo=None, hi=None, checksum=None, codec=None):
+    """
+    GETs a chunk, or only bytes lo..hi (inclusive) of it when given, from
+    the fastest replica, falling back to the others on failure.
+
+    Whole chunks are verified against `checksum` (hex sha256 of the stored
+    bytes) while they stream in; a corrupt replica counts as failed and
+    the next one is tried. Compressed chunks (`codec` other than "raw")
+    are always fetched whole, decoded as they arrive, then sliced. Partial
+    reads of raw chunks cannot be verified against a whole-chunk hash and
+    are returned as served.
+    """
+    if isinstance(nodes, str):
+        nodes = [nodes]
+    compressed = codec not in (None, "raw")
+    headers = {"Range": f"bytes={lo}-{hi}"} if lo is not None and not compressed else {}
+    error = None
+    for node_url in _candidates(nodes, chunk_id):
+        start = time.monotonic()
         try:
-            r = requests.get(f"{node_url}/chunk/{chunk_id}", timeout=5)
+            r = transport.get(f"{node_url}/chunk/{chunk_id}", headers=headers,
+                             timeout=FETCH_TIMEOUT, stream=True)
             r.raise_for_status()
-            with open(chunk_path, "wb") as out_file:
-                out_file.write(r.content)
-            print(f"[OK] Downloaded {chunk_id} from {node_url}")
+            whole = not headers or r.status_code == 200
+            data = _read_decoded(r, checksum, codec) if whole else r.content
+        except requests.RequestException as e:
+            if isinstance(e, ChecksumMismatch):
+                print(f"[WARN] Corrupt replica of {chunk_id} on {node_url}, trying another")
+            record_latency(node_url, FAILURE_PENALTY)
+            error = e
+            continue
+        record_latency(node_url, time.monotonic() - start)
+        if lo is not None and whole:
+            # whole chunk fetched (compressed, or the node ignored Range)
+            return data[lo:hi + 1]
+        return data
+    raise error or requests.RequestException(f"No replicas for {chunk_id}")
+
+def reconstruct_chunk(metadata, chunk):
+    """
+    Degraded read of an erasure-coded chunk: fetches the other shards of
+    its stripe in parallel and decodes the chunk from the first k to arrive.
+    """
+    k, m = metadata["ec"]["k"], metadata["ec"]["m"]
+    stripe = metadata["stripes"][chunk["stripe"]]
+    shard_size = stripe["shard_size"]
+    by_id = {c["id"]: c for c in metadata["chunks"]}
+
+    # stripes shorter than k chunks are padded with implicit zero shards
+    shards = {i: bytes(shard_size) for i in range(len(stripe["data"]), k)}
+    others = [(i, by_id[cid]) for i, cid in enumerate(stripe["data"]) if cid != chunk["id"]]
+    others += [(k + j, p) for j, p in enumerate(stripe["parity"])]
+
+    pool = ThreadPoolExecutor(max_workers=len(others))
+    try:
+        futures = {pool.submit(fetch_chunk, entry["nodes"], entry["id"], checksum=entry.get("sha256")): i for i, entry in others}
+        for future in as_completed(futures):
+            try:
+                shards[futures[future]] = future.result().ljust(shard_size, b"\0")
+            except requests.RequestException:
+                continue
+            if len(shards) >= k:
+                break
+    finally:
+        # stragglers are not needed once k shards are in
+        pool.shutdown(wait=False, cancel_futures=True)
+    if len(shards) < k:
+        raise requests.RequestException(
+            f"Cannot reconstruct {chunk['id']}: only {len(shards)}/{k} shards reachable")
+    index = stripe["data"].index(chunk["id"])
+    data = decode(shards, k, m)[index][:chunk["size"]]
+    if chunk.get("sha256") and hashlib.sha256(data).hexdigest() != chunk["sha256"]:
+        raise ChecksumMismatch(f"Reconstructed {chunk['id']} does not match its sha256")
+    return data
+
+def _new_replicas(metadata, chunk):
+    """
+    Replicas the metadata lists for `chunk` now that `metadata`, loaded
+    when the read started, does not: copies made since by re-replication
+    after a node failure, or by the rebalancer.
+    """
+    current = load_metadata(metadata["file_name"]) if metadata.get("file_name") else None
+    for entry in all_chunks(current) if current else []:
+        if entry["id"] == chunk["id"]:
+            return [n for n in entry["nodes"] if n not in chunk["nodes"]]
+    return []
+
+def fetch_part(metadata, chunk, lo=None, hi=None):
+    """
+    fetch_chunk for a chunk of `metadata`. When every known replica
+    fails, replicas recorded since `metadata` was loaded are tried, then
+    erasure-coded chunks are reconstructed from parity.
+    """
+    args = (chunk["id"], lo, hi, chunk.get("sha256"), chunk.get("codec"))
+    try:
+        return fetch_chunk(chunk["nodes"], *args)
+    except requests.RequestException as e:
+        error = e
+    new_nodes = _new_replicas(metadata, chunk)
+    if new_nodes:
+        try:
+            return fetch_chunk(new_nodes, *args)
         except requests.RequestException as e:
-            print(f"[ERROR] Failed to download {chunk_id} from {node_url}: {e}")
-            return
+            error = e
+    if "stripe" not in chunk:
+        raise error
+    print(f"[WARN] {chunk['id']} unavailable ({error}), reconstructing from parity")
+    data = reconstruct_chunk(metadata, chunk)
+    return data if lo is None else data[lo:hi + 1]
 
+def iter_file_chunks(metadata, window=FETCH_WINDOW, byte_range=None):
+    """
+    Yields a file's chunk bytes in order. Up to `window` chunks are fetched
+    in parallel; each is yielded as soon as it and all chunks before it
+    have arrived, so nothing is staged on disk and memory stays bounded by
+    the window.
+
+    With `byte_range` (start, end inclusive) only the chunks covering that
+    range are fetched, each trimmed to the requested bytes. Missing chunks
+    of erasure-coded files are rebuilt from their stripe (degraded read).
+    """
+    if byte_range is None:
+        parts = [(c, None, None) for c in metadata["chunks"]]
+    else:
+        parts = [
+            (c, lo, hi) if (lo, hi) != (0, c["size"] - 1) else (c, None, None)
+            for c, lo, hi in chunk_slices(metadata["chunks"], *byte_range)
+        ]
+    parts = iter(parts)
+    pool = ThreadPoolExecutor(max_workers=window)
+    pending = deque()
+
+    def submit(part):
+        chunk, lo, hi = part
+        pending.append(pool.submit(fetch_part, metadata, chunk, lo, hi))
+
+    try:
+        for part in parts:
+            submit(part)
+            if len(pending) >= window:
+                break
+        while pending:
+            data = pending.popleft().result()
+            part = next(parts, None)
+            if part is not None:
+                submit(part)
+            yield data
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+def download_batched(metadata, out_file):
+    """
+    Writes a whole file into `out_file` with one /fetch_batch stream per
+    node instead of one GET per chunk: each chunk is assigned to its
+    fastest replica, nodes are read in parallel and chunks are written at
+    their offsets as they arrive. Chunks a node could not deliver (missing
+    or corrupt) are then fetched one by one with replica failover.
+    """
+    plan = defaultdict(list)
+    for chunk in metadata["chunks"]:
+        plan[order_replicas(chunk["nodes"])[0]].append(chunk)
+    out_file.truncate(metadata["size"])
+    write_lock = threading.Lock()
+
+    def pull(node_url, chunks):
+        by_id = defaultdict(list)  # repeated content-addressed chunks share an id
+        for chunk in chunks:
+            by_id[chunk["id"]].append(chunk)
+        missed = dict(by_id)
+        start = time.monotonic()
+        try:
+            for chunk_id, stored in fetch_chunks(node_url, list(by_id)):
+                if stored is None or chunk_id not in missed:
+                    continue
+                first = by_id[chunk_id][0]
+                try:
+                    data = _decode_blocks([stored], first.get("sha256"), first.get("codec"), node_url)
+                except ChecksumMismatch as e:
+                    print(f"[WARN] Corrupt replica of {chunk_id}: {e}")
+                    continue
+                with write_lock:
+                    for chunk in by_id[chunk_id]:
+                        out_file.seek(chunk["offset"])
+                        out_file.write(data)
+                del missed[chunk_id]
+            record_latency(node_url, (time.monotonic() - start) / len(by_id))
+        except (requests.RequestException, EOFError) as e:
+            print(f"[WARN] Batch fetch from {node_url} failed: {e}")
+            record_latency(node_url, FAILURE_PENALTY)
+        return [chunk for entries in missed.values() for chunk in entries]
+
+    with ThreadPoolExecutor(max_workers=max(1, min(len(plan), FETCH_WINDOW))) as pool:
+        leftovers = [c for missed in pool.map(lambda item: pull(*item), plan.items()) for c in missed]
+    for chunk in leftovers:
+        data = fetch_part(metadata, chunk)
+        out_file.seek(chunk["offset"])
+        out_file.write(data)
+
+def download_and_reconstruct(file_basename):
+    metadata = load_metadata(file_basename)
+    if metadata is None:
+        print(f"[ERROR] Metadata not found for {file_basename}")
+        return
+
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
     name, ext = os.path.splitext(file_basename)
     output_path = os.path.join(OUTPUT_DIR, f"{name}_reconstructed{ext}")
-    reconstruct_file(chunk_names, output_path)
+    try:
+        with open(output_path, "wb") as out_file:
+            if metadata["size"] is None:
+                # legacy metadata without offsets: fetch in order
+                for data in iter_file_chunks(metadata):
+                    out_file.write(data)
+            else:
+                download_batched(metadata, out_file)
+    except requests.RequestException as e:
+        print(f"[ERROR] Failed to download {file_basename}: {e}")
+        os.remove(output_path)
+        return
 
     # Verify integrity
     original_path = os.path.join(INPUT_DIR, file_basename)
@@ -0,0 +1,52 @@
+import os
+import time
+import threading
+from dfs.core import transport
+from dfs.core.hash_ring import Topology
+from dfs.core.placement import MODE as PLACEMENT_MODE
+
+# Computes chunk locations on the client from the global balancer's ring
+# membership (/ring), the same walk the balancers do on upload with
+# DFS_PLACEMENT=ring. Membership is fetched once per RING_TTL seconds, so
+# locating a chunk costs no request at all.
+
+LOAD_BALANCER_URL = "http://localhost:6001"
+RING_TTL = 30  # seconds the fetched membership is trusted
+
+_lock = threading.Lock()
+_cached = (0, None)  # (fetched at, Topology)
+
+
+def topology():
+    """
+    The current Topology, or None if the ring is unreachable.
+    """
+    global _cached
+    with _lock:
+        fetched, topo = _cached
+        if topo is not None and time.time() - fetched < RING_TTL:
+            return topo
+        try:
+            r = transport.get(f"{LOAD_BALANCER_URL}/ring", timeout=5)
+            r.raise_for_status()
+            topo = Topology(r.json())
+        except Exception as e:
+            print(f"[WARN] Could not fetch ring from {LOAD_BALANCER_URL}: {e}")
+        _cached = (time.time(), topo)
+        return topo
+
+
+def locate_nodes(chunk_id, replicas=1):
+    """
+    Node urls that should hold `chunk_id`: each replica's preference list
+    in turn, without repeats. Empty unless ring placement is enabled.
+    """
+    if PLACEMENT_MODE != "ring":
+        return []
+    topo = topology()
+    if topo is None:
+        return []
+    nodes = []
+    for placement in topo.locate(chunk_id, replicas):
+        nodes += [n for n in placement["nodes"] if n not in nodes]
+    return nodes
@@ -1,55 +1,364 @@
+import io
 import os
 import sys
 import json
+import time
+import hashlib
 import requests
-from dfs.core.chunker import split_file
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dfs.core.chunker import FileSlice, iter_chunk_ranges, iter_cdc_ranges, sha256_range
+from dfs.core.metadata import build_metadata, commit_metadata, lookup_chunks
+from dfs.core.erasure import encode
+from dfs.core import codec as chunk_codec
+from dfs.core import transport
+from dfs.core.batch import batches
+from dfs.client.batch import delete_chunks
 
 # Configuration
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
-CHUNK_DIR = os.path.join(BASE_DIR, "chunks")
 METADATA_DIR = os.path.join(BASE_DIR, "metadata")
 INPUT_DIR = os.path.join(BASE_DIR, "input_files")
 LOAD_BALANCER_URL = "http://localhost:6001"
 
+MAX_IN_FLIGHT = int(os.getenv("DFS_UPLOAD_CONCURRENCY", "4"))  # chunks uploading at once
+MAX_RETRIES = 3                                                # attempts per chunk
+RETRY_BACKOFF = 0.5                                            # seconds, doubled per retry
+UPLOAD_TIMEOUT = 30                                            # seconds per chunk POST
+CHUNKING = os.getenv("DFS_CHUNKING", "fixed")                  # "fixed" 1MB or "cdc" content-defined
+REPLICATION = int(os.getenv("DFS_REPLICATION", "1"))           # copies of every chunk
+STORAGE = os.getenv("DFS_STORAGE", "replicated")               # "replicated" or "ec" (erasure coded)
+EC_DATA = int(os.getenv("DFS_EC_DATA", "4"))                   # data chunks per stripe
+EC_PARITY = int(os.getenv("DFS_EC_PARITY", "2"))               # parity shards per stripe
+UPLOAD_PATH = os.getenv("DFS_UPLOAD_PATH", "direct")           # "direct" to the nodes or through the "balancer"
+
 # Ensure required directories exist
-os.makedirs(CHUNK_DIR, exist_ok=True)
 os.makedirs(METADATA_DIR, exist_ok=True)
 
-def upload_file(file_path):
+
+def _post_chunk(chunk_name, open_body, checksum, replication=1, exclude=(), retries=MAX_RETRIES, file_id=None):
+    """
+    POSTs one chunk to the global balancer, retrying with exponential
+    backoff. `open_body` returns a fresh file object for each attempt;
+    every node verifies the bytes against `checksum` (hex sha256), so a
+    chunk corrupted in transit is rejected and sent again. `exclude` lists
+    nodes the chunk must not be placed on; `file_id` lets the balancers
+    stripe one file's chunks across distinct nodes. Returns the balancer's
+    JSON response.
+    """
+    for attempt in range(1, retries + 1):
+        try:
+            with open_body() as chunk_file:
+                response = transport.post(
+                    f"{LOAD_BALANCER_URL}/upload_chunk",
+                    files={"chunk": (chunk_name, chunk_file)},
+                    data={
+                        "chunk_id":      chunk_name,
+                        "checksum":      checksum,
+                        "replicas":      replication,
+                        "exclude_nodes": json.dumps(list(exclude)),
+                        "file_id":       file_id or ""
+                    },
+                    timeout=UPLOAD_TIMEOUT * replication
+                )
+            response.raise_for_status()
+            return response.json()
+        except requests.exceptions.RequestException as e:
+            if attempt == retries:
+                raise
+            delay = RETRY_BACKOFF * 2 ** (attempt - 1)
+            print(f"[RETRY] {chunk_name} attempt {attempt} failed ({e}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def _place_chunks(chunk_names, replication=1, file_id=None):
+    """
+    Asks the global balancer where each chunk goes, in batches, for a
+    direct upload. Returns {chunk name: {"cluster", "nodes", "tokens"}};
+    chunks it could not place are left out and go through the balancer.
+    """
+    placements = {}
+    for group in batches(chunk_names):
+        try:
+            r = transport.post(f"{LOAD_BALANCER_URL}/place", json={
+                "chunks":   group,
+                "replicas": replication,
+                "file_id":  file_id or ""
+            }, timeout=UPLOAD_TIMEOUT)
+            r.raise_for_status()
+            placements.update({n: p for n, p in r.json()["placements"].items() if p["nodes"]})
+        except (requests.exceptions.RequestException, KeyError, ValueError) as e:
+            print(f"[WARN] Placement of {len(group)} chunk(s) failed ({e}), using the balancer path")
+    return placements
+
+
+def _store_direct(chunk_name, open_body, checksum, placement):
+    """
+    Writes one chunk straight to each node in `placement`, with the
+    node's placement token. Returns the nodes that stored it.
+    """
+    stored = []
+    for node in placement["nodes"]:
+        try:
+            with open_body() as chunk_file:
+                r = transport.post(
+                    f"{node}/store",
+                    files={"chunk": (chunk_name, chunk_file)},
+                    data={
+                        "chunk_id": chunk_name,
+                        "checksum": checksum,
+                        "token":    placement["tokens"].get(node) or ""
+                    },
+                    timeout=UPLOAD_TIMEOUT
+                )
+            r.raise_for_status()
+            stored.append(node)
+        except requests.exceptions.RequestException as e:
+            print(f"[WARN] Direct write of {chunk_name} to {node} failed: {e}")
+    return stored
+
+
+def _upload_chunk(file_path, chunk_name, offset, length, replication=1, checksum=None,
+                  compression=chunk_codec.COMPRESSION, placement=None):
+    """
+    Uploads one chunk from its byte range in the source file.
+
+    A sample of the chunk picks its codec: compressible chunks are zlib
+    encoded in memory and sent (and stored) compressed; the rest stream
+    straight from the file. The sha256 is of the bytes as stored, hashed
+    from the file range first for raw chunks unless given (content-addressed
+    chunks already carry it). Returns the balancer's response plus
+    "sha256", "codec" and "stored_size".
+
+    With a `placement` from /place the chunk is written to those nodes
+    directly; if none of them takes it, it goes through the balancer.
+    """
+    with FileSlice(file_path, offset, min(length, chunk_codec.SAMPLE_SIZE)) as sample:
+        codec = chunk_codec.choose_codec(sample.read(), compression)
+    if codec == "raw":
+        checksum = checksum or sha256_range(file_path, offset, length)
+        stored_size = length
+        open_body = lambda: FileSlice(file_path, offset, length, name=chunk_name)
+    else:
+        with FileSlice(file_path, offset, length) as src:
+            body = chunk_codec.encode(src.read(), codec)
+        checksum = hashlib.sha256(body).hexdigest()
+        stored_size = len(body)
+        open_body = lambda: io.BytesIO(body)
+    nodes = _store_direct(chunk_name, open_body, checksum, placement) if placement else []
+    if nodes:
+        result = {"cluster": placement["cluster"], "node": nodes[0], "nodes": nodes}
+    else:
+        result = _post_chunk(chunk_name, open_body, checksum, replication,
+                             file_id=os.path.basename(file_path))
+    return {**result, "sha256": checksum, "codec": codec, "stored_size": stored_size}
+
+
+def _place_shard(chunk_name, body, checksum, used, file_id=None):
+    """
+    Stores one shard of a stripe on a node the stripe does not use yet, so
+    a single node failure costs at most one shard. Falls back to any node
+    when every node already holds a shard of the stripe.
+    """
+    try:
+        result = _post_chunk(chunk_name, lambda: io.BytesIO(body), checksum, exclude=used, retries=1,
+                             file_id=file_id)
+    except requests.exceptions.HTTPError as e:
+        if not used or e.response is None or e.response.status_code != 503:
+            raise
+        print(f"[WARN] No unused node left for {chunk_name}, sharing a node within its stripe")
+        result = _post_chunk(chunk_name, lambda: io.BytesIO(body), checksum, file_id=file_id)
+    return result.get('nodes') or [result['node']]
+
+
+def _upload_stripe(file_path, index, stripe, k, m):
+    """
+    Uploads one erasure-coded stripe: up to k data chunks and m parity
+    shards computed from them (short chunks zero-padded to the stripe's
+    shard size). Shards are stored uncompressed, since decoding works on
+    the raw bytes. On failure the stripe's stored shards are rolled back.
+    """
+    data = []
+    for name, offset, length in stripe:
+        with FileSlice(file_path, offset, length) as chunk_file:
+            data.append(chunk_file.read())
+    shard_size = max(len(d) for d in data)
+    padded = [d.ljust(shard_size, b"\0") for d in data]
+    padded += [bytes(shard_size)] * (k - len(padded))
+    parity_names = [f"{os.path.basename(file_path)}_stripe{index:05d}_parity{j}" for j in range(m)]
+    shards = [(name, d) for (name, _, _), d in zip(stripe, data)]
+    shards += list(zip(parity_names, encode(padded, m)))
+
+    checksums = {name: hashlib.sha256(body).hexdigest() for name, body in shards}
+    placed, used = {}, []
+    try:
+        for name, body in shards:
+            placed[name] = _place_shard(name, body, checksums[name], used, os.path.basename(file_path))
+            used.extend(placed[name])
+    except Exception:
+        _rollback(placed)
+        raise
+    return {
+        "placed":     placed,
+        "checksums":  checksums,
+        "shard_size": shard_size,
+        "data":       [name for name, _, _ in stripe],
+        "parity":     [
+            {"id": p, "nodes": placed[p], "size": shard_size, "sha256": checksums[p]}
+            for p in parity_names
+        ]
+    }
+
+
+def _rollback(placed):
+    """
+    Deletes chunks that were stored before the upload failed, so a failed
+    upload leaves nothing behind on the nodes (one batch request per node).
+    """
+    failed = delete_chunks([{"id": name, "nodes": nodes} for name, nodes in placed.items()])
+    if failed:
+        print(f"[WARN] Could not roll back {len(failed)} chunk(s): {', '.join(failed)}")
+
+
+def upload_file(file_path, max_in_flight=MAX_IN_FLIGHT, chunking=CHUNKING, replication=REPLICATION,
+                storage=STORAGE, ec_data=EC_DATA, ec_parity=EC_PARITY, compression=chunk_codec.COMPRESSION):
+    """
+    Uploads a file's chunks concurrently, with at most
+    `max_in_flight` requests outstanding. Metadata is only written once
+    every chunk is stored; on failure the stored chunks are deleted.
+    Returns the metadata, or None on failure.
+
+    With chunking="cdc" chunk boundaries follow the content and chunk ids
+    are content hashes: chunks already stored for another file are only
+    referenced, not uploaded again.
+
+    Every chunk's sha256 is recorded in the metadata; nodes verify it
+    when storing and clients when reading. With compression="auto"
+    compressible chunks are stored zlib encoded and their "codec" is
+    recorded, so clients decode them while streaming.
+
+    Each chunk is stored on `replication` nodes, in distinct clusters
+    where possible. With DFS_UPLOAD_PATH=direct the balancers only choose
+    the nodes, in one /place call per batch of chunks, and the chunk
+    bytes go straight to the nodes. With storage="ec" chunks are instead grouped into
+    stripes of `ec_data` chunks plus `ec_parity` Reed-Solomon parity
+    shards spread over distinct nodes: any `ec_parity` shards of a stripe
+    can be lost, at a storage overhead of (k + m) / k instead of R.
+    """
     if not os.path.exists(file_path):
         print(f"[ERROR] File not found: {file_path}")
         return
 
-    print(f"[INFO] Splitting file: {file_path}")
-    chunk_files = split_file(file_path, output_dir=CHUNK_DIR)
+    if storage == "ec" and chunking == "cdc":
+        print("[WARN] Erasure coding uses fixed-size chunks; ignoring cdc chunking")
+        chunking = "fixed"
+    mode = f"{chunking} chunking" + (f", RS({ec_data},{ec_parity})" if storage == "ec" else "")
+    print(f"[INFO] Uploading file: {file_path} ({mode})")
+    if chunking == "cdc":
+        ranges = list(iter_cdc_ranges(file_path))
+    else:
+        ranges = list(iter_chunk_ranges(file_path))
+    chunk_files = [name for name, _, _ in ranges]
+    sizes = {name: length for name, _, length in ranges}
+
+    existing = lookup_chunks(set(chunk_files)) if chunking == "cdc" else {}
+    to_upload, seen = [], set(existing)
+    for name, offset, length in ranges:
+        if name not in seen:
+            seen.add(name)
+            to_upload.append((name, offset, length))
+    if existing:
+        print(f"[INFO] {len(existing)} chunk(s) already stored, uploading {len(to_upload)}")
 
     file_name = os.path.basename(file_path)
-    metadata = {}
+    placed = {}
+    stripes = {}
+    stored = {}   # chunk name → {"sha256", "codec", "stored_size"}
+    failed = None
 
-    for chunk_name in chunk_files:
-        chunk_path = os.path.join(CHUNK_DIR, chunk_name)
+    placements = {}
+    if storage != "ec" and UPLOAD_PATH == "direct" and to_upload:
+        placements = _place_chunks([name for name, _, _ in to_upload], replication, file_name)
 
-        try:
-            with open(chunk_path, "rb") as chunk_file:
-                response = requests.post(
-                    f"{LOAD_BALANCER_URL}/upload_chunk",
-                    files={"chunk": chunk_file},
-                    data={"chunk_id": chunk_name},
-                    timeout=5
-                )
-                response.raise_for_status()
-                result = response.json()
-                print(f"[OK] Uploaded {chunk_name} → {result['cluster']} / {result['node']}")
-                metadata[chunk_name] = result['node']
-        except requests.exceptions.RequestException as e:
-            print(f"[FAIL] Upload failed for {chunk_name}: {e}")
-            return
+    with ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+        if storage == "ec":
+            futures = {
+                pool.submit(_upload_stripe, file_path, i, to_upload[start:start + ec_data],
+                            ec_data, ec_parity): i
+                for i, start in enumerate(range(0, len(to_upload), ec_data))
+            }
+        else:
+            futures = {
+                pool.submit(_upload_chunk, file_path, name, offset, length, replication,
+                            # content-addressed ids are "sha256-<hex>" of the chunk already
+                            name.split("-", 1)[1] if chunking == "cdc" else None,
+                            compression, placements.get(name)): name
+                for name, offset, length in to_upload
+            }
+        for future in as_completed(futures):
+            label = futures[future]
+            if future.cancelled():
+                continue
+            try:
+                result = future.result()
+                if storage == "ec":
+                    stripes[label] = result
+                    placed.update(result["placed"])
+                    for name, checksum in result["checksums"].items():
+                        stored[name] = {"sha256": checksum, "codec": "raw"}
+                    print(f"[OK] Uploaded stripe {label} ({len(result['placed'])} shards)")
+                    continue
+                nodes = result.get('nodes') or [result['node']]
+                placed[label] = nodes
+                stored[label] = {k: result[k] for k in ("sha256", "codec", "stored_size")}
+                print(f"[OK] Uploaded {label} → {result['cluster']} / {', '.join(nodes)}")
+                if len(nodes) < replication:
+                    print(f"[WARN] {label} has {len(nodes)}/{replication} replicas")
+            except Exception as e:
+                print(f"[FAIL] Upload failed for {label}: {e}")
+                if failed is None:
+                    failed = label
+                    # stop queued chunks; in-flight ones finish and get rolled back
+                    for pending in futures:
+                        pending.cancel()
+
+    if failed is not None:
+        _rollback(placed)
+        print(f"[ERROR] Upload of {file_name} aborted, {len(placed)} stored chunk(s) rolled back.")
+        return
 
-    metadata_path = os.path.join(METADATA_DIR, f"{file_name}.json")
-    with open(metadata_path, "w") as f:
-        json.dump(metadata, f, indent=2)
+    # commit metadata in chunk order, atomically; sizes/offsets let readers
+    # map byte ranges onto chunks
+    stored.update(existing)
+    for name, nodes in placed.items():
+        stored[name]["nodes"] = nodes
+    chunks = [
+        {"id": name, "size": sizes[name], "stored_size": sizes[name], **stored[name]}
+        for name in chunk_files
+    ]
+    extra = {}
+    if storage == "ec":
+        for i, chunk in enumerate(chunks):
+            chunk["stripe"] = i // ec_data
+        extra = {
+            "storage": "ec",
+            "ec":      {"k": ec_data, "m": ec_parity},
+            "stripes": [
+                {k: stripes[i][k] for k in ("shard_size", "data", "parity")}
+                for i in range(len(stripes))
+            ]
+        }
+    metadata = build_metadata(file_name, chunks, chunking=chunking, **extra)
+    # content-addressed chunks are referenced in the same commit, and a
+    # previous upload under this name releases its own
+    metadata_path, unreferenced = commit_metadata(file_name, metadata, acquire=chunking == "cdc", replace=True)
+    if unreferenced:
+        failed = delete_chunks(unreferenced)
+        print(f"[INFO] Deleted {len(unreferenced) - len(failed)} chunk(s) only the previous version used")
+        if failed:
+            print(f"[WARN] Could not delete {len(failed)} old chunk(s): {', '.join(failed)}")
 
     print(f"\n[SUCCESS] File uploaded. Metadata saved at: {metadata_path}")
+    return metadata
 
 if __name__ == "__main__":
     if len(sys.argv) < 2:
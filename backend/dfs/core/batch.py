@@ -0,0 +1,47 @@
+import struct
+
+# Length-prefixed stream used by a node's /fetch_batch. Per requested chunk:
+#   uint16 id length | id (utf-8) | int64 data length (-1: not stored) | data
+# Frames come in request order, so a client can read them one at a time.
+
+MAX_BATCH = 256  # chunk ids per batch request
+
+_ID_LEN = struct.Struct(">H")
+_DATA_LEN = struct.Struct(">q")
+
+
+def frame_header(chunk_id, length):
+    raw_id = chunk_id.encode("utf-8")
+    return _ID_LEN.pack(len(raw_id)) + raw_id + _DATA_LEN.pack(length)
+
+
+def _read_exact(read, n):
+    buf = bytearray()
+    while len(buf) < n:
+        block = read(n - len(buf))
+        if not block:
+            raise EOFError(f"batch stream ended {n - len(buf)} bytes early")
+        buf += block
+    return bytes(buf)
+
+
+def iter_frames(read):
+    """
+    Parses a batch stream from `read(n)`, yielding (chunk_id, data) with
+    data None for chunks the node does not have.
+    """
+    while True:
+        head = read(_ID_LEN.size)
+        if not head:
+            return
+        if len(head) < _ID_LEN.size:
+            head += _read_exact(read, _ID_LEN.size - len(head))
+        (id_len,) = _ID_LEN.unpack(head)
+        chunk_id = _read_exact(read, id_len).decode("utf-8")
+        (length,) = _DATA_LEN.unpack(_read_exact(read, _DATA_LEN.size))
+        yield chunk_id, (None if length < 0 else _read_exact(read, length))
+
+
+def batches(items, size=MAX_BATCH):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
@@ -0,0 +1,122 @@
+import threading
+from collections import OrderedDict
+
+# In-memory caches bounded by bytes, shared by the storage nodes (hot
+# chunks) and the web app (reconstructed files).
+#
+# A key is only worth caching once it has been asked for twice: admit()
+# remembers recent misses, so one-off reads (a rebalance pull, a single
+# download) stream past without pushing hot entries out.
+
+REMEMBER = 4096  # recent misses remembered for admission
+
+
+class LRUCache:
+    """
+    Least-recently-used cache of byte strings, holding at most `capacity`
+    bytes; values larger than `max_item` (default a quarter of the
+    capacity) are never cached. A capacity of 0 disables it. Thread-safe.
+    """
+
+    def __init__(self, capacity, max_item=None, remember=REMEMBER):
+        self.capacity = capacity
+        self.max_item = capacity // 4 if max_item is None else max_item
+        self.remember = remember
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key → value, least recently used first
+        self._seen = OrderedDict()     # recent misses, for admit()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0         # bumped by pop(); see put(since=...)
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def admit(self, key):
+        """
+        True if `key` missed recently too and should be cached now;
+        otherwise remembers this miss and returns False.
+        """
+        if not self.capacity:
+            return False
+        with self._lock:
+            if self._seen.pop(key, None) is not None:
+                return True
+            self._seen[key] = True
+            if len(self._seen) > self.remember:
+                self._seen.popitem(last=False)
+            return False
+
+    def put(self, key, value, since=None):
+        """
+        Caches `value`, evicting the least recently used entries to make
+        room. With `since` (the `invalidations` count read before the value
+        was loaded) nothing is cached if an entry was invalidated since,
+        so a load racing a write or delete cannot cache stale bytes.
+        """
+        size = len(value)
+        if not self.capacity or size > self.max_item:
+            return False
+        with self._lock:
+            if since is not None and since != self.invalidations:
+                return False
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= len(old)
+            self._entries[key] = value
+            self.bytes += size
+            while self.bytes > self.capacity:
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes -= len(evicted)
+                self.evictions += 1
+            return True
+
+    def pop(self, key):
+        """
+        Drops `key` (after it was overwritten or deleted).
+        """
+        with self._lock:
+            self.invalidations += 1
+            self._seen.pop(key, None)
+            value = self._entries.pop(key, None)
+            if value is not None:
+                self.bytes -= len(value)
+            return value
+
+    def pop_matching(self, match):
+        """
+        Drops every key for which `match(key)` is true.
+        """
+        with self._lock:
+            self.invalidations += 1
+            for key in [k for k in self._entries if match(k)]:
+                self.bytes -= len(self._entries.pop(key))
+
+    def clear(self):
+        with self._lock:
+            self.invalidations += 1
+            self._entries.clear()
+            self._seen.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "capacity_bytes": self.capacity,
+                "bytes":          self.bytes,
+                "entries":        len(self._entries),
+                "hits":           self.hits,
+                "misses":         self.misses,
+                "hit_rate":       round(self.hits / lookups, 3) if lookups else 0.0,
+                "evictions":      self.evictions
+            }
@@ -1,12 +1,146 @@
+import io
 import os
 import sys
+import shutil
+import hashlib
+import numpy as np
 from pathlib import Path
 
 # Add the dfs directory to the Python path
 sys.path.append(str(Path(__file__).resolve().parents[1] / 'dfs'))
 
+DEFAULT_CHUNK_SIZE = 1024 * 1024  # 1MB
 
-def split_file(file_path, output_dir="chunks", chunk_size=1024 * 1024):
+# Content-defined chunking (gear rolling hash, FastCDC-style cut points)
+CDC_MIN_SIZE = 256 * 1024
+CDC_AVG_SIZE = 1024 * 1024        # must be a power of two
+CDC_MAX_SIZE = 4 * 1024 * 1024
+_CDC_BLOCK = 8 * 1024 * 1024      # bytes hashed per numpy pass
+_GEAR = np.random.RandomState(2024).randint(0, 2 ** 32, size=256, dtype=np.uint64).astype(np.uint32)
+
+
+def chunk_name(file_name, index):
+    return f"{file_name}_chunk{index:05d}"
+
+
+def iter_chunk_ranges(file_path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yields (chunk_name, offset, length) for each fixed-size chunk of a file
+    without reading or copying any data.
+    """
+    file_name = os.path.basename(file_path)
+    size = os.path.getsize(file_path)
+    for i, offset in enumerate(range(0, size, chunk_size)):
+        yield chunk_name(file_name, i), offset, min(chunk_size, size - offset)
+
+
+def content_chunk_id(data):
+    """
+    Content-addressed chunk id: identical bytes always get the same id.
+    """
+    return f"sha256-{hashlib.sha256(data).hexdigest()}"
+
+
+def _cdc_candidates(data, mask):
+    """
+    Positions i where the 32-bit gear hash of the bytes ending at i has all
+    `mask` bits clear. With a one-bit shift per byte, the hash only depends
+    on the last 32 bytes, so it is computed with 32 vectorised passes per
+    block instead of a Python loop per byte.
+    """
+    found = []
+    for start in range(0, len(data), _CDC_BLOCK):
+        lo = max(0, start - 31)
+        gear = _GEAR[np.asarray(data[lo:start + _CDC_BLOCK])]
+        h = np.zeros(len(gear), dtype=np.uint32)
+        for j in range(32):
+            h[j:] += gear[:len(gear) - j] << np.uint32(j)
+        hits = np.nonzero((h & mask) == 0)[0] + lo
+        found.append(hits[hits >= start])
+    return np.concatenate(found) if found else np.array([], dtype=np.int64)
+
+
+def iter_cdc_ranges(file_path, min_size=CDC_MIN_SIZE, avg_size=CDC_AVG_SIZE, max_size=CDC_MAX_SIZE):
+    """
+    Yields (chunk_id, offset, length) for content-defined chunks of a file.
+
+    Cut points follow the content, so an edit only changes the chunks
+    around it and identical regions of different files produce identical,
+    content-addressed chunks.
+    """
+    size = os.path.getsize(file_path)
+    if size == 0:
+        return
+    data = np.memmap(file_path, dtype=np.uint8, mode="r")
+    # top bits of the hash: each depends on the most bytes
+    mask = np.uint32(((avg_size - 1) << (32 - avg_size.bit_length() + 1)) & 0xFFFFFFFF)
+    cuts = _cdc_candidates(data, mask)
+
+    offset = 0
+    while offset < size:
+        lo = np.searchsorted(cuts, offset + min_size - 1)
+        end = int(cuts[lo]) + 1 if lo < len(cuts) else size
+        end = min(end, offset + max_size, size)
+        view = memoryview(data[offset:end])
+        yield content_chunk_id(view), offset, end - offset
+        offset = end
+    del data
+
+
+class FileSlice(io.RawIOBase):
+    """
+    Read-only file object over bytes [offset, offset + length) of a file.
+
+    Reads use positional I/O (os.pread where available), so many slices of
+    the same file can be streamed concurrently without temp chunk files.
+    """
+
+    def __init__(self, file_path, offset, length, name=None):
+        self._fd = os.open(file_path, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+        self._offset = offset
+        self._length = length
+        self._pos = 0
+        self.name = name or os.path.basename(file_path)
+
+    def readable(self):
+        return True
+
+    def __len__(self):
+        return self._length
+
+    def readinto(self, buffer):
+        remaining = self._length - self._pos
+        if remaining <= 0:
+            return 0
+        n = min(len(buffer), remaining)
+        if hasattr(os, "pread"):
+            data = os.pread(self._fd, n, self._offset + self._pos)
+        else:
+            os.lseek(self._fd, self._offset + self._pos, os.SEEK_SET)
+            data = os.read(self._fd, n)
+        buffer[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            os.close(self._fd)
+        super().close()
+
+
+def sha256_range(file_path, offset, length, block_size=DEFAULT_CHUNK_SIZE):
+    """
+    Hex sha256 of bytes [offset, offset + length) of a file, hashed
+    incrementally so the range is never held in memory at once.
+    """
+    hasher = hashlib.sha256()
+    with FileSlice(file_path, offset, length) as src:
+        for block in iter(lambda: src.read(block_size), b""):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def split_file(file_path, output_dir="chunks", chunk_size=DEFAULT_CHUNK_SIZE):
     """
     Splits a file into binary chunks.
 
@@ -17,27 +151,53 @@ def split_file(file_path, output_dir="chunks", chunk_size=1024 * 1024):
 
     Returns:
         List[str]: Ordered list of chunk file names.
+
+    Uploads no longer need this; they stream FileSlice views from
+    iter_chunk_ranges instead of writing chunk files first.
     """
     os.makedirs(output_dir, exist_ok=True)
     chunks = []
-    file_name = os.path.basename(file_path)
-
-    with open(file_path, 'rb') as f:
-        i = 0
-        while True:
-            chunk = f.read(chunk_size)
-            if not chunk:
-                break
-            chunk_name = f"{file_name}_chunk{i:05d}" 
-            chunk_path = os.path.join(output_dir, chunk_name)
-            with open(chunk_path, 'wb') as cf:
-                cf.write(chunk)
-            chunks.append(chunk_name)
-            i += 1
-
+    for name, offset, length in iter_chunk_ranges(file_path, chunk_size):
+        with FileSlice(file_path, offset, length) as src, open(os.path.join(output_dir, name), 'wb') as cf:
+            shutil.copyfileobj(src, cf)
+        chunks.append(name)
     return chunks
 
 
+def _copy_into(src_fd, dst_fd, offset, length):
+    """
+    Copies `length` bytes from the start of src_fd to dst_fd at `offset`,
+    in the kernel where possible.
+    """
+    copied = 0
+    if hasattr(os, "copy_file_range"):
+        try:
+            while copied < length:
+                n = os.copy_file_range(src_fd, dst_fd, length - copied, copied, offset + copied)
+                if n == 0:
+                    break
+                copied += n
+            return copied
+        except OSError:
+            pass  # e.g. cross-filesystem on older kernels; fall back below
+    if hasattr(os, "sendfile") and sys.platform.startswith("linux"):
+        os.lseek(dst_fd, offset + copied, os.SEEK_SET)
+        while copied < length:
+            n = os.sendfile(dst_fd, src_fd, copied, length - copied)
+            if n == 0:
+                break
+            copied += n
+        return copied
+    os.lseek(src_fd, copied, os.SEEK_SET)
+    os.lseek(dst_fd, offset + copied, os.SEEK_SET)
+    while copied < length:
+        data = os.read(src_fd, min(1024 * 1024, length - copied))
+        if not data:
+            break
+        os.write(dst_fd, data)
+        copied += len(data)
+    return copied
+
 
 def reconstruct_file(chunk_files, output_path, input_dir="chunks"):
     """
@@ -47,9 +207,21 @@ def reconstruct_file(chunk_files, output_path, input_dir="chunks"):
         chunk_files (List[str]): Ordered list of chunk filenames.
         output_path (str): Path to the output file.
         input_dir (str): Directory where chunks are located.
+
+    The output is preallocated to its final size and each chunk is copied
+    into place with copy_file_range/sendfile, so chunk data never passes
+    through Python buffers.
     """
+    paths = [os.path.join(input_dir, name) for name in chunk_files]
+    sizes = [os.path.getsize(p) for p in paths]
     with open(output_path, 'wb') as out_file:
-        for chunk_name in chunk_files:
-            chunk_path = os.path.join(input_dir, chunk_name)
-            with open(chunk_path, 'rb') as cf:
-                out_file.write(cf.read())
+        out_fd = out_file.fileno()
+        out_file.truncate(sum(sizes))
+        offset = 0
+        for path, size in zip(paths, sizes):
+            src_fd = os.open(path, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+            try:
+                _copy_into(src_fd, out_fd, offset, size)
+            finally:
+                os.close(src_fd)
+            offset += size
@@ -0,0 +1,51 @@
+import os
+import zlib
+
+# Adaptive chunk compression. Each chunk gets a codec ("raw" or "zlib")
+# recorded in its metadata entry; nodes store the encoded bytes as-is and
+# clients decode while the chunk streams in.
+
+COMPRESSION = os.getenv("DFS_COMPRESSION", "auto")  # "auto" or "off"
+ZLIB_LEVEL = 1                                      # fastest level; most of the gain on text
+SAMPLE_SIZE = 64 * 1024                             # bytes trial-compressed per chunk
+MIN_RATIO = 0.9                                     # compress only if the sample shrinks below this
+
+CODECS = ("raw", "zlib")
+DecodeError = zlib.error
+
+
+def choose_codec(sample, mode=COMPRESSION):
+    """
+    Trial-compresses a sample of the chunk and picks "zlib" only when it
+    is worthwhile; already-compressed data (images, fonts, compressed PDF
+    streams) stays "raw".
+    """
+    if mode == "off" or not sample:
+        return "raw"
+    ratio = len(zlib.compress(sample, ZLIB_LEVEL)) / len(sample)
+    return "zlib" if ratio < MIN_RATIO else "raw"
+
+
+def encode(data, codec):
+    if codec == "zlib":
+        return zlib.compress(data, ZLIB_LEVEL)
+    return data
+
+
+class _Passthrough:
+    def decompress(self, data):
+        return data
+
+    def flush(self):
+        return b""
+
+
+def decoder(codec):
+    """
+    Returns an incremental decoder with decompress(block) / flush().
+    """
+    if codec in (None, "raw"):
+        return _Passthrough()
+    if codec == "zlib":
+        return zlib.decompressobj()
+    raise ValueError(f"Unknown chunk codec: {codec}")
@@ -0,0 +1,122 @@
+import numpy as np
+
+# Reed-Solomon erasure coding over GF(256), systematic form.
+#
+# A stripe has k data shards followed by m parity shards. The generator
+# matrix is [I_k ; C] where C is an m x k Cauchy matrix, so any k of the
+# k + m shards are enough to rebuild the data shards.
+
+_PRIMITIVE = 0x11d
+
+_EXP = np.zeros(512, dtype=np.uint8)
+_LOG = np.zeros(256, dtype=np.int32)
+_x = 1
+for _i in range(255):
+    _EXP[_i] = _x
+    _LOG[_x] = _i
+    _x <<= 1
+    if _x & 0x100:
+        _x ^= _PRIMITIVE
+_EXP[255:510] = _EXP[:255]
+
+
+def gf_mul(a, b):
+    if a == 0 or b == 0:
+        return 0
+    return int(_EXP[_LOG[a] + _LOG[b]])
+
+
+def gf_inv(a):
+    if a == 0:
+        raise ZeroDivisionError("0 has no inverse in GF(256)")
+    return int(_EXP[255 - _LOG[a]])
+
+
+def _mul_vec(coef, vec):
+    """
+    coef * vec over GF(256) for a uint8 array `vec`.
+    """
+    if coef == 0:
+        return np.zeros_like(vec)
+    out = _EXP[_LOG[vec] + _LOG[coef]]
+    out[vec == 0] = 0
+    return out
+
+
+def cauchy_matrix(k, m):
+    """
+    m x k Cauchy matrix with x_i = k + i and y_j = j (all distinct).
+    """
+    if k + m > 256:
+        raise ValueError("k + m must be at most 256")
+    return [[gf_inv((k + i) ^ j) for j in range(k)] for i in range(m)]
+
+
+def _generator_row(index, k, m):
+    if index < k:
+        return [1 if j == index else 0 for j in range(k)]
+    return cauchy_matrix(k, m)[index - k]
+
+
+def _invert(matrix):
+    """
+    Gauss-Jordan inversion of a k x k matrix over GF(256).
+    """
+    k = len(matrix)
+    aug = [list(row) + [1 if i == j else 0 for j in range(k)] for i, row in enumerate(matrix)]
+    for col in range(k):
+        pivot = next((r for r in range(col, k) if aug[r][col]), None)
+        if pivot is None:
+            raise ValueError("shard matrix is singular")
+        aug[col], aug[pivot] = aug[pivot], aug[col]
+        inv = gf_inv(aug[col][col])
+        aug[col] = [gf_mul(v, inv) for v in aug[col]]
+        for r in range(k):
+            if r != col and aug[r][col]:
+                factor = aug[r][col]
+                aug[r] = [v ^ gf_mul(factor, p) for v, p in zip(aug[r], aug[col])]
+    return [row[k:] for row in aug]
+
+
+def _combine(rows, shards):
+    """
+    rows x shards: each output shard is the GF(256) dot product of a row
+    with the input shards.
+    """
+    out = []
+    for row in rows:
+        acc = np.zeros_like(shards[0])
+        for coef, shard in zip(row, shards):
+            if coef:
+                acc ^= _mul_vec(coef, shard)
+        out.append(acc)
+    return out
+
+
+def encode(data_shards, m):
+    """
+    Computes m parity shards for k equally sized data shards (bytes).
+    """
+    k = len(data_shards)
+    shards = [np.frombuffer(d, dtype=np.uint8) for d in data_shards]
+    return [p.tobytes() for p in _combine(cauchy_matrix(k, m), shards)]
+
+
+def decode(available, k, m):
+    """
+    Rebuilds the k data shards from any k available shards.
+
+    Args:
+        available (dict): shard index (0..k+m-1) -> bytes, at least k entries,
+            all the same length.
+    Returns:
+        List[bytes]: the k data shards in order.
+    """
+    if len(available) < k:
+        raise ValueError(f"need {k} shards, only {len(available)} available")
+    if all(i in available for i in range(k)):
+        return [available[i] for i in range(k)]
+    indices = sorted(available)[:k]
+    matrix = [_generator_row(i, k, m) for i in indices]
+    shards = [np.frombuffer(available[i], dtype=np.uint8) for i in indices]
+    return [d.tobytes() for d in _combine(_invert(matrix), shards)]
@@ -0,0 +1,124 @@
+import bisect
+import hashlib
+
+# Consistent-hash placement. Every member (a node, or a cluster) owns
+# points on a 64-bit ring in proportion to its weight, and a chunk belongs
+# to the members found walking clockwise from the chunk id's hash. Adding
+# or removing a member only moves the chunks on the arcs it gains or
+# loses, about 1/N of them, and anyone holding the member list can compute
+# a chunk's location without asking for metadata.
+#
+# Placement is two-level: a ring of clusters weighted by their total
+# capacity picks the cluster for each replica, and each cluster's ring of
+# nodes picks the node within it.
+
+VNODES = 100                    # ring points per unit of weight
+RING_UNIT_MB = 100 * 1024       # node capacity that counts as weight 1.0
+
+
+def ring_hash(key):
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+
+def capacity_weight(capacity_mb):
+    """
+    Ring weight of a node with `capacity_mb` of disk; rounded so small
+    fluctuations in reported capacity do not reshuffle the ring.
+    """
+    return max(0.01, round(capacity_mb / RING_UNIT_MB, 2))
+
+
+class HashRing:
+    def __init__(self, members=None, vnodes=VNODES):
+        self.vnodes = vnodes
+        self.members = dict(members or {})  # member → weight
+        self._rebuild()
+
+    def _rebuild(self):
+        points = sorted(
+            (ring_hash(f"{member}#{i}"), member)
+            for member, weight in self.members.items()
+            for i in range(max(1, round(self.vnodes * weight)))
+        )
+        # swapped in one assignment so concurrent lookups see a whole ring
+        self._ring = ([h for h, _ in points], [m for _, m in points], len(self.members))
+
+    def add(self, member, weight=1.0):
+        if self.members.get(member) != weight:
+            self.members[member] = weight
+            self._rebuild()
+
+    def remove(self, member):
+        if self.members.pop(member, None) is not None:
+            self._rebuild()
+
+    def __len__(self):
+        return len(self.members)
+
+    def __contains__(self, member):
+        return member in self.members
+
+    def lookup(self, key, count=1):
+        """
+        The first `count` distinct members clockwise from the key's hash:
+        the key's preference list.
+        """
+        hashes, owners, size = self._ring
+        if not owners:
+            return []
+        count = min(count, size)
+        found = []
+        start = bisect.bisect(hashes, ring_hash(key))
+        for i in range(len(owners)):
+            owner = owners[(start + i) % len(owners)]
+            if owner not in found:
+                found.append(owner)
+                if len(found) == count:
+                    break
+        return found
+
+    def to_dict(self):
+        return {"vnodes": self.vnodes, "members": dict(self.members)}
+
+
+class Topology:
+    """
+    Two-level ring built from the global balancer's /ring:
+    {"vnodes": V, "clusters": {name: {"url", "nodes": {node_url: weight}}}}.
+    A cluster's weight is the sum of its nodes' weights.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        vnodes = data.get("vnodes", VNODES)
+        clusters = {n: c for n, c in data.get("clusters", {}).items() if c.get("nodes")}
+        self.urls = {n: c.get("url") for n, c in clusters.items()}
+        self.cluster_ring = HashRing({n: sum(c["nodes"].values()) for n, c in clusters.items()}, vnodes)
+        self.node_rings = {n: HashRing(c["nodes"], vnodes) for n, c in clusters.items()}
+
+    def cluster_order(self, chunk_id):
+        return self.cluster_ring.lookup(chunk_id, len(self.cluster_ring))
+
+    def node_order(self, cluster, chunk_id):
+        ring = self.node_rings.get(cluster)
+        return ring.lookup(chunk_id, len(ring)) if ring else []
+
+    def locate(self, chunk_id, replicas=1):
+        """
+        Where the replicas of a chunk live: one entry per replica with its
+        cluster and that cluster's nodes in preference order. Replica i
+        goes to the i-th cluster on the ring (wrapping when there are
+        fewer clusters than replicas), on the first node not already used
+        by an earlier replica - the same walk the balancers do on upload.
+        """
+        clusters = self.cluster_order(chunk_id)
+        if not clusters:
+            return []
+        placements, used = [], set()
+        for i in range(replicas):
+            cluster = clusters[i % len(clusters)]
+            nodes = [n for n in self.node_order(cluster, chunk_id) if n not in used]
+            if nodes:
+                used.add(nodes[0])
+            placements.append({"cluster": cluster, "url": self.urls[cluster], "nodes": nodes})
+        return placements
@@ -0,0 +1,134 @@
+import os
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from dfs.core import transport
+
+# Heartbeats flow up the tree: every node pushes a compact status to its
+# cluster manager, and every cluster manager pushes a cluster summary to
+# the global balancer, each PUSH_INTERVAL seconds. Parents only poll the
+# targets whose pushes have gone stale, all at once and each under its own
+# deadline, so one dead target never delays anyone else's status.
+
+PUSH_INTERVAL = float(os.getenv("DFS_HEARTBEAT_INTERVAL", "1"))  # seconds between pushes
+STALE_AFTER = float(os.getenv("DFS_HEARTBEAT_STALE", "2"))       # heartbeat age that triggers a poll
+POLL_DEADLINE = float(os.getenv("DFS_POLL_DEADLINE", "1"))       # seconds a polled target gets to answer
+POLL_WORKERS = 32                                                # concurrent polls per process
+LATENCY_WINDOW = 512                                             # recent requests kept for latency stats
+
+_poll_pool = ThreadPoolExecutor(max_workers=POLL_WORKERS, thread_name_prefix="poll")
+
+
+class RequestStats:
+    """
+    In-flight request count and latency of the last LATENCY_WINDOW
+    requests, shared by a server's request hooks.
+    """
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=window)
+        self.inflight = 0
+        self.requests = 0
+
+    def begin(self):
+        with self._lock:
+            self.inflight += 1
+        return time.perf_counter()
+
+    def end(self, started):
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.inflight -= 1
+            self.requests += 1
+            self._latencies.append(elapsed)
+
+    def snapshot(self):
+        with self._lock:
+            latencies = sorted(self._latencies)
+            inflight, requests = self.inflight, self.requests
+        return {
+            "inflight":   inflight,
+            "requests":   requests,
+            "latency_ms": latency_summary(latencies)
+        }
+
+
+def latency_summary(latencies):
+    """
+    avg/p50/p99 in milliseconds of a sorted list of durations in seconds.
+    """
+    if not latencies:
+        return {"avg": 0.0, "p50": 0.0, "p99": 0.0}
+    n = len(latencies)
+    return {
+        "avg": round(sum(latencies) / n * 1000, 2),
+        "p50": round(latencies[n // 2] * 1000, 2),
+        "p99": round(latencies[min(n - 1, int(n * 0.99))] * 1000, 2)
+    }
+
+
+def system_load():
+    """
+    1-minute load average, or 0.0 where the OS has none (Windows).
+    """
+    try:
+        return round(os.getloadavg()[0], 2)
+    except (AttributeError, OSError):
+        return 0.0
+
+
+def start_pusher(parent_url, payload, interval=PUSH_INTERVAL):
+    """
+    Starts a daemon thread that POSTs payload() to {parent_url}/heartbeat
+    every `interval` seconds. A failing parent is reported once per
+    outage; pushing simply resumes when it comes back.
+    """
+    def run():
+        failing = False
+        while True:
+            try:
+                r = transport.post(f"{parent_url}/heartbeat", json=payload(), timeout=interval)
+                r.raise_for_status()
+                if failing:
+                    print(f"[INFO] Heartbeats to {parent_url} resumed")
+                    failing = False
+            except Exception as e:
+                if not failing:
+                    print(f"[WARN] Heartbeat push to {parent_url} failed: {e}")
+                    failing = True
+            time.sleep(interval)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+def stale(heartbeats, targets, now=None):
+    """
+    The targets whose last heartbeat is older than STALE_AFTER.
+    """
+    now = time.time() if now is None else now
+    return [t for t in targets if now - heartbeats.get(t, {}).get("last_seen", 0) > STALE_AFTER]
+
+
+def poll_all(urls, path="/status", deadline=POLL_DEADLINE):
+    """
+    GETs {url}{path} on every url at once. Returns {url: JSON body or
+    None}; a target that has not answered within `deadline` seconds counts
+    as failed without holding up the others.
+    """
+    futures = {url: _poll_pool.submit(transport.get, f"{url}{path}", timeout=deadline) for url in urls}
+    wait(futures.values(), timeout=deadline)
+    results = {}
+    for url, future in futures.items():
+        results[url] = None
+        if future.done() and future.exception() is None:
+            r = future.result()
+            if r.ok:
+                try:
+                    results[url] = r.json()
+                except ValueError:
+                    pass
+    return results
@@ -0,0 +1,484 @@
+import os
+import re
+import json
+import hashlib
+import tempfile
+import threading
+from contextlib import contextmanager
+from urllib.parse import quote
+from dfs.core import transport
+
+# Metadata lives in the metadata service (dfs/metadata_service.py) when
+# DFS_METADATA_URL is set, otherwise in the local files below. Callers use
+# the same functions either way.
+METADATA_URL = os.getenv("DFS_METADATA_URL", "").rstrip("/")
+METADATA_TIMEOUT = 10  # seconds per metadata service call
+
+# Directory holding one <file_name>.json per uploaded file
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+METADATA_DIR = os.path.join(BASE_DIR, "metadata")
+os.makedirs(METADATA_DIR, exist_ok=True)
+
+# Reference counts for content-addressed (CDC) chunks shared between files:
+# { chunk_id: {"refs": n, "nodes": [url, ...], "sha256", "codec", "stored_size"} }
+CHUNK_REFS_FILE = os.path.join(BASE_DIR, "chunk_refs.json")
+_refs_lock = threading.Lock()
+
+# The web app, the launcher and the cluster managers (rebalancing, repair)
+# all write these files; every read-modify-write holds _locked(), which
+# also takes an exclusive lock on LOCK_FILE against the other processes.
+LOCK_FILE = os.path.join(METADATA_DIR, ".lock")
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# Metadata layout (version 2):
+# {
+#   "version": 2,
+#   "file_name": "paper.pdf",
+#   "size": 2097152,
+#   "chunking": "fixed" | "cdc",
+#   "chunks": [
+#     {"id": "paper.pdf_chunk00000", "nodes": ["http://localhost:5001", ...], "offset": 0, "size": 1048576,
+#      "sha256": "<hex digest of the stored bytes>", "codec": "raw" | "zlib", "stored_size": 301234},
+#     ...
+#   ]
+# }
+# Erasure-coded files ("storage": "ec") also carry
+#   "ec": {"k": 4, "m": 2},
+#   "stripes": [{"shard_size": 1048576, "data": [chunk ids],
+#                "parity": [{"id", "nodes", "size", "sha256"}, ...]}, ...]
+# and every data chunk entry has a "stripe" index. Stripes with fewer than
+# k data chunks are padded with implicit all-zero shards.
+# "nodes" lists every replica. "size"/"offset" describe the decoded chunk,
+# "stored_size" the (possibly compressed) bytes on the nodes. "sha256" and
+# "codec" are absent for files uploaded before they were recorded; a
+# missing codec means "raw". Files uploaded before version 2 store a flat
+# {chunk_id: node_url} map and early version 2 files a single "node";
+# load_metadata converts both on read (offset/size are None for the former).
+METADATA_VERSION = 2
+
+
+def metadata_path(file_name):
+    return os.path.join(METADATA_DIR, f"{file_name}.json")
+
+
+def _service(method, path, **kwargs):
+    """
+    Calls the metadata service; returns the response (404s included).
+    """
+    r = transport.request(method, f"{METADATA_URL}{path}", timeout=METADATA_TIMEOUT, **kwargs)
+    if r.status_code != 404:
+        r.raise_for_status()
+    return r
+
+
+def _file_path(file_name):
+    return f"/files/{quote(file_name, safe='')}"
+
+
+def chunk_number(chunk_id):
+    match = re.search(r"_chunk(\d+)$", chunk_id)
+    return int(match.group(1)) if match else -1
+
+
+def normalize_metadata(file_name, raw):
+    """
+    Returns `raw` in the version 2 layout, converting legacy flat maps.
+    """
+    if "chunks" in raw:
+        for chunk in raw["chunks"]:
+            if "nodes" not in chunk:
+                chunk["nodes"] = [chunk.pop("node")]
+        return raw
+    chunks = [
+        {"id": chunk_id, "nodes": [raw[chunk_id]], "offset": None, "size": None}
+        for chunk_id in sorted(raw.keys(), key=chunk_number)
+    ]
+    return {"version": 1, "file_name": file_name, "size": None, "chunking": "fixed", "chunks": chunks}
+
+
+def all_chunks(metadata):
+    """
+    Every stored chunk entry of a file: data chunks plus parity shards.
+    """
+    parity = [p for stripe in metadata.get("stripes", []) for p in stripe["parity"]]
+    return metadata["chunks"] + parity
+
+
+def content_version(metadata):
+    """
+    Fingerprint of a file's bytes as its metadata records them: changes
+    when the file is uploaded again with other contents, but not when its
+    chunks move between nodes.
+    """
+    digest = hashlib.sha256()
+    for chunk in metadata["chunks"]:
+        digest.update(f"{chunk['id']}:{chunk.get('sha256', '')}:{chunk.get('size', '')}\n".encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def build_metadata(file_name, chunks, chunking="fixed", **extra):
+    """
+    Builds version 2 metadata from an ordered list of chunk entries
+    (each with at least id, nodes and size), filling in offsets. Extra
+    keyword arguments (e.g. storage, ec, stripes) are stored as-is.
+    """
+    offset = 0
+    for chunk in chunks:
+        chunk["offset"] = offset
+        offset += chunk["size"]
+    return {
+        "version":   METADATA_VERSION,
+        "file_name": file_name,
+        "size":      offset,
+        "chunking":  chunking,
+        "chunks":    chunks,
+        **extra
+    }
+
+
+def load_metadata(file_name):
+    """
+    Returns a file's metadata (version 2 layout), or None if it was never
+    uploaded.
+    """
+    if METADATA_URL:
+        r = _service("GET", _file_path(file_name))
+        return None if r.status_code == 404 else r.json()
+    path = metadata_path(file_name)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return normalize_metadata(file_name, json.load(f))
+
+
+def save_metadata(file_name, metadata):
+    """
+    Atomically writes a file's metadata: the JSON goes to a temp file in the
+    same directory, is fsynced, then renamed over the old version, so
+    readers never see a partially written file.
+    """
+    if METADATA_URL:
+        return commit_metadata(file_name, metadata)[0]
+    fd, tmp_path = tempfile.mkstemp(dir=METADATA_DIR, prefix=".tmp-", suffix=".json")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(metadata, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, metadata_path(file_name))
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return metadata_path(file_name)
+
+
+def load_metadata_batch(file_names):
+    """
+    {file_name: metadata or None} for many files in one call.
+    """
+    if METADATA_URL:
+        return _service("POST", "/files/lookup", json={"files": list(file_names)}).json()
+    return {name: load_metadata(name) for name in file_names}
+
+
+def list_files():
+    """
+    Names of all uploaded files, sorted.
+    """
+    if METADATA_URL:
+        return _service("GET", "/files").json()["files"]
+    return sorted(
+        f[:-len(".json")] for f in os.listdir(METADATA_DIR)
+        if f.endswith(".json") and not f.startswith(".tmp-")
+    )
+
+
+def commit_metadata(file_name, metadata, acquire=False, replace=False):
+    """
+    Saves a file's metadata and, with `acquire`, a reference to each of its
+    (content-addressed) chunks. With `replace` (a new upload under an
+    existing name) the previous version, if content-addressed, gives up
+    its references in the same step. The metadata service applies all of
+    it as one write-ahead log record, so a crash never leaves one without
+    the other. Returns (where the metadata was stored, the previous
+    version's chunk entries no file references any more); the caller
+    deletes those from their nodes.
+    """
+    if METADATA_URL:
+        r = _service("POST", "/commit", json={
+            "file": file_name, "metadata": metadata, "acquire": acquire, "replace": replace
+        })
+        return f"{METADATA_URL}{_file_path(file_name)}", r.json().get("unreferenced", [])
+    with _locked():
+        previous = load_metadata(file_name) if replace else None
+        unreferenced = []
+        if acquire or (previous and previous.get("chunking") == "cdc"):
+            refs = load_chunk_refs()
+            if acquire:
+                add_refs(refs, metadata["chunks"])
+            if previous and previous.get("chunking") == "cdc":
+                unreferenced = drop_refs(refs, previous["chunks"])
+            _atomic_write_json(CHUNK_REFS_FILE, refs)
+        return save_metadata(file_name, metadata), unreferenced
+
+
+def delete_metadata(file_name):
+    """
+    Forgets a file's metadata; a content-addressed file drops its chunk
+    references in the same step (see unreferenced_chunks). Returns False
+    if there was none.
+    """
+    if METADATA_URL:
+        return _service("DELETE", _file_path(file_name)).status_code != 404
+    with _locked():
+        metadata = load_metadata(file_name)
+        if metadata is None:
+            return False
+        if metadata.get("chunking") == "cdc":
+            refs = load_chunk_refs()
+            drop_refs(refs, metadata["chunks"])
+            _atomic_write_json(CHUNK_REFS_FILE, refs)
+        try:
+            os.remove(metadata_path(file_name))
+        except FileNotFoundError:
+            return False
+        return True
+
+
+@contextmanager
+def _locked():
+    with _refs_lock, open(LOCK_FILE, "a+") as f:
+        if fcntl:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:  # LK_LOCK gives up after 10 seconds
+                    pass
+        yield  # unlocked when the file is closed
+
+
+def _atomic_write_json(path, data):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-", suffix=".json")
+    with os.fdopen(fd, "w") as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def load_chunk_refs():
+    if not os.path.exists(CHUNK_REFS_FILE):
+        return {}
+    with open(CHUNK_REFS_FILE, "r") as f:
+        return json.load(f)
+
+
+_SHARED_FIELDS = ("nodes", "sha256", "codec", "stored_size")
+
+
+def shared_fields(entry):
+    """
+    How a ref entry's chunk is stored (fields it predates are left out).
+    """
+    found = {k: entry[k] for k in _SHARED_FIELDS if k in entry}
+    found.setdefault("nodes", [entry.get("node")])
+    return found
+
+
+def add_refs(refs, chunks):
+    for chunk in chunks:
+        entry = refs.setdefault(chunk["id"], {
+            "refs": 0, **{k: chunk[k] for k in _SHARED_FIELDS if k in chunk}
+        })
+        entry["refs"] += 1
+
+
+def drop_refs(refs, chunks):
+    unreferenced = []
+    for chunk in chunks:
+        entry = refs.get(chunk["id"])
+        if entry is None:
+            unreferenced.append(chunk)
+            continue
+        entry["refs"] -= 1
+        if entry["refs"] <= 0:
+            del refs[chunk["id"]]
+            unreferenced.append(chunk)
+    return unreferenced
+
+
+def lookup_chunks(chunk_ids):
+    """
+    Returns {chunk_id: {"nodes": [...], "sha256", "codec", "stored_size"}}
+    for the content-addressed chunks that are already stored somewhere.
+    """
+    if METADATA_URL:
+        return _service("POST", "/chunks/lookup", json={"chunk_ids": list(chunk_ids)}).json()
+    refs = load_chunk_refs()
+    return {cid: shared_fields(refs[cid]) for cid in chunk_ids if cid in refs}
+
+
+def acquire_chunks(chunks):
+    """
+    Adds one reference per chunk entry (id, nodes, and how it is stored).
+    """
+    if METADATA_URL:
+        _service("POST", "/chunks/acquire", json={"chunks": chunks})
+        return
+    with _locked():
+        refs = load_chunk_refs()
+        add_refs(refs, chunks)
+        _atomic_write_json(CHUNK_REFS_FILE, refs)
+
+
+def unreferenced_chunks(chunks):
+    """
+    The entries among `chunks` whose count would reach zero if one
+    reference per entry were dropped, without dropping anything: a delete
+    removes these from their nodes first and only then drops the
+    references (with delete_metadata), so a failed delete can be retried.
+    """
+    if METADATA_URL:
+        return _service("POST", "/chunks/unreferenced", json={"chunks": chunks}).json()["unreferenced"]
+    refs = {cid: dict(entry) for cid, entry in load_chunk_refs().items()}
+    return drop_refs(refs, chunks)
+
+
+def release_chunks(chunks):
+    """
+    Drops one reference per chunk entry. Returns the entries whose count
+    reached zero; only those should be deleted from their nodes.
+    """
+    if METADATA_URL:
+        return _service("POST", "/chunks/release", json={"chunks": chunks}).json()["unreferenced"]
+    with _locked():
+        refs = load_chunk_refs()
+        unreferenced = drop_refs(refs, chunks)
+        _atomic_write_json(CHUNK_REFS_FILE, refs)
+    return unreferenced
+
+
+# ——— Chunk locations (rebalancing, re-replication) ———
+
+def _moved(nodes, move):
+    src, dst = move
+    moved = [dst if n == src else n for n in nodes]
+    if src is None or src not in nodes:
+        moved.append(dst)
+    return list(dict.fromkeys(moved))
+
+
+def relocate_entries(entries, moves, checksums=None):
+    """
+    Applies {chunk_id: (from_node, to_node)} to chunk entries (dicts with
+    "nodes"; `entries` maps or lists them by id); with from_node None the
+    chunk gains a replica on to_node. Entries whose sha256 differs from
+    the one in `checksums` (the bytes that were copied) are left alone.
+    Returns whether anything changed.
+    """
+    checksums = checksums or {}
+    items = entries.items() if isinstance(entries, dict) else ((c["id"], c) for c in entries)
+    changed = False
+    for chunk_id, entry in items:
+        if checksums.get(chunk_id) and entry.get("sha256") and entry["sha256"] != checksums[chunk_id]:
+            continue
+        if chunk_id in moves and "nodes" in entry:
+            nodes = _moved(entry["nodes"], moves[chunk_id])
+            if nodes != entry["nodes"]:
+                entry["nodes"] = nodes
+                changed = True
+    return changed
+
+
+def stripe_shards(metadata):
+    """
+    {chunk_id: shard entries of its stripe} for every data chunk and
+    parity shard of an erasure-coded file.
+    """
+    by_id = {c["id"]: c for c in metadata["chunks"]}
+    shards = {}
+    for stripe in metadata.get("stripes", []):
+        members = [by_id[i] for i in stripe["data"] if i in by_id] + stripe["parity"]
+        for shard in members:
+            shards[shard["id"]] = members
+    return shards
+
+
+def located_chunks(metadatas, nodes):
+    """
+    {chunk_id: entry} for every stored chunk of `metadatas` with a replica
+    on one of `nodes`. Shards of an erasure-coded stripe come as copies
+    with "stripe_nodes": the nodes holding the stripe's other shards, which
+    a move or repair must not put this one on.
+    """
+    nodes = set(nodes)
+    found = {}
+    for metadata in metadatas:
+        shards = stripe_shards(metadata)
+        for chunk in all_chunks(metadata):
+            if chunk["id"] in found or not nodes.intersection(chunk["nodes"]):
+                continue
+            if chunk["id"] in shards:
+                others = [n for s in shards[chunk["id"]] if s is not chunk for n in s["nodes"]]
+                chunk = {**chunk, "stripe_nodes": list(dict.fromkeys(others))}
+            found[chunk["id"]] = chunk
+    return found
+
+
+def chunks_on(nodes, limit=None):
+    """
+    Chunk entries (id, nodes, size, stored_size, sha256, ...) with a
+    replica on any of `nodes`, each shared chunk once, at most `limit`.
+    """
+    if METADATA_URL:
+        return _service("POST", "/chunks/on", json={"nodes": list(nodes), "limit": limit}).json()["chunks"]
+    found = located_chunks(filter(None, map(load_metadata, list_files())), nodes)
+    return list(found.values())[:limit]
+
+
+def relocate_chunks(moves):
+    """
+    Records that chunks moved (or gained a replica): `moves` is a list of
+    {"id", "from", "to"} plus optionally the "sha256" of the copied bytes.
+    Every file referencing a chunk, and its shared ref entry, is updated. The metadata service applies the whole list as
+    one WAL record; the file backend rewrites each affected file
+    atomically, skipping files uploaded again or deleted since their
+    chunks were looked up. Returns the ids of the moves recorded.
+    """
+    if METADATA_URL:
+        _service("POST", "/chunks/relocate", json={"moves": moves})
+        return {m["id"] for m in moves}
+    by_id = {m["id"]: (m.get("from"), m["to"]) for m in moves}
+    checksums = {m["id"]: m["sha256"] for m in moves if m.get("sha256")}
+    recorded = set()
+    for name in list_files():
+        metadata = load_metadata(name)
+        if not metadata or not by_id.keys() & {c["id"] for c in all_chunks(metadata)}:
+            continue
+        version = content_version(metadata)
+        with _locked():
+            # the file may have changed since the chunks were picked: a
+            # new upload under the same name reuses fixed chunk ids for
+            # other bytes, so only the version the copies came from moves
+            metadata = load_metadata(name)
+            if not metadata or content_version(metadata) != version:
+                continue
+            if relocate_entries(all_chunks(metadata), by_id, checksums):
+                save_metadata(name, metadata)
+            recorded |= {c["id"] for c in all_chunks(metadata) if c["id"] in by_id
+                         and by_id[c["id"]][1] in c["nodes"]}
+    with _locked():
+        refs = load_chunk_refs()
+        if relocate_entries(refs, by_id, checksums):
+            _atomic_write_json(CHUNK_REFS_FILE, refs)
+        recorded |= {cid for cid in by_id.keys() & refs.keys() if by_id[cid][1] in refs[cid].get("nodes", ())}
+    return recorded
@@ -0,0 +1,325 @@
+import os
+import json
+import time
+import tempfile
+import threading
+from collections import defaultdict
+from dfs.core.metadata import (
+    METADATA_DIR, CHUNK_REFS_FILE, normalize_metadata, load_chunk_refs, all_chunks,
+    add_refs, drop_refs, shared_fields, relocate_entries, located_chunks
+)
+
+# The metadata service's namespace: every file's metadata and the chunk
+# reference counts, held in memory. Each change is appended to a
+# write-ahead log (one JSON record per line, fsynced) before it is applied,
+# and every SNAPSHOT_EVERY records or SNAPSHOT_INTERVAL seconds the whole
+# state is written to a snapshot and the log starts over. Records carry a
+# sequence number, so replay after a crash skips anything the snapshot
+# already holds and a torn last line is simply dropped.
+#
+# A record is applied whole or not at all: a file's metadata and the
+# references to its chunks commit together.
+
+SNAPSHOT_EVERY = int(os.getenv("DFS_METADATA_SNAPSHOT_EVERY", "1000"))        # WAL records between snapshots
+SNAPSHOT_INTERVAL = float(os.getenv("DFS_METADATA_SNAPSHOT_INTERVAL", "60"))  # seconds between snapshots of a dirty log
+WAL_FILE = "wal.log"
+SNAPSHOT_FILE = "snapshot.json"
+
+
+def valid_chunk_entry(entry):
+    """
+    Chunk entries need a string id, and "nodes", if present, a list of
+    node URLs.
+    """
+    if not isinstance(entry, dict) or not isinstance(entry.get("id"), str) or not entry["id"]:
+        return False
+    nodes = entry.get("nodes", [])
+    return isinstance(nodes, list) and all(isinstance(n, str) for n in nodes)
+
+
+def valid_move(move):
+    return (isinstance(move, dict) and isinstance(move.get("id"), str) and bool(move["id"])
+            and isinstance(move.get("to"), str) and bool(move["to"])
+            and isinstance(move.get("from"), (str, type(None)))
+            and isinstance(move.get("sha256"), (str, type(None))))
+
+
+def valid_metadata(metadata):
+    if not isinstance(metadata, dict) or not isinstance(metadata.get("chunks"), list):
+        return False
+    stripes = metadata.get("stripes", [])
+    if not isinstance(stripes, list) or not all(
+            isinstance(s, dict) and isinstance(s.get("parity"), list) for s in stripes):
+        return False
+    return all(valid_chunk_entry(c) for c in all_chunks(metadata))
+
+
+def check_record(record):
+    """
+    Raises ValueError unless `record` can be applied. Records are checked
+    before they are logged: one failing half-way through would already be
+    in the WAL and fail again on every replay.
+    """
+    op = record.get("op")
+    if op in ("commit", "delete") and not isinstance(record.get("file"), str):
+        raise ValueError("record needs a file name")
+    if op == "commit" and not valid_metadata(record.get("metadata")):
+        raise ValueError("metadata must have a list of chunk entries, each with a string id")
+    if op == "relocate" and not (isinstance(record.get("moves"), list) and all(map(valid_move, record["moves"]))):
+        raise ValueError("moves must be {\"id\", \"from\", \"to\"} entries")
+    if op in ("acquire", "release") and not (
+            isinstance(record.get("chunks"), list) and all(map(valid_chunk_entry, record["chunks"]))):
+        raise ValueError("chunks must be entries with a string id")
+    if op not in ("commit", "delete", "relocate", "acquire", "release"):
+        raise ValueError(f"unknown metadata op {op!r}")
+
+
+class MetadataStore:
+    def __init__(self, data_dir):
+        self.data_dir = data_dir
+        os.makedirs(data_dir, exist_ok=True)
+        self.wal_path = os.path.join(data_dir, WAL_FILE)
+        self.snapshot_path = os.path.join(data_dir, SNAPSHOT_FILE)
+        self._lock = threading.Lock()
+        self.files = {}     # file_name → metadata (version 2 layout)
+        self.refs = {}      # chunk_id → {"refs", "nodes", "sha256", "codec", "stored_size"}
+        self.chunk_files = defaultdict(set)  # chunk_id → files with an entry for it
+        self.seq = 0        # last applied record
+        self.logged = 0     # records in the WAL since the last snapshot
+        self.last_snapshot = time.time()
+        self._recover()
+        self._wal = open(self.wal_path, "a")
+
+    # ——— Recovery ———
+
+    def _recover(self):
+        has_snapshot = os.path.exists(self.snapshot_path)
+        if has_snapshot:
+            with open(self.snapshot_path) as f:
+                snap = json.load(f)
+            self.files, self.refs, self.seq = snap["files"], snap["refs"], snap["seq"]
+        for name, metadata in self.files.items():
+            self._index(name, metadata)
+        replayed = self._replay()
+        if not has_snapshot and not replayed:
+            self._import_legacy()
+        print(f"[INFO] Metadata store: {len(self.files)} files, {len(self.refs)} shared chunks "
+              f"(seq {self.seq}, {replayed} WAL records replayed)")
+
+    def _replay(self):
+        if not os.path.exists(self.wal_path):
+            return 0
+        replayed = 0
+        good = 0  # bytes up to the last complete record
+        with open(self.wal_path, "rb") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break  # torn write at the tail
+                good += len(line)
+                if record["seq"] > self.seq:
+                    try:
+                        check_record(record)
+                    except ValueError as e:
+                        # logged by a version that did not check records first
+                        print(f"[WARN] Skipping bad WAL record {record['seq']}: {e}")
+                        continue
+                    self._apply(record)
+                    self.seq = record["seq"]
+                    replayed += 1
+        if good < os.path.getsize(self.wal_path):
+            print(f"[WARN] Dropping torn record at the end of {self.wal_path}")
+            with open(self.wal_path, "r+b") as f:
+                f.truncate(good)
+        self.logged = replayed
+        return replayed
+
+    def _import_legacy(self):
+        """
+        First start: takes over the per-file JSON metadata and chunk_refs.json
+        written before the service existed, and snapshots them.
+        """
+        if os.path.isdir(METADATA_DIR):
+            for entry in os.listdir(METADATA_DIR):
+                if not entry.endswith(".json") or entry.startswith(".tmp-"):
+                    continue
+                name = entry[:-len(".json")]
+                try:
+                    with open(os.path.join(METADATA_DIR, entry)) as f:
+                        self.files[name] = normalize_metadata(name, json.load(f))
+                    self._index(name, self.files[name])
+                except (OSError, ValueError) as e:
+                    print(f"[WARN] Skipping unreadable metadata {entry}: {e}")
+        if os.path.exists(CHUNK_REFS_FILE):
+            self.refs = load_chunk_refs()
+        if self.files or self.refs:
+            print(f"[INFO] Imported {len(self.files)} files from {METADATA_DIR}")
+            self._write_snapshot()
+
+    # ——— Log and apply ———
+
+    def _index(self, name, metadata, add=True):
+        for chunk in all_chunks(metadata):
+            if add:
+                self.chunk_files[chunk["id"]].add(name)
+            else:
+                self.chunk_files[chunk["id"]].discard(name)
+                if not self.chunk_files[chunk["id"]]:
+                    del self.chunk_files[chunk["id"]]
+
+    def _apply(self, record):
+        op = record["op"]
+        if op == "commit":
+            previous = self.files.get(record["file"])
+            if record.get("acquire"):
+                add_refs(self.refs, record["metadata"]["chunks"])
+            unreferenced = []
+            if record.get("replace") and previous and previous.get("chunking") == "cdc":
+                unreferenced = drop_refs(self.refs, previous["chunks"])
+            if previous:
+                self._index(record["file"], previous, add=False)
+            self.files[record["file"]] = record["metadata"]
+            self._index(record["file"], record["metadata"])
+            return unreferenced
+        elif op == "delete":
+            metadata = self.files.pop(record["file"], None)
+            if metadata:
+                self._index(record["file"], metadata, add=False)
+                if record.get("release") and metadata.get("chunking") == "cdc":
+                    drop_refs(self.refs, metadata["chunks"])
+        elif op == "relocate":
+            moves = {m["id"]: (m.get("from"), m["to"]) for m in record["moves"]}
+            checksums = {m["id"]: m["sha256"] for m in record["moves"] if m.get("sha256")}
+            names = set().union(*(self.chunk_files.get(cid, ()) for cid in moves))
+            for name in names:
+                relocate_entries(all_chunks(self.files[name]), moves, checksums)
+            relocate_entries(self.refs, moves, checksums)
+            return len(names)
+        elif op == "acquire":
+            add_refs(self.refs, record["chunks"])
+        elif op == "release":
+            return drop_refs(self.refs, record["chunks"])
+        else:
+            raise ValueError(f"unknown metadata op {op!r}")
+
+    def _commit(self, record):
+        """
+        Checks `record` (ValueError if it is malformed), logs it, fsyncs,
+        then applies it. Callers hold the lock.
+        """
+        check_record(record)
+        record["seq"] = self.seq + 1
+        self._wal.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self._wal.flush()
+        os.fsync(self._wal.fileno())
+        result = self._apply(record)
+        self.seq = record["seq"]
+        self.logged += 1
+        if self.logged >= SNAPSHOT_EVERY:
+            self._write_snapshot()
+        return result
+
+    def _write_snapshot(self):
+        fd, tmp_path = tempfile.mkstemp(dir=self.data_dir, prefix=".tmp-", suffix=".json")
+        with os.fdopen(fd, "w") as f:
+            json.dump({"seq": self.seq, "files": self.files, "refs": self.refs}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+        # records up to seq are in the snapshot; a crash before this
+        # truncation only means they are skipped on replay
+        if hasattr(self, "_wal"):
+            self._wal.truncate(0)
+            self._wal.seek(0)
+        elif os.path.exists(self.wal_path):
+            open(self.wal_path, "w").close()
+        self.logged = 0
+        self.last_snapshot = time.time()
+
+    def snapshot(self):
+        with self._lock:
+            self._write_snapshot()
+
+    def snapshot_if_due(self):
+        with self._lock:
+            if self.logged and time.time() - self.last_snapshot >= SNAPSHOT_INTERVAL:
+                self._write_snapshot()
+
+    # ——— Operations ———
+
+    def get(self, file_name):
+        return self.files.get(file_name)
+
+    def get_many(self, file_names):
+        with self._lock:
+            return {name: self.files.get(name) for name in file_names}
+
+    def list_files(self):
+        with self._lock:
+            return sorted(self.files)
+
+    def commit(self, file_name, metadata, acquire=False, replace=False):
+        """
+        Stores a file's metadata and, with `acquire`, one reference to each
+        of its chunks, as a single record. With `replace` a content-addressed
+        previous version drops its references in the same record; returns
+        its chunk entries no file references any more.
+        """
+        with self._lock:
+            return self._commit({"op": "commit", "file": file_name, "metadata": metadata,
+                                 "acquire": acquire, "replace": replace})
+
+    def delete(self, file_name):
+        """
+        Forgets a file; a content-addressed one drops its chunk references
+        in the same record.
+        """
+        with self._lock:
+            if file_name not in self.files:
+                return False
+            self._commit({"op": "delete", "file": file_name, "release": True})
+            return True
+
+    def unreferenced(self, chunks):
+        """
+        Which of `chunks` a release would leave without references, without
+        changing anything.
+        """
+        with self._lock:
+            refs = {c["id"]: dict(self.refs[c["id"]]) for c in chunks if c["id"] in self.refs}
+            return drop_refs(refs, chunks)
+
+    def lookup_chunks(self, chunk_ids):
+        with self._lock:
+            return {cid: shared_fields(self.refs[cid]) for cid in chunk_ids if cid in self.refs}
+
+    def chunks_on(self, nodes, limit=None):
+        with self._lock:
+            found = located_chunks(self.files.values(), nodes)
+            return [dict(chunk) for chunk in list(found.values())[:limit]]
+
+    def relocate(self, moves):
+        """
+        Moves (or adds) chunk replicas in every file that has the chunk.
+        Returns the number of files updated.
+        """
+        with self._lock:
+            return self._commit({"op": "relocate", "moves": moves})
+
+    def acquire(self, chunks):
+        with self._lock:
+            self._commit({"op": "acquire", "chunks": chunks})
+
+    def release(self, chunks):
+        with self._lock:
+            return self._commit({"op": "release", "chunks": chunks})
+
+    def stats(self):
+        with self._lock:
+            return {
+                "files":         len(self.files),
+                "shared_chunks": len(self.refs),
+                "seq":           self.seq,
+                "wal_records":   self.logged
+            }
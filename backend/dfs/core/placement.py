@@ -0,0 +1,114 @@
+import os
+import time
+import random
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+# Chunk placement for the cluster managers (targets are nodes) and the
+# global balancer (targets are clusters).
+#
+# A target costs latency EWMA x (1 + queue depth / capacity). The queue
+# depth is what the target last reported in flight plus the reservations
+# this process holds for chunks it is sending there right now, so a burst
+# spreads out before the next heartbeat lands. Targets are picked by power
+# of two choices: the cheaper of two random candidates wins, which avoids
+# every request herding onto the one "best" target. Within a file, the
+# candidates holding the fewest of its chunks go first, so consecutive
+# chunks are striped across distinct targets.
+
+MODE = os.getenv("DFS_PLACEMENT", "load")  # "load" (this module) or "ring" (dfs.core.hash_ring)
+EWMA_ALPHA = 0.3           # weight of the newest latency sample
+DEFAULT_LATENCY_MS = 10.0  # for targets not measured or reported yet
+STRIPE_TTL = 600           # seconds a file's placement counts are kept after its last chunk
+
+
+class Placement:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reserved = defaultdict(int)  # target → chunks being sent there
+        self.latency = {}                 # target → latency EWMA (ms)
+        self._stripes = {}                # file_id → (last update, {target: chunks})
+
+    def observe(self, target, latency_ms):
+        """
+        Feeds one measured request latency into the target's EWMA.
+        """
+        with self._lock:
+            prev = self.latency.get(target)
+            self.latency[target] = latency_ms if prev is None else prev + EWMA_ALPHA * (latency_ms - prev)
+
+    @contextmanager
+    def reservation(self, targets):
+        """
+        Counts a chunk as queued on each target while the body runs.
+        """
+        with self._lock:
+            for target in targets:
+                self.reserved[target] += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                for target in targets:
+                    self.reserved[target] -= 1
+                    if self.reserved[target] <= 0:
+                        del self.reserved[target]
+
+    def cost(self, target, load):
+        """
+        `load` is what the target last reported: "inflight", "capacity"
+        (parallel slots, e.g. a cluster's live nodes) and "latency_ms",
+        which seeds the EWMA until a request has been measured.
+        """
+        latency = self.latency.get(target) or load.get("latency_ms") or DEFAULT_LATENCY_MS
+        queue = load.get("inflight", 0) + self.reserved.get(target, 0)
+        return latency * (1 + queue / max(1, load.get("capacity", 1)))
+
+    def _stripe_counts(self, file_id):
+        entry = self._stripes.get(file_id) if file_id else None
+        return entry[1] if entry else {}
+
+    def rank(self, candidates, loads, file_id=None):
+        """
+        Orders the candidates for one chunk: repeated power-of-two choices
+        over the ones holding the fewest chunks of `file_id` per unit of
+        capacity.
+        """
+        with self._lock:
+            counts = self._stripe_counts(file_id)
+            share = {t: counts.get(t, 0) / max(1, loads.get(t, {}).get("capacity", 1)) for t in candidates}
+            remaining = list(candidates)
+            ranked = []
+            while remaining:
+                fewest = min(share[t] for t in remaining)
+                pool = [t for t in remaining if share[t] == fewest]
+                pair = random.sample(pool, min(2, len(pool)))
+                best = min(pair, key=lambda t: self.cost(t, loads.get(t, {})))
+                ranked.append(best)
+                remaining.remove(best)
+        return ranked
+
+    def record(self, file_id, targets):
+        """
+        Notes that a chunk of `file_id` went to `targets`; counts of files
+        idle for STRIPE_TTL are dropped.
+        """
+        if not file_id:
+            return
+        now = time.time()
+        with self._lock:
+            for stale_id in [f for f, (seen, _) in self._stripes.items() if now - seen > STRIPE_TTL]:
+                del self._stripes[stale_id]
+            counts = self._stripe_counts(file_id) or {}
+            for target in targets:
+                counts[target] = counts.get(target, 0) + 1
+            self._stripes[file_id] = (now, counts)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "reserved":   dict(self.reserved),
+                "latency_ms": {t: round(v, 2) for t, v in self.latency.items()},
+                "files":      len(self._stripes)
+            }
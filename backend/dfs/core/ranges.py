@@ -0,0 +1,53 @@
+import re
+
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def parse_range(header, total):
+    """
+    Parses a single HTTP byte range against a resource of `total` bytes.
+
+    Returns (start, end) with `end` inclusive, or None when there is no
+    usable Range header (absent, malformed or multi-range), in which case
+    the whole resource should be served. Raises ValueError when the range
+    cannot be satisfied (416).
+    """
+    if not header:
+        return None
+    match = _RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if first == "" and last == "":
+        return None
+    if first == "":
+        # suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            raise ValueError("empty suffix range")
+        return max(total - length, 0), total - 1
+    start = int(first)
+    end = int(last) if last else total - 1
+    if start >= total or end < start:
+        raise ValueError(f"range {header} not satisfiable for {total} bytes")
+    return start, min(end, total - 1)
+
+
+def content_range(start, end, total):
+    return f"bytes {start}-{end}/{total}"
+
+
+def chunk_slices(chunks, start, end):
+    """
+    Maps the file byte range [start, end] onto chunk entries (with offset
+    and size). Returns (chunk, lo, hi) tuples, `lo`/`hi` inclusive offsets
+    within that chunk, for only the chunks that overlap the range.
+    """
+    slices = []
+    for chunk in chunks:
+        c_start = chunk["offset"]
+        c_end = c_start + chunk["size"] - 1
+        if c_end < start or c_start > end:
+            continue
+        slices.append((chunk, max(start, c_start) - c_start, min(end, c_end) - c_start))
+    return slices
@@ -0,0 +1,84 @@
+import os
+import time
+import threading
+
+# Background rebalancing, shared by the cluster managers (targets are
+# nodes) and the global balancer (targets are clusters). Chunks are placed
+# once on upload; this moves them afterwards so a target that joined late
+# or filled faster than the rest evens out.
+#
+# Each round plans byte transfers from the targets storing the most per
+# unit of capacity to those storing the least, capped at a per-round
+# budget. Every copy is a pull issued by a cluster manager (the global
+# balancer hands cross-cluster moves to the destination's manager), which
+# sends it through its Throttle, so each manager's migration traffic
+# stays under BANDWIDTH_MB per second and no byte is throttled twice.
+
+INTERVAL = float(os.getenv("DFS_REBALANCE_INTERVAL", "30"))          # seconds between rounds; 0: only on POST /rebalance
+BANDWIDTH_MB = float(os.getenv("DFS_REBALANCE_BANDWIDTH_MB", "4"))   # MB/s of migration traffic per cluster manager
+THRESHOLD = float(os.getenv("DFS_REBALANCE_THRESHOLD", "0.1"))       # tolerated deviation from the mean utilization
+ROUND_MB = 256                                                       # most data moved per round
+MOVE_BATCH = 16                                                      # chunks per node-to-node pull
+
+
+def plan_moves(used, capacity, threshold=THRESHOLD, budget=ROUND_MB * 1024 * 1024):
+    """
+    `used` maps each target to its stored bytes, `capacity` to its
+    relative capacity (e.g. ring weight). Returns [(source, destination,
+    bytes)] that bring every target within `threshold` of the mean
+    utilization, most overloaded first, moving at most `budget` bytes.
+    A target is only out of balance when it deviates by more than
+    `threshold` of the mean, so small differences never cause traffic.
+    """
+    targets = [t for t in used if capacity.get(t, 0) > 0]
+    total_cap = sum(capacity[t] for t in targets)
+    if len(targets) < 2 or total_cap <= 0:
+        return []
+    mean = sum(used[t] for t in targets) / total_cap
+    if mean <= 0:
+        return []
+    slack = mean * threshold
+    excess = {t: used[t] - mean * capacity[t] for t in targets if used[t] / capacity[t] > mean + slack}
+    deficit = {t: mean * capacity[t] - used[t] for t in targets if used[t] / capacity[t] < mean - slack}
+    # a target only slightly under the mean may still take data from a
+    # badly overloaded one
+    if excess and not deficit:
+        deficit = {t: mean * capacity[t] - used[t] for t in targets if used[t] / capacity[t] < mean}
+    moves = []
+    for src in sorted(excess, key=excess.get, reverse=True):
+        for dst in sorted(deficit, key=deficit.get, reverse=True):
+            amount = min(excess[src], deficit[dst], budget)
+            if amount <= 0:
+                continue
+            moves.append((src, dst, int(amount)))
+            excess[src] -= amount
+            deficit[dst] -= amount
+            budget -= amount
+            if budget <= 0:
+                return moves
+    return moves
+
+
+class Throttle:
+    """
+    Token bucket over bytes: take(n) blocks until n more bytes fit under
+    `rate` bytes per second. Bursts up to one second's worth.
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self._lock = threading.Lock()
+        self._tokens = rate
+        self._stamp = time.monotonic()
+        self.total = 0
+
+    def take(self, n):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.rate, self._tokens + (now - self._stamp) * self.rate)
+            self._stamp = now
+            self._tokens -= n
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+            self.total += n
+        if wait:
+            time.sleep(wait)
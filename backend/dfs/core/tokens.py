@@ -0,0 +1,72 @@
+import os
+import hmac
+import json
+import time
+import base64
+import hashlib
+
+# Placement tokens let clients write chunks straight to storage nodes:
+# the balancers choose the nodes and sign, for every (node, chunk), a
+# short-lived token that the node checks before storing. All processes
+# share DFS_TOKEN_SECRET (the launchers generate one per session). A node
+# without a secret accepts writes without tokens, as before.
+#
+# Token: base64url(JSON claims {"node", "chunk", "exp"}) "." base64url(HMAC-SHA256)
+
+SECRET = os.getenv("DFS_TOKEN_SECRET", "")
+TOKEN_TTL = int(os.getenv("DFS_TOKEN_TTL", "300"))  # seconds a token stays valid
+
+
+class TokenError(Exception):
+    """
+    A placement token is malformed, forged, expired or for another write.
+    """
+
+
+def _b64(raw):
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+
+def _unb64(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _mac(payload, secret):
+    return hmac.new(secret.encode("utf-8"), payload.encode("ascii"), hashlib.sha256).digest()
+
+
+def issue(node, chunk_id, ttl=TOKEN_TTL, secret=SECRET):
+    """
+    Token allowing `chunk_id` to be written to `node` for `ttl` seconds,
+    or None when no secret is configured.
+    """
+    if not secret:
+        return None
+    claims = {"node": node, "chunk": chunk_id, "exp": int(time.time() + ttl)}
+    payload = _b64(json.dumps(claims, separators=(",", ":")).encode("utf-8"))
+    return f"{payload}.{_b64(_mac(payload, secret))}"
+
+
+def verify(token, node, chunk_id, secret=SECRET, now=None):
+    """
+    Raises TokenError unless `token` allows writing `chunk_id` to `node`.
+    """
+    if not isinstance(token, str):
+        raise TokenError("missing token" if token is None else "malformed token")
+    try:
+        payload, mac = token.split(".")
+        valid_mac = hmac.compare_digest(_unb64(mac), _mac(payload, secret))
+    except (ValueError, TypeError, UnicodeError):
+        raise TokenError("malformed token")
+    if not valid_mac:
+        raise TokenError("bad signature")
+    try:
+        claims = json.loads(_unb64(payload))
+    except (ValueError, UnicodeError):
+        raise TokenError("malformed token")
+    if not isinstance(claims, dict):
+        raise TokenError("malformed token")
+    if claims.get("node") != node or claims.get("chunk") != chunk_id:
+        raise TokenError(f"token is for {claims.get('chunk')} on {claims.get('node')}")
+    if claims.get("exp", 0) < (time.time() if now is None else now):
+        raise TokenError("token expired")
@@ -0,0 +1,105 @@
+import os
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Shared HTTP transport for every DFS hop (client → global balancer →
+# cluster manager → node). One session per process keeps a connection pool
+# per host, so repeated calls to the same service reuse open keep-alive
+# connections instead of paying a TCP handshake (and an ephemeral port)
+# per request.
+
+POOL_HOSTS = int(os.getenv("DFS_POOL_HOSTS", "64"))          # hosts with a cached pool
+POOL_MAXSIZE = int(os.getenv("DFS_POOL_MAXSIZE", "32"))      # idle connections kept per host
+CONNECT_TIMEOUT = float(os.getenv("DFS_CONNECT_TIMEOUT", "2"))
+READ_TIMEOUT = float(os.getenv("DFS_READ_TIMEOUT", "30"))
+CONNECT_RETRIES = 2  # only connection setup is retried; a sent request never is
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def _timeout(timeout):
+    """
+    (connect, read) timeout: a bare number is the read timeout, with
+    connection setup capped at CONNECT_TIMEOUT so a dead host fails fast.
+    """
+    if timeout is None:
+        return (CONNECT_TIMEOUT, READ_TIMEOUT)
+    if isinstance(timeout, tuple):
+        return timeout
+    return (min(CONNECT_TIMEOUT, timeout), timeout)
+
+
+def get_session():
+    """
+    The process-wide pooled session, created on first use.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=POOL_HOSTS,
+                    pool_maxsize=POOL_MAXSIZE,
+                    max_retries=Retry(total=None, connect=CONNECT_RETRIES, read=0,
+                                      redirect=0, status=0, other=0, backoff_factor=0.1)
+                )
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _session = session
+    return _session
+
+
+def request(method, url, timeout=None, **kwargs):
+    return get_session().request(method, url, timeout=_timeout(timeout), **kwargs)
+
+
+def get(url, timeout=None, **kwargs):
+    return request("GET", url, timeout=timeout, **kwargs)
+
+
+def post(url, timeout=None, **kwargs):
+    return request("POST", url, timeout=timeout, **kwargs)
+
+
+def delete(url, timeout=None, **kwargs):
+    return request("DELETE", url, timeout=timeout, **kwargs)
+
+
+def pool_stats():
+    """
+    Per-host pool counters: connections opened, requests sent over them,
+    and idle connections ready for reuse. `reuse` is the share of requests
+    that did not need a new connection.
+    """
+    if _session is None:
+        return {"hosts": {}, "connections": 0, "requests": 0, "reuse": 0.0}
+    hosts = {}
+    seen = set()
+    for adapter in _session.adapters.values():
+        if id(adapter) in seen:
+            continue
+        seen.add(id(adapter))
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            hosts[f"{pool.scheme}://{pool.host}:{pool.port}"] = {
+                "connections": pool.num_connections,
+                "requests":    pool.num_requests,
+                # the queue is pre-filled with None placeholders
+                "idle":        sum(c is not None for c in list(pool.pool.queue)) if pool.pool else 0,
+                "maxsize":     POOL_MAXSIZE
+            }
+    connections = sum(h["connections"] for h in hosts.values())
+    sent = sum(h["requests"] for h in hosts.values())
+    return {
+        "hosts":       hosts,
+        "connections": connections,
+        "requests":    sent,
+        "reuse":       round(1 - connections / sent, 3) if sent else 0.0
+    }
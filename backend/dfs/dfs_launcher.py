@@ -3,10 +3,17 @@ import subprocess
 import time
 import sys
 import json
-from dfs.core.chunker import reconstruct_file
+import secrets
+from dfs.client.download import download_and_reconstruct
+from dfs.core.metadata import load_metadata, list_files, delete_metadata, unreferenced_chunks, all_chunks, METADATA_URL
+from dfs.client.batch import delete_chunks, group_by_node
 
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
 
+# "flask" runs nodes/node_storage.py, "async" the aiohttp node (same API)
+NODE_SERVER = os.getenv("DFS_NODE_SERVER", "flask")
+NODE_SCRIPTS = {"flask": "node_storage.py", "async": "async_node.py"}
+
 def start_process(cmd, cwd=None, env=None):
     try:
         env = env or os.environ.copy()
@@ -19,11 +26,14 @@ def start_process(cmd, cwd=None, env=None):
 def get_free_ports(start, count):
     return [start + i for i in range(count)]
 
-def launch_nodes(cluster_id, node_ports):
+def launch_nodes(cluster_id, node_ports, cluster_port=None):
     processes = []
+    env = os.environ.copy()
+    if cluster_port:
+        env["DFS_HEARTBEAT_URL"] = f"http://localhost:{cluster_port}"  # nodes push heartbeats to their manager
     for port in node_ports:
         print(f"Starting storage node on port {port}...")
-        p = start_process(["python", "nodes/node_storage.py", "--port", str(port)])
+        p = start_process(["python", "nodes/" + NODE_SCRIPTS[NODE_SERVER], "--port", str(port)], env=env)
         if p: processes.append(p)
     return processes
 
@@ -31,6 +41,7 @@ def launch_cluster_manager(cluster_port, node_ports):
     node_urls = json.dumps([f"http://localhost:{port}" for port in node_ports])
     env = os.environ.copy()
     env["NODES"] = node_urls
+    env["DFS_HEARTBEAT_URL"] = "http://localhost:6000"  # managers push heartbeats to the global balancer
     env["PYTHONPATH"] = BASE_DIR
     print(f"Starting cluster manager on port {cluster_port}...")
     return start_process(["python", "load_balancers/cluster_manager.py", "--port", str(cluster_port)], env=env)
@@ -42,6 +53,17 @@ def launch_global_balancer(cluster_map):
     print("Starting global load balancer on port 6000...")
     return start_process(["python", "load_balancers/global_balancer.py", "--port", "6000"], env=env)
 
+def launch_metadata_service():
+    """
+    Starts the metadata service when DFS_METADATA_URL names one; the
+    clients in this process and in child processes then use it.
+    """
+    if not METADATA_URL:
+        return None
+    port = METADATA_URL.rsplit(":", 1)[-1]
+    print(f"Starting metadata service on port {port}...")
+    return start_process(["python", "metadata_service.py", "--port", port])
+
 def upload_file():
     file_path = input("Enter filename (from tests/input_files/): ").strip()
     full_path = os.path.join(BASE_DIR, "tests", "input_files", file_path)
@@ -53,44 +75,29 @@ def upload_file():
     subprocess.run(["python", "client/upload.py", file_path], env=env)
 
 def list_uploaded_files():
-    metadata_dir = os.path.join(BASE_DIR, "metadata")
-    if not os.path.exists(metadata_dir):
-        print("No metadata directory found.")
-        return
-
-    files = [f for f in os.listdir(metadata_dir) if f.endswith(".json")]
+    files = list_files()
     if not files:
         print("No uploaded files found.")
         return
 
     print("\nUploaded Files:")
     for i, f in enumerate(files):
-        print(f"[{i+1}] {f.replace('.json', '')}")
+        print(f"[{i+1}] {f}")
     choice = input("Enter file number to view metadata (or press Enter to cancel): ").strip()
     if choice.isdigit():
         index = int(choice) - 1
         if 0 <= index < len(files):
-            path = os.path.join(metadata_dir, files[index])
-            with open(path) as f:
-                data = json.load(f)
-                print(json.dumps(data, indent=2))
+            print(json.dumps(load_metadata(files[index]), indent=2))
 
 def download_file():
-    import re
-    metadata_dir = os.path.join(BASE_DIR, "metadata")
-    output_dir = os.path.join(BASE_DIR, "tests", "output_files")
-    chunk_dir = os.path.join(BASE_DIR, "chunks")
-    os.makedirs(output_dir, exist_ok=True)
-    os.makedirs(chunk_dir, exist_ok=True)
-
-    files = [f for f in os.listdir(metadata_dir) if f.endswith(".json")]
+    files = list_files()
     if not files:
         print("[INFO] No uploaded files found.")
         return
 
     print("\nAvailable uploaded files:")
     for i, f in enumerate(files):
-        print(f"[{i+1}] {f.replace('.json', '')}")
+        print(f"[{i+1}] {f}")
 
     choice = input("Enter file number to download: ").strip()
     if not choice.isdigit():
@@ -102,58 +109,26 @@ def download_file():
         print("[ERROR] Invalid file number.")
         return
 
-    file_basename = files[index].replace(".json", "")
-    metadata_path = os.path.join(metadata_dir, f"{file_basename}.json")
-
+    file_basename = files[index]
     try:
-        with open(metadata_path, "r") as f:
-            metadata = json.load(f)
-
-        def extract_chunk_index(chunk_id):
-            match = re.search(r'_chunk(\d+)$', chunk_id)
-            return int(match.group(1)) if match else -1
-
-        chunks = sorted(metadata.keys(), key=extract_chunk_index)
-
-        import requests
-        for chunk_id in chunks:
-            node_url = metadata[chunk_id]
-            chunk_path = os.path.join(chunk_dir, chunk_id)
-
-            r = requests.get(f"{node_url}/chunk/{chunk_id}", timeout=5)
-            r.raise_for_status()
-
-            with open(chunk_path, "wb") as f:
-                f.write(r.content)
-            print(f"[OK] Downloaded {chunk_id} from {node_url}")
-
-        from core.chunker import reconstruct_file
-        name, ext = os.path.splitext(file_basename)
-        output_path = os.path.join(output_dir, f"{name}_reconstructed{ext}")
-
-        if os.path.exists(output_path):
-            os.remove(output_path)
-
-        reconstruct_file(chunks, output_path)
-        print(f"\n[SUCCESS] File downloaded and reconstructed at: {output_path}")
-
+        # chunks are fetched in parallel and written straight to tests/output_files
+        download_and_reconstruct(file_basename)
     except Exception as e:
         print(f"[ERROR] Download failed: {e}")
 
 
 def delete_distributed_file():
-    metadata_dir = os.path.join(BASE_DIR, "metadata")
     chunk_dir = os.path.join(BASE_DIR, "chunks")
     output_dir = os.path.join(BASE_DIR, "tests", "output_files")
-    files = [f for f in os.listdir(metadata_dir) if f.endswith(".json")]
-    
+    files = list_files()
+
     if not files:
         print("[INFO] No uploaded files found.")
         return
 
     print("\nUploaded Files:")
     for i, f in enumerate(files):
-        print(f"[{i+1}] {f.replace('.json', '')}")
+        print(f"[{i+1}] {f}")
 
     choice = input("Enter file number to delete: ").strip()
 
@@ -166,8 +141,7 @@ def delete_distributed_file():
         print("[ERROR] Invalid file number.")
         return
 
-    file_basename = files[index].replace(".json", "")
-    metadata_file = os.path.join(metadata_dir, f"{file_basename}.json")
+    file_basename = files[index]
 
     confirm = input(f"Are you sure you want to delete '{file_basename}'? [y/N]: ").strip().lower()
     if confirm != 'y':
@@ -175,35 +149,31 @@ def delete_distributed_file():
         return
 
     try:
-        with open(metadata_file, "r") as f:
-            metadata = json.load(f)
+        metadata = load_metadata(file_basename)
     except Exception as e:
         print(f"[ERROR] Could not read metadata: {e}")
         return
 
-    failed = []
-    for chunk_id, node_url in metadata.items():
-        try:
-            import requests
-            r = requests.delete(f"{node_url}/chunk/{chunk_id}", timeout=5)
-            if r.status_code == 200:
-                print(f"[OK] Deleted {chunk_id} from {node_url}")
-            else:
-                failed.append(chunk_id)
-                print(f"[WARN] Chunk {chunk_id} deletion failed with status {r.status_code}")
-        except Exception as e:
-            failed.append(chunk_id)
-            print(f"[ERROR] Could not delete {chunk_id}: {e}")
+    chunks = all_chunks(metadata)  # data chunks plus any parity shards
+    if metadata.get("chunking") == "cdc":
+        # shared content-addressed chunks stay until their last file is
+        # deleted; the references go with the metadata, below
+        chunks = unreferenced_chunks(chunks)
+
+    # one batch request per node; chunks already gone count as deleted
+    failed = delete_chunks(chunks)
+    if not failed:
+        print(f"[OK] Deleted {len(chunks)} chunk(s) from {len(group_by_node(chunks))} node(s)")
 
     if failed:
         print(f"[FAIL] Some chunks could not be deleted: {failed}")
     else:
-        os.remove(metadata_file)
+        delete_metadata(file_basename)
         print(f"[SUCCESS] Metadata for '{file_basename}' deleted.")
 
         # Delete local chunks
-        for chunk_id in metadata:
-            local_path = os.path.join(chunk_dir, chunk_id)
+        for chunk in metadata["chunks"]:
+            local_path = os.path.join(chunk_dir, chunk["id"])
             if os.path.exists(local_path):
                 os.remove(local_path)
 
@@ -233,6 +203,10 @@ def main():
     cluster_managers = []
     cluster_map = {}
 
+    # nodes accept direct writes signed by the balancers with this secret
+    os.environ.setdefault("DFS_TOKEN_SECRET", secrets.token_hex(32))
+    metadata_service = launch_metadata_service()
+
     for c in range(clusters):
         node_ports = get_free_ports(node_base_port + c * nodes_per_cluster, nodes_per_cluster)
         cluster_port = cluster_base_port + c
@@ -242,7 +216,7 @@ def main():
         cluster_managers.append(cm_process)
 
         # Launch nodes for this cluster
-        node_processes = launch_nodes(c, node_ports)
+        node_processes = launch_nodes(c, node_ports, cluster_port)
         all_node_processes.extend(node_processes)
 
         # Register cluster
@@ -274,7 +248,7 @@ def main():
             delete_distributed_file()
         elif choice == "5":
             print("Shutting down all processes...")
-            for p in all_node_processes + cluster_managers + [global_balancer]:
+            for p in all_node_processes + cluster_managers + [global_balancer, metadata_service]:
                 if p: p.terminate()
             break
         else:
@@ -3,8 +3,6 @@
 import os
 import sys
 import json
-import random
-import requests
 import threading
 import time
 
@@ -14,6 +12,16 @@ from flask_cors import CORS
 # allow importing dfs.load_balancers.log and DEFAULT_TIMEOUT
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from dfs.load_balancers import log, DEFAULT_TIMEOUT
+from dfs.core import transport, tokens
+from dfs.core.heartbeat import start_pusher, poll_all, stale, STALE_AFTER
+from dfs.core.placement import Placement, MODE as PLACEMENT_MODE
+from dfs.core.hash_ring import HashRing, capacity_weight
+from dfs.core.rebalance import (
+    plan_moves, Throttle, INTERVAL as REBALANCE_INTERVAL, BANDWIDTH_MB, MOVE_BATCH, ROUND_MB
+)
+from dfs.core.batch import batches
+from dfs.core.metadata import chunks_on, relocate_chunks
+from dfs.client.batch import delete_chunks
 
 app = Flask(__name__)
 CORS(app)  # enable cross-origin so dashboard can fetch /status, /node_heartbeats
@@ -28,145 +36,549 @@ except Exception as e:
 if not NODES:
     log("⚠️ No nodes configured. Set NODES environment variable correctly.", context="CLUSTER")
 
-CHUNK_PENALTY = 50  # MB penalty per stored chunk
+MIN_FREE_MB = 100  # nodes with less free space get no new chunks
+HEARTBEAT_URL = os.getenv("DFS_HEARTBEAT_URL")  # global balancer to push cluster heartbeats to
 
 # ——— Heartbeat state & monitor ———
-NODE_HEARTBEATS = {}  # node_url → { last_seen, status, free_mb, chunk_count }
-HEARTBEAT_INTERVAL = 5  # seconds
+NODE_HEARTBEATS = {}  # node_url → { last_seen, status, down_since, source, free_mb, capacity_mb, chunk_count, stored_bytes, inflight, load, latency_ms }
+HEARTBEAT_INTERVAL = 1  # seconds between checks for stale nodes
+NODE_RING = HashRing()  # node_url → weight by disk capacity, used with DFS_PLACEMENT=ring
+
+def record_node_heartbeat(node, data, source):
+    """
+    Stores a heartbeat that arrived by push or poll; logs only when a node
+    comes (back) up.
+    """
+    prev = NODE_HEARTBEATS.get(node, {})
+    NODE_HEARTBEATS[node] = {
+        "last_seen":    time.time(),
+        "status":       "alive",
+        "source":       source,
+        "free_mb":      data.get("free_mb", 0),
+        "capacity_mb":  data.get("capacity_mb", 0),
+        "chunk_count":  data.get("chunk_count", 0),
+        "stored_bytes": data.get("stored_bytes", 0),
+        "inflight":     data.get("inflight", 0),
+        "load":         data.get("load", 0.0),
+        "latency_ms":   data.get("latency_ms", {})
+    }
+    if data.get("capacity_mb"):
+        # a node joins the ring on its first heartbeat and stays while down,
+        # so its chunks keep their computed location through an outage
+        NODE_RING.add(node, capacity_weight(data["capacity_mb"]))
+    if prev.get("status") != "alive":
+        log(f"Heartbeat OK from {node} ({source})", context="HEARTBEAT")
+
+def mark_node_down(node):
+    prev = NODE_HEARTBEATS.get(node, {})
+    if time.time() - prev.get("last_seen", 0) <= STALE_AFTER:
+        return  # a push landed while the poll was failing
+    NODE_HEARTBEATS[node] = {
+        **prev,
+        "last_seen":  prev.get("last_seen", 0),  # 0: never heard from
+        "status":     "down",
+        "down_since": prev["down_since"] if prev.get("status") == "down" else time.time(),
+        "free_mb":    0,
+        "inflight":   0
+    }
+    if prev.get("status") != "down":
+        log(f"❌ No heartbeat from {node}", context="HEARTBEAT")
 
 def node_heartbeat_monitor():
     """
-    Periodically ping each node's /status to keep NODE_HEARTBEATS up to date.
+    Nodes push heartbeats to /heartbeat. Every HEARTBEAT_INTERVAL this
+    polls only the nodes whose last heartbeat has gone stale, all at once
+    with a per-node deadline, and marks those that do not answer as down.
     """
     while True:
-        for node in NODES:
-            try:
-                r = requests.get(f"{node}/status", timeout=DEFAULT_TIMEOUT)
-                r.raise_for_status()
-                data = r.json()
-                NODE_HEARTBEATS[node] = {
-                    "last_seen":   time.time(),
-                    "status":      "alive",
-                    "free_mb":     data.get("free_mb", 0),
-                    "chunk_count": data.get("chunk_count", 0)
-                }
-                log(f"Heartbeat OK from {node}", context="HEARTBEAT")
-            except Exception as e:
-                prev = NODE_HEARTBEATS.get(node, {})
-                NODE_HEARTBEATS[node] = {
-                    "last_seen":   prev.get("last_seen", 0),
-                    "status":      "down",
-                    "free_mb":     0,
-                    "chunk_count": prev.get("chunk_count", 0)
-                }
-                log(f"❌ No heartbeat from {node}: {e}", context="HEARTBEAT")
+        for node, data in poll_all(stale(NODE_HEARTBEATS, NODES)).items():
+            if data is None:
+                mark_node_down(node)
+            else:
+                record_node_heartbeat(node, data, source="poll")
         time.sleep(HEARTBEAT_INTERVAL)
 
+def cluster_summary():
+    """
+    Aggregate free space, chunk count, load and latency over the nodes.
+    """
+    alive = [hb for hb in NODE_HEARTBEATS.values() if hb.get("status") == "alive"]
+    p99s  = [hb.get("latency_ms", {}).get("p99", 0) for hb in alive]
+    return {
+        "cluster_free_mb":      sum(hb.get("free_mb", 0) for hb in NODE_HEARTBEATS.values()),
+        "cluster_chunk_count":  sum(hb.get("chunk_count", 0) for hb in NODE_HEARTBEATS.values()),
+        "cluster_stored_bytes": sum(hb.get("stored_bytes", 0) for hb in NODE_HEARTBEATS.values()),
+        "active_nodes":         len(alive),
+        "inflight":             sum(hb.get("inflight", 0) for hb in alive),
+        "max_p99_ms":           max(p99s, default=0),
+        "ring_nodes":           dict(NODE_RING.members),
+        "under_replicated":     REPAIR_STATS["under_replicated"]
+    }
+
 # ——— Node selection logic ———
 
+PLACEMENT = Placement()
+
 def get_node_status(node):
     """
-    Returns the last-known heartbeat entry for this node,
-    or pings it immediately if missing.
+    Returns the last-known heartbeat entry for this node, or None.
     """
     hb = NODE_HEARTBEATS.get(node)
     if hb:
         return {"url": node, **hb}
-    # fallback to on-demand ping
-    try:
-        r = requests.get(f"{node}/status", timeout=DEFAULT_TIMEOUT)
-        r.raise_for_status()
-        data = r.json()
-        return {
-            "url":         node,
-            "status":      "alive",
-            "last_seen":   time.time(),
-            "free_mb":     data.get("free_mb", 0),
-            "chunk_count": data.get("chunk_count", 0)
-        }
-    except:
-        return None
+    return None
+
+def has_room(node):
+    hb = NODE_HEARTBEATS.get(node, {})
+    return hb.get("status") == "alive" and hb.get("free_mb", 0) >= MIN_FREE_MB
+
+def ring_node(chunk_id, exclude=()):
+    """
+    The first alive node with room on the chunk's ring walk outside `exclude`.
+    """
+    for node in NODE_RING.lookup(chunk_id, len(NODE_RING)):
+        if node not in exclude and has_room(node):
+            return node
+    return None
 
-def compute_score(node_info):
+def ring_preference(chunk_id, count):
     """
-    Score = free_mb - chunk_count * penalty
+    The `count` nodes the ring puts a chunk's replicas in this cluster on:
+    its ring walk without the alive nodes that are out of room. Down nodes
+    keep their place, so an outage alone moves nothing.
     """
-    return node_info["free_mb"] - (node_info["chunk_count"] * CHUNK_PENALTY)
+    walk = NODE_RING.lookup(chunk_id, len(NODE_RING))
+    full = {n for n in walk if NODE_HEARTBEATS.get(n, {}).get("status") == "alive" and not has_room(n)}
+    return [n for n in walk if n not in full][:count]
 
-def select_best_node():
+def select_best_node(exclude=(), file_id=None, chunk_id=None):
     """
-    Chooses an alive node with highest score.
+    Chooses an alive node with room to spare, skipping nodes in `exclude`
+    (e.g. ones already holding a replica of the chunk): power of two
+    choices over latency and queue depth (reported in-flight requests plus
+    chunks this manager is sending right now), among the nodes holding
+    the fewest chunks of `file_id`. With DFS_PLACEMENT=ring the chunk
+    goes where the hash ring puts it instead.
     """
-    statuses = []
+    if PLACEMENT_MODE == "ring" and chunk_id:
+        node = ring_node(chunk_id, exclude)
+        if node:
+            log(f"[SELECTED NODE] {node} → ring position of {chunk_id}", context="CLUSTER")
+            return node
+
+    # nodes not heard from yet (just started) are polled together, on demand
+    unknown = [n for n in NODES if n not in NODE_HEARTBEATS and n not in exclude]
+    for node, data in poll_all(unknown).items():
+        if data is not None:
+            record_node_heartbeat(node, data, source="poll")
+
+    loads = {}
     for n in NODES:
+        if n in exclude:
+            continue
         info = get_node_status(n)
-        if info and info["status"] == "alive":
-            try:
-                info["score"] = compute_score(info)
-                statuses.append(info)
-            except Exception as e:
-                log(f"Error computing score for {n}: {e}", context="CLUSTER")
-
-    if not statuses:
+        if info and info["status"] == "alive" and info["free_mb"] >= MIN_FREE_MB:
+            loads[n] = {
+                "inflight":   info.get("inflight", 0),
+                "latency_ms": info.get("latency_ms", {}).get("p50", 0)
+            }
+
+    if not loads:
         log("No available alive nodes", context="CLUSTER")
         return None
 
-    max_score = max(s["score"] for s in statuses)
-    top = [s for s in statuses if abs(s["score"] - max_score) < 1e-3]
-    chosen = random.choice(top)
-    log(f"[SELECTED NODE] {chosen['url']} → Score: {chosen['score']}", context="CLUSTER")
-    return chosen["url"]
+    chosen = PLACEMENT.rank(list(loads), loads, file_id)[0]
+    PLACEMENT.record(file_id, [chosen])
+    log(f"[SELECTED NODE] {chosen} → cost {PLACEMENT.cost(chosen, loads[chosen]):.1f}", context="CLUSTER")
+    return chosen
+
+# ——— Rebalancing ———
+
+THROTTLE = Throttle(BANDWIDTH_MB * 1024 * 1024)
+REBALANCE_STATS = {"rounds": 0, "moved_chunks": 0, "moved_bytes": 0, "failed_chunks": 0, "last_plan": []}
+_rebalance_lock = threading.Lock()
+_rebalance_now = threading.Event()  # set by POST /rebalance
+
+def chunk_bytes(chunk):
+    return chunk.get("stored_size") or chunk.get("size") or 0
+
+def taken(chunk):
+    """
+    Nodes a chunk must not be copied to: its replicas, and for a shard of
+    an erasure-coded stripe every node holding another shard of it (two
+    shards on one node would be lost together).
+    """
+    return set(chunk["nodes"]).union(chunk.get("stripe_nodes", []))
+
+def transfer(source, chunks, dst=None, replaces=None, throttle=THROTTLE, context="REBALANCE"):
+    """
+    Copies chunk entries from `source` onto `dst` (default: the best node
+    without a replica of each chunk): the destination pulls them straight
+    from the source, then the metadata swaps `replaces` for the new node
+    in one atomic update per batch. A move (`replaces` left as the
+    source) deletes the source copies only after that; a repair replaces
+    a dead node and leaves the source alone. Returns (copied chunks,
+    failed ids).
+    """
+    replaces = replaces or source
+    by_dst, copied, failed = {}, [], []
+    for chunk in chunks:
+        target = dst or select_best_node(exclude=taken(chunk), chunk_id=chunk["id"])
+        if target and target not in taken(chunk):
+            by_dst.setdefault(target, []).append(chunk)
+        else:
+            failed.append(chunk["id"])
+    for target, group in ((t, b) for t, g in by_dst.items() for b in batches(g, MOVE_BATCH)):
+        throttle.take(sum(chunk_bytes(c) for c in group))
+        try:
+            r = transport.post(f"{target}/pull", json={
+                "source":    source,
+                "ids":       [c["id"] for c in group],
+                "checksums": {c["id"]: c["sha256"] for c in group if c.get("sha256")},
+                "tokens":    {c["id"]: tokens.issue(target, c["id"]) for c in group}
+            }, timeout=DEFAULT_TIMEOUT * 6)
+            r.raise_for_status()
+            stored = set(r.json().get("stored", []))
+        except Exception as e:
+            log(f"Pull of {len(group)} chunk(s) from {source} to {target} failed: {e}", context=context)
+            stored = set()
+        done = [c for c in group if c["id"] in stored]
+        failed += [c["id"] for c in group if c["id"] not in stored]
+        if not done:
+            continue
+        recorded = relocate_chunks([{"id": c["id"], "from": replaces, "to": target, "sha256": c.get("sha256")}
+                                    for c in done])
+        # a chunk whose file was deleted or uploaded again meanwhile is not
+        # recorded; its copy on `target` is left as garbage
+        failed += [c["id"] for c in done if c["id"] not in recorded]
+        done = [c for c in done if c["id"] in recorded]
+        if replaces == source and done:
+            # the copy on `target` is authoritative now; a failed delete only leaves garbage
+            delete_chunks([{"id": c["id"], "nodes": [source]} for c in done])
+        copied += done
+        log(f"Copied {len(done)} chunk(s) {source} → {target}, replacing {replaces}", context=context)
+    return copied, failed
+
+def migrate(source, chunks, dst=None):
+    """
+    Moves chunk entries off `source` (see transfer), counted in
+    REBALANCE_STATS. Returns (moved ids, failed ids).
+    """
+    moved, failed = transfer(source, chunks, dst)
+    REBALANCE_STATS["moved_chunks"] += len(moved)
+    REBALANCE_STATS["moved_bytes"] += sum(chunk_bytes(c) for c in moved)
+    REBALANCE_STATS["failed_chunks"] += len(failed)
+    return [c["id"] for c in moved], failed
+
+def ring_round():
+    """
+    DFS_PLACEMENT=ring: moves chunk replicas that are no longer where this
+    cluster's ring puts them (a node joined, left, filled up or changed
+    weight) onto the node it does, so locations stay computable from the
+    ring. Only chunks whose preference list changed move, about 1/N of
+    them per joined node; one replica per chunk and at most ROUND_MB per
+    round. Returns the plan.
+    """
+    moves, budget = {}, ROUND_MB * 1024 * 1024
+    for chunk in chunks_on(NODES):
+        held = [n for n in chunk["nodes"] if n in NODES]
+        wanted = ring_preference(chunk["id"], len(held))
+        src = next((n for n in held if n not in wanted
+                    and NODE_HEARTBEATS.get(n, {}).get("status") == "alive"), None)
+        dst = next((n for n in wanted if n not in taken(chunk) and has_room(n)), None)
+        if src and dst:
+            moves.setdefault((src, dst), []).append(chunk)
+            budget -= chunk_bytes(chunk)
+            if budget <= 0:
+                break
+    for (src, dst), chunks in moves.items():
+        log(f"Moving {len(chunks)} chunk(s) {src} → {dst} to their ring position", context="REBALANCE")
+        migrate(src, chunks, dst)
+    return [(src, dst, sum(chunk_bytes(c) for c in chunks)) for (src, dst), chunks in moves.items()]
+
+def rebalance_round():
+    """
+    Plans moves between this cluster's alive nodes from their stored
+    bytes per unit of capacity and carries them out (with
+    DFS_PLACEMENT=ring: moves chunks to their ring position). Returns the
+    plan.
+    """
+    if PLACEMENT_MODE == "ring":
+        with _rebalance_lock:
+            plan = ring_round()
+            REBALANCE_STATS["last_plan"] = [{"from": s, "to": d, "bytes": b} for s, d, b in plan]
+            REBALANCE_STATS["rounds"] += 1
+        return plan
+    alive = {n: hb for n, hb in NODE_HEARTBEATS.items() if hb.get("status") == "alive" and hb.get("capacity_mb")}
+    plan = plan_moves(
+        {n: hb.get("stored_bytes", 0) for n, hb in alive.items()},
+        {n: capacity_weight(hb["capacity_mb"]) for n, hb in alive.items()}
+    )
+    with _rebalance_lock:
+        REBALANCE_STATS["last_plan"] = [{"from": s, "to": d, "bytes": b} for s, d, b in plan]
+        for src, dst, amount in plan:
+            picked, total = [], 0
+            for chunk in chunks_on([src]):
+                if total >= amount:
+                    break
+                if dst not in taken(chunk):
+                    picked.append(chunk)
+                    total += chunk_bytes(chunk)
+            if picked:
+                log(f"Rebalancing {total} bytes in {len(picked)} chunk(s) {src} → {dst}", context="REBALANCE")
+                migrate(src, picked, dst)
+        REBALANCE_STATS["rounds"] += 1
+    return plan
+
+def rebalancer():
+    """
+    Runs a rebalance round every DFS_REBALANCE_INTERVAL seconds (with 0,
+    only when asked), and right away when POST /rebalance asks. With
+    DFS_PLACEMENT=ring a timed round only runs once the ring or the set of
+    nodes with room changed, until every chunk is back in its ring position.
+    """
+    settled = None  # ring state every chunk has been moved for
+    while True:
+        asked = _rebalance_now.wait(REBALANCE_INTERVAL if REBALANCE_INTERVAL > 0 else None)
+        _rebalance_now.clear()
+        try:
+            if PLACEMENT_MODE != "ring":
+                rebalance_round()
+                continue
+            state = (dict(NODE_RING.members), {n for n in NODES if has_room(n)})
+            if (asked or state != settled) and not rebalance_round():
+                settled = state
+        except Exception as e:
+            log(f"Rebalance round failed: {e}", context="REBALANCE")
+
+# ——— Re-replication ———
+
+REPAIR_GRACE = float(os.getenv("DFS_REPAIR_GRACE", "5"))                   # seconds a node stays down before its chunks are copied elsewhere
+REPAIR_INTERVAL = 2                                                        # seconds between repair rounds
+REPAIR_THROTTLE = Throttle(float(os.getenv("DFS_REPAIR_BANDWIDTH_MB", "32")) * 1024 * 1024)
+REPAIR_STATS = {"under_replicated": 0, "lost": 0, "repaired_chunks": 0, "repaired_bytes": 0, "failed_chunks": 0}
+
+def repair_round():
+    """
+    Counts the chunks with a replica on a down node as under-replicated,
+    and re-replicates those whose node has been down for longer than
+    REPAIR_GRACE: an alive node of this cluster pulls each from a
+    surviving replica and the metadata swaps the dead node for the new
+    one. The grace runs from when the node went down; nodes never heard
+    from are left alone. Chunks with the fewest surviving replicas go first. Chunks with
+    none are counted as lost; erasure-coded ones stay readable by
+    reconstruction from their stripe.
+    """
+    now  = time.time()
+    down = {n for n in NODES if NODE_HEARTBEATS.get(n, {}).get("status") == "down"}
+    # a node this manager never heard from may just not be started yet
+    dead = {n for n in down if NODE_HEARTBEATS[n].get("last_seen")
+            and now - NODE_HEARTBEATS[n]["down_since"] > REPAIR_GRACE}
+    if not down:
+        REPAIR_STATS.update(under_replicated=0, lost=0)
+        return
+    alive = {n for n in NODES if NODE_HEARTBEATS.get(n, {}).get("status") == "alive"}
+    queue, under, lost = [], 0, 0
+    for chunk in chunks_on(down):
+        survivors = [n for n in chunk["nodes"] if n not in down]
+        under += 1
+        if not survivors:
+            lost += 1
+        elif dead.intersection(chunk["nodes"]):
+            queue.append((len(survivors), chunk, survivors))
+    REPAIR_STATS.update(under_replicated=under, lost=lost)
+    if not queue:
+        return
+
+    # one batch per (surviving source, dead replica), most endangered first
+    batches_by_pair = {}
+    for _, chunk, survivors in sorted(queue, key=lambda q: q[0]):
+        source = next((n for n in survivors if n in alive), survivors[0])
+        dead_replica = next(n for n in chunk["nodes"] if n in dead)
+        batches_by_pair.setdefault((source, dead_replica), []).append(chunk)
+    log(f"{len(queue)} chunk(s) under-replicated on {sorted(dead)}, {lost} lost", context="REPAIR")
+    for (source, dead_replica), chunks in batches_by_pair.items():
+        copied, failed = transfer(source, chunks, replaces=dead_replica,
+                                  throttle=REPAIR_THROTTLE, context="REPAIR")
+        REPAIR_STATS["under_replicated"] -= len(copied)
+        REPAIR_STATS["repaired_chunks"] += len(copied)
+        REPAIR_STATS["repaired_bytes"] += sum(chunk_bytes(c) for c in copied)
+        REPAIR_STATS["failed_chunks"] += len(failed)
+
+def repair_monitor():
+    while True:
+        time.sleep(REPAIR_INTERVAL)
+        try:
+            repair_round()
+        except Exception as e:
+            log(f"Repair round failed: {e}", context="REPAIR")
 
 # ——— HTTP Endpoints ———
 
 @app.route('/upload_chunk', methods=['POST'])
 def upload_chunk():
+    """
+    Stores a chunk on the best local node, then forwards it down the
+    replication pipeline: `forward_to` is a JSON list of cluster manager
+    URLs still to receive a replica, `exclude_nodes` the nodes that
+    already hold one. Each hop is store-and-forward (the next hop starts
+    once the local copy is stored, so a failed store never leaves
+    replicas further down), so replica latencies add up along the chain. An optional `checksum` (hex sha256) travels with
+    the chunk to every node, which rejects corrupted bytes with 422, and
+    an optional `file_id` stripes a file's chunks across nodes.
+    Responds with every node the chunk landed on.
+    """
     chunk    = request.files.get("chunk")
     chunk_id = request.form.get("chunk_id")
     if not chunk or not chunk_id:
         log("Missing chunk or chunk_id", context="CLUSTER")
         return jsonify({"error": "Missing chunk or chunk_id"}), 400
 
-    node = select_best_node()
+    try:
+        forward_to = json.loads(request.form.get("forward_to", "[]"))
+        exclude    = json.loads(request.form.get("exclude_nodes", "[]"))
+    except ValueError:
+        forward_to = None
+    if not isinstance(forward_to, list) or not isinstance(exclude, list):
+        return jsonify({"error": "forward_to and exclude_nodes must be JSON lists"}), 400
+    checksum   = request.form.get("checksum", "")
+    file_id    = request.form.get("file_id", "")
+    data       = chunk.read()
+
+    node = select_best_node(exclude=exclude, file_id=file_id, chunk_id=chunk_id)
     if not node:
         return jsonify({"error": "No available nodes"}), 503
 
+    started = time.perf_counter()
     try:
-        r = requests.post(
-            f"{node}/store",
-            files={"chunk": (chunk.filename, chunk.stream, chunk.mimetype)},
-            data={"chunk_id": chunk_id},
-            timeout=DEFAULT_TIMEOUT
-        )
+        with PLACEMENT.reservation([node]):
+            r = transport.post(
+                f"{node}/store",
+                files={"chunk": (chunk_id, data)},
+                data={"chunk_id": chunk_id, "checksum": checksum, "token": tokens.issue(node, chunk_id) or ""},
+                timeout=DEFAULT_TIMEOUT
+            )
+        if r.status_code == 422:
+            log(f"Node {node} rejected {chunk_id}: checksum mismatch", context="CLUSTER")
+            return jsonify(r.json()), 422
         r.raise_for_status()
+        PLACEMENT.observe(node, (time.perf_counter() - started) * 1000)
         log(f"Forwarded {chunk_id} to {node}", context="CLUSTER")
-        return jsonify({"status": "stored", "node": node, "chunk_id": chunk_id}), 200
     except Exception as e:
+        # count the failure as a timeout so the node drops down the ranking
+        PLACEMENT.observe(node, DEFAULT_TIMEOUT * 1000)
         log(f"Upload to node {node} failed: {e}", context="CLUSTER")
         return jsonify({"error": str(e)}), 500
 
+    nodes = [node]
+    if forward_to:
+        # next hop in the pipeline; a failure there leaves this replica in place
+        try:
+            r = transport.post(
+                f"{forward_to[0]}/upload_chunk",
+                files={"chunk": (chunk_id, data)},
+                data={
+                    "chunk_id":      chunk_id,
+                    "checksum":      checksum,
+                    "file_id":       file_id,
+                    "forward_to":    json.dumps(forward_to[1:]),
+                    "exclude_nodes": json.dumps(exclude + nodes)
+                },
+                timeout=DEFAULT_TIMEOUT * (len(forward_to) + 1)
+            )
+            r.raise_for_status()
+            nodes += r.json().get("nodes", [])
+        except Exception as e:
+            log(f"Replica forward of {chunk_id} to {forward_to[0]} failed: {e}", context="CLUSTER")
+
+    return jsonify({"status": "stored", "node": node, "nodes": nodes, "chunk_id": chunk_id}), 200
+
+@app.route('/place', methods=['POST'])
+def place():
+    """
+    Chooses a node for each chunk without receiving it, so the client can
+    write straight to the node (with a token from the global balancer).
+    Body: {"chunks": [{"id", "exclude": [nodes]}], "file_id"}; responds
+    {"nodes": {chunk_id: node or null}}.
+    """
+    body   = request.get_json(silent=True) or {}
+    chunks = body.get("chunks")
+    if not isinstance(chunks, list) or not all(isinstance(c, dict) and c.get("id") for c in chunks):
+        return jsonify({"error": "Body must be {\"chunks\": [{\"id\", \"exclude\"}, ...]}"}), 400
+    file_id = body.get("file_id", "")
+    return jsonify({"nodes": {
+        c["id"]: select_best_node(exclude=c.get("exclude") or [], file_id=file_id, chunk_id=c["id"])
+        for c in chunks
+    }}), 200
+
 @app.route('/status', methods=['GET'])
 def cluster_status():
     """
     Returns aggregate cluster info plus a summary of node heartbeats.
     """
-    total_free   = 0
-    total_chunks = 0
-    active_nodes = 0
-
-    for node, hb in NODE_HEARTBEATS.items():
-        total_free   += hb.get("free_mb", 0)
-        total_chunks += hb.get("chunk_count", 0)
-        if hb.get("status") == "alive":
-            active_nodes += 1
-
     return jsonify({
-        "cluster_free_mb":    total_free,
-        "cluster_chunk_count": total_chunks,
-        "active_nodes":        active_nodes,
-        "node_heartbeats":     NODE_HEARTBEATS
+        **cluster_summary(),
+        "node_heartbeats": NODE_HEARTBEATS,
+        "placement":       PLACEMENT.stats(),
+        "rebalance":       REBALANCE_STATS,
+        "repair":          REPAIR_STATS
     }), 200
 
+@app.route('/migrate', methods=['POST'])
+def migrate_in():
+    """
+    Moves chunks from a node (usually in another cluster) onto this
+    cluster's nodes. Body: {"source": node_url, "chunks": [chunk entries]}.
+    """
+    body   = request.get_json(silent=True) or {}
+    source = body.get("source")
+    chunks = body.get("chunks")
+    if not source or not isinstance(chunks, list):
+        return jsonify({"error": "Body must be {\"source\", \"chunks\": [...]}"}), 400
+    moved, failed = migrate(source, chunks)
+    return jsonify({"moved": moved, "failed": failed}), 200 if not failed else 207
+
+@app.route('/rebalance', methods=['GET', 'POST'])
+def rebalance():
+    """
+    GET: migration counters and the last plan. POST: starts a round in the
+    background (poll GET for its outcome; "rounds" goes up when it ends).
+    """
+    if request.method == 'POST':
+        _rebalance_now.set()
+        return jsonify({**REBALANCE_STATS, "status": "started", "throttled_bytes": THROTTLE.total}), 202
+    return jsonify({**REBALANCE_STATS, "throttled_bytes": THROTTLE.total}), 200
+
+@app.route('/heartbeat', methods=['POST'])
+def receive_heartbeat():
+    """
+    Push endpoint for node heartbeats: the node's /status body plus its
+    own `url`, which must be one of NODES.
+    """
+    data = request.get_json(silent=True) or {}
+    node = data.get("url")
+    if node not in NODES:
+        return jsonify({"error": f"Unknown node: {node}"}), 404
+    record_node_heartbeat(node, data, source="push")
+    return jsonify({"status": "ok"}), 200
+
+@app.route('/ring', methods=['GET'])
+def ring():
+    """
+    This cluster's node ring: members and their capacity weights.
+    """
+    return jsonify(NODE_RING.to_dict()), 200
+
+@app.route('/locate', methods=['GET'])
+def locate():
+    """
+    A chunk's nodes in ring preference order: ?chunk_id=...
+    """
+    chunk_id = request.args.get("chunk_id")
+    if not chunk_id:
+        return jsonify({"error": "Missing chunk_id"}), 400
+    return jsonify({"chunk_id": chunk_id, "nodes": NODE_RING.lookup(chunk_id, len(NODE_RING))}), 200
+
 @app.route('/node_heartbeats', methods=['GET'])
 def node_heartbeats():
     """
@@ -174,6 +586,13 @@ def node_heartbeats():
     """
     return jsonify(NODE_HEARTBEATS), 200
 
+@app.route('/pool_stats', methods=['GET'])
+def pool_stats():
+    """
+    Connection pool counters for this manager's calls to its nodes.
+    """
+    return jsonify(transport.pool_stats()), 200
+
 @app.route('/', methods=['GET'])
 def index():
     return "Cluster Manager is running", 200
@@ -181,12 +600,22 @@ def index():
 # ——— Launcher ———
 
 if __name__ == '__main__':
-    # start the background monitor thread
-    threading.Thread(target=node_heartbeat_monitor, daemon=True).start()
-
     import argparse
     parser = argparse.ArgumentParser(description="DFS Cluster Manager")
     parser.add_argument('--port', type=int, default=7001)
+    parser.add_argument('--heartbeat-url', default=HEARTBEAT_URL,
+                        help='Global balancer to push heartbeats to (default: $DFS_HEARTBEAT_URL)')
+    parser.add_argument('--url', help='URL the global balancer knows this cluster by (default: http://localhost:<port>)')
     args = parser.parse_args()
 
+    # debug=True re-runs this script in a reloader child that does the
+    # serving; only that process monitors and pushes
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        threading.Thread(target=node_heartbeat_monitor, daemon=True).start()
+        threading.Thread(target=rebalancer, daemon=True).start()
+        threading.Thread(target=repair_monitor, daemon=True).start()
+        if args.heartbeat_url:
+            cluster_url = args.url or f"http://localhost:{args.port}"
+            start_pusher(args.heartbeat_url, lambda: {"url": cluster_url, **cluster_summary()})
+
     app.run(host='0.0.0.0', port=args.port, debug=True)
@@ -5,7 +5,7 @@ import sys
 import json
 import threading
 import time
-import requests
+from collections import Counter
 
 from flask import Flask, request, jsonify, abort
 from flask_cors import CORS
@@ -13,6 +13,15 @@ from flask_cors import CORS
 # make sure we can import our shared log/timeout helpers
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from dfs.load_balancers import log, DEFAULT_TIMEOUT
+from dfs.core import transport, tokens
+from dfs.core.heartbeat import poll_all, stale, STALE_AFTER
+from dfs.core.placement import Placement, MODE as PLACEMENT_MODE
+from dfs.core.hash_ring import Topology, VNODES
+from dfs.core.rebalance import (
+    plan_moves, INTERVAL as REBALANCE_INTERVAL, MOVE_BATCH, ROUND_MB
+)
+from dfs.core.batch import batches
+from dfs.core.metadata import chunks_on
 
 app = Flask(__name__)
 CORS(app)  # allow cross-origin requests from your front-end
@@ -30,89 +39,383 @@ else:
     log(f"Clusters configured: {list(CLUSTERS.keys())}", context="GLOBAL")
 
 # —— Heartbeat state —— 
-CLUSTER_HEARTBEATS = {}        # { cluster_name: {last_seen, free_mb, status} }
-HEARTBEAT_INTERVAL = 30        # seconds (was 10)
+CLUSTER_HEARTBEATS = {}        # { cluster_name: {last_seen, status, source, free_mb, chunk_count, stored_bytes, active_nodes, inflight, max_p99_ms, under_replicated} }
+HEARTBEAT_INTERVAL = 1         # seconds between checks for stale clusters (was 30)
+MIN_FREE_MB = 100              # clusters with less free space get no new chunks
 
-def get_cluster_status(url):
+PLACEMENT = Placement()
+CLUSTER_RINGS = {}             # { cluster_name: {node_url: weight} }, from heartbeats
+_topology = Topology({})
+
+def cluster_name(url):
+    return next((n for n, v in CLUSTERS.items() if v == url), None)
+
+def record_cluster_heartbeat(name, data, source):
     """
-    Ping a cluster manager's /status endpoint.
+    Stores a cluster summary that arrived by push or poll; logs only when
+    a cluster comes (back) up.
     """
-    try:
-        r = requests.get(f"{url}/status", timeout=DEFAULT_TIMEOUT)
-        r.raise_for_status()
-        data = r.json()
-        name = next((n for n,v in CLUSTERS.items() if v == url), url)
-        return {
-            "url": url,
-            "name": name,
-            "free_mb": data.get("cluster_free_mb", 0)
-        }
-    except Exception as e:
-        log(f"Cluster {url} unreachable: {e}", context="GLOBAL")
-        return None
+    prev = CLUSTER_HEARTBEATS.get(name, {})
+    CLUSTER_HEARTBEATS[name] = {
+        "last_seen":        time.time(),
+        "status":           "alive",
+        "source":           source,
+        "free_mb":          data.get("cluster_free_mb", 0),
+        "chunk_count":      data.get("cluster_chunk_count", 0),
+        "stored_bytes":     data.get("cluster_stored_bytes", 0),
+        "active_nodes":     data.get("active_nodes", 0),
+        "inflight":         data.get("inflight", 0),
+        "max_p99_ms":       data.get("max_p99_ms", 0),
+        "under_replicated": data.get("under_replicated", 0)
+    }
+    if data.get("ring_nodes"):
+        CLUSTER_RINGS[name] = data["ring_nodes"]
+    if prev.get("status") != "alive":
+        log(f"Heartbeat OK from {name} ({source})", context="HEARTBEAT")
+
+def topology():
+    """
+    The two-level hash ring over every cluster that has reported nodes;
+    rebuilt only when membership or weights change.
+    """
+    global _topology
+    data = {
+        "vnodes":   VNODES,
+        "clusters": {n: {"url": CLUSTERS[n], "nodes": nodes} for n, nodes in CLUSTER_RINGS.items()}
+    }
+    if data != _topology.data:
+        _topology = Topology(data)
+    return _topology
+
+def mark_cluster_down(name):
+    prev = CLUSTER_HEARTBEATS.get(name, {})
+    if time.time() - prev.get("last_seen", 0) <= STALE_AFTER:
+        return  # a push landed while the poll was failing
+    CLUSTER_HEARTBEATS[name] = {
+        **prev,
+        "last_seen": prev.get("last_seen", 0),
+        "status":    "down",
+        "free_mb":   0,
+        "inflight":  0
+    }
+    if prev.get("status") != "down":
+        log(f"❌ No heartbeat from {name}", context="HEARTBEAT")
 
 def heartbeat_monitor():
     """
-    Background thread: periodically refresh CLUSTER_HEARTBEATS.
+    Cluster managers push summaries to /heartbeat. Every
+    HEARTBEAT_INTERVAL this polls only the clusters whose last heartbeat
+    has gone stale, all at once with a per-cluster deadline, and marks
+    those that do not answer as down.
     """
     while True:
-        for name, url in CLUSTERS.items():
-            status = get_cluster_status(url)
-            if status:
-                CLUSTER_HEARTBEATS[name] = {
-                    "last_seen": time.time(),
-                    "free_mb":   status["free_mb"],
-                    "status":    "alive"
-                }
-                log(f"Heartbeat OK from {name}", context="HEARTBEAT")
+        names = stale(CLUSTER_HEARTBEATS, list(CLUSTERS))
+        polled = poll_all([CLUSTERS[n] for n in names])
+        for name in names:
+            data = polled[CLUSTERS[name]]
+            if data is None:
+                mark_cluster_down(name)
             else:
-                prev = CLUSTER_HEARTBEATS.get(name, {})
-                CLUSTER_HEARTBEATS[name] = {
-                    "last_seen": prev.get("last_seen", 0),
-                    "free_mb":   0,
-                    "status":    "down"
-                }
-                log(f"❌ No heartbeat from {name}", context="HEARTBEAT")
+                record_cluster_heartbeat(name, data, source="poll")
         time.sleep(HEARTBEAT_INTERVAL)
 
+# —— Rebalancing across clusters —— 
+REBALANCE_STATS = {"rounds": 0, "moved_chunks": 0, "moved_bytes": 0, "failed_chunks": 0, "last_plan": []}
+_rebalance_lock = threading.Lock()
+_rebalance_now = threading.Event()  # set by POST /rebalance
+
+def send_moves(src, dst, by_source):
+    """
+    Hands chunk entries, grouped by the node holding them in cluster
+    `src`, to cluster `dst`'s manager, which pulls them onto its nodes
+    (see /migrate), in MOVE_BATCH batches. That manager's pulls go
+    through its bandwidth throttle, so none is applied here.
+    """
+    for source, chunks in ((s, b) for s, g in by_source.items() for b in batches(g, MOVE_BATCH)):
+        try:
+            r = transport.post(f"{CLUSTERS[dst]}/migrate", json={"source": source, "chunks": chunks},
+                               timeout=DEFAULT_TIMEOUT * 12)
+            r.raise_for_status()
+            moved = set(r.json().get("moved", []))
+        except Exception as e:
+            log(f"Migration of {len(chunks)} chunk(s) {src} → {dst} failed: {e}", context="REBALANCE")
+            moved = set()
+        REBALANCE_STATS["moved_chunks"] += len(moved)
+        REBALANCE_STATS["moved_bytes"] += sum(c.get("stored_size") or c.get("size") or 0
+                                              for c in chunks if c["id"] in moved)
+        REBALANCE_STATS["failed_chunks"] += len(chunks) - len(moved)
+        log(f"Moved {len(moved)}/{len(chunks)} chunk(s) from {source} ({src}) to {dst}", context="REBALANCE")
+
+def ring_round():
+    """
+    DFS_PLACEMENT=ring: moves replicas that sit in a cluster the
+    top-level ring no longer picks for their chunk (a cluster joined,
+    left or changed weight) to the one it does; the destination manager
+    then puts them on its ring node. Only chunks whose cluster order
+    changed move, one replica per chunk and at most ROUND_MB per round.
+    Returns the plan.
+    """
+    ring = topology()
+    cluster_of = {node: name for name, nodes in CLUSTER_RINGS.items() for node in nodes}
+    alive = {n for n, hb in CLUSTER_HEARTBEATS.items() if hb.get("status") == "alive"}
+    moves, budget = {}, ROUND_MB * 1024 * 1024
+    for chunk in chunks_on(cluster_of):
+        order = ring.cluster_order(chunk["id"])
+        held = Counter(cluster_of[n] for n in chunk["nodes"] if n in cluster_of)
+        if not order or not held:
+            continue
+        wanted = Counter(order[i % len(order)] for i in range(sum(held.values())))
+        src = next((c for c in held - wanted if c in alive), None)
+        stripe = set(chunk.get("stripe_nodes", []))  # a cluster needs a node without a shard of it
+        dst = next((c for c in wanted - held if c in alive and set(CLUSTER_RINGS[c]) - stripe), None)
+        if src and dst:
+            source = next(n for n in chunk["nodes"] if cluster_of.get(n) == src)
+            moves.setdefault((src, dst), {}).setdefault(source, []).append(chunk)
+            budget -= chunk.get("stored_size") or chunk.get("size") or 0
+            if budget <= 0:
+                break
+    plan = [(src, dst, sum(c.get("stored_size") or c.get("size") or 0 for g in by_source.values() for c in g))
+            for (src, dst), by_source in moves.items()]
+    with _rebalance_lock:
+        REBALANCE_STATS["last_plan"] = [{"from": s, "to": d, "bytes": b} for s, d, b in plan]
+        for (src, dst), by_source in moves.items():
+            send_moves(src, dst, by_source)
+        REBALANCE_STATS["rounds"] += 1
+    return plan
+
+def rebalance_round():
+    """
+    Plans moves between alive clusters from their stored bytes per unit
+    of capacity (the sum of their nodes' ring weights). Chunks leave the
+    source cluster's nodes for the destination cluster manager's /migrate,
+    never onto a cluster that already holds a replica, so replicas stay
+    in distinct clusters. With DFS_PLACEMENT=ring moves chunks to their
+    ring clusters instead (see ring_round). Returns the plan.
+    """
+    if PLACEMENT_MODE == "ring":
+        return ring_round()
+    alive = [n for n, hb in CLUSTER_HEARTBEATS.items() if hb.get("status") == "alive" and CLUSTER_RINGS.get(n)]
+    plan = plan_moves(
+        {n: CLUSTER_HEARTBEATS[n].get("stored_bytes", 0) for n in alive},
+        {n: sum(CLUSTER_RINGS[n].values()) for n in alive}
+    )
+    with _rebalance_lock:
+        REBALANCE_STATS["last_plan"] = [{"from": s, "to": d, "bytes": b} for s, d, b in plan]
+        for src, dst, amount in plan:
+            src_nodes, dst_nodes = set(CLUSTER_RINGS[src]), set(CLUSTER_RINGS[dst])
+            by_source, total = {}, 0
+            for chunk in chunks_on(src_nodes):
+                if total >= amount:
+                    break
+                if dst_nodes.intersection(chunk["nodes"]) or not dst_nodes - set(chunk.get("stripe_nodes", [])):
+                    continue  # a replica there already, or every node holds a shard of its stripe
+                source = next(n for n in chunk["nodes"] if n in src_nodes)
+                by_source.setdefault(source, []).append(chunk)
+                total += chunk.get("stored_size") or chunk.get("size") or 0
+            send_moves(src, dst, by_source)
+        REBALANCE_STATS["rounds"] += 1
+    return plan
+
+def rebalancer():
+    """
+    Runs a cross-cluster rebalance round every DFS_REBALANCE_INTERVAL
+    seconds (with 0, only when asked), and right away when POST /rebalance
+    asks. With DFS_PLACEMENT=ring a timed round only runs once the
+    topology or the set of alive clusters changed, until every chunk is
+    back in its ring clusters.
+    """
+    settled = None  # topology every chunk has been moved for
+    while True:
+        asked = _rebalance_now.wait(REBALANCE_INTERVAL if REBALANCE_INTERVAL > 0 else None)
+        _rebalance_now.clear()
+        try:
+            if PLACEMENT_MODE != "ring":
+                rebalance_round()
+                continue
+            state = (topology().data, {n for n, hb in CLUSTER_HEARTBEATS.items() if hb.get("status") == "alive"})
+            if (asked or state != settled) and not rebalance_round():
+                settled = state
+        except Exception as e:
+            log(f"Rebalance round failed: {e}", context="REBALANCE")
+
+# —— Cluster selection —— 
+def cluster_loads():
+    """
+    Clusters that can take chunks now, with the loads they are ranked by.
+    """
+    return {
+        n: {
+            "inflight":   v.get("inflight", 0),
+            "capacity":   v.get("active_nodes", 1),
+            "latency_ms": v.get("max_p99_ms", 0)
+        }
+        for n, v in CLUSTER_HEARTBEATS.items()
+        if v["status"] == "alive" and v["free_mb"] >= MIN_FREE_MB
+    }
+
+def rank_clusters(chunk_id, loads, file_id):
+    """
+    Best clusters first for a chunk: its ring order with DFS_PLACEMENT=ring,
+    otherwise power of two choices over `loads`.
+    """
+    if PLACEMENT_MODE == "ring":
+        ring_order = [n for n in topology().cluster_order(chunk_id) if n in loads]
+        return ring_order + [n for n in loads if n not in ring_order]
+    return PLACEMENT.rank(list(loads), loads, file_id)
+
 # —— API Endpoints —— 
 
 @app.route('/upload_chunk', methods=['POST'])
 def upload_chunk():
     """
     Receives a chunk and forwards it to the best cluster manager.
+    With `replicas` = R > 1 the chunk is pipelined through R cluster
+    managers, distinct clusters first, each storing one replica.
+    `exclude_nodes` (JSON list) are nodes the chunk must not land on; when
+    a cluster has no other node the next cluster is tried. An optional
+    `checksum` is passed through for the nodes to verify.
+
+    Clusters are ranked by power of two choices over latency and queue
+    depth per live node (reported in-flight requests plus chunks being
+    forwarded from here), holding the fewest chunks of `file_id` first,
+    so a file's chunks stripe across clusters.
     """
     chunk = request.files.get("chunk")
     chunk_id = request.form.get("chunk_id")
     if not chunk or not chunk_id:
         return jsonify({"error": "Missing chunk or chunk_id"}), 400
+    try:
+        replicas = max(1, int(request.form.get("replicas", 1)))
+        exclude  = json.loads(request.form.get("exclude_nodes", "[]"))
+    except ValueError:
+        exclude = None
+    if not isinstance(exclude, list):
+        return jsonify({"error": "replicas must be an integer and exclude_nodes a JSON list"}), 400
 
-    alive = [n for n,v in CLUSTER_HEARTBEATS.items() if v["status"] == "alive"]
-    if not alive:
+    file_id = request.form.get("file_id", "")
+
+    loads = cluster_loads()
+    if not loads:
         return jsonify({"error": "No available clusters"}), 503
 
-    best       = max(alive, key=lambda n: CLUSTER_HEARTBEATS[n]["free_mb"])
-    target_url = CLUSTERS[best]
+    # best clusters first; wrap around when there are fewer clusters than replicas
+    ranked = rank_clusters(chunk_id, loads, file_id)
+    for first in range(len(ranked)):
+        pipeline   = [ranked[(first + i) % len(ranked)] for i in range(replicas)]
+        best       = pipeline[0]
+        target_url = CLUSTERS[best]
+        PLACEMENT.record(file_id, pipeline)
+        try:
+            chunk.stream.seek(0)
+            started = time.perf_counter()
+            with PLACEMENT.reservation(pipeline):
+                r = transport.post(
+                    f"{target_url}/upload_chunk",
+                    files={"chunk": (chunk.filename, chunk.stream, chunk.mimetype)},
+                    data={
+                        "chunk_id":      chunk_id,
+                        "checksum":      request.form.get("checksum", ""),
+                        "file_id":       file_id,
+                        "forward_to":    json.dumps([CLUSTERS[n] for n in pipeline[1:]]),
+                        "exclude_nodes": json.dumps(exclude)
+                    },
+                    timeout=DEFAULT_TIMEOUT * replicas
+                )
+            if r.status_code == 503 and exclude:
+                log(f"{best} has no node outside {exclude} for {chunk_id}", context="GLOBAL")
+                continue
+            if r.status_code == 422:
+                log(f"{chunk_id} failed checksum verification in {best}", context="GLOBAL")
+                return jsonify(r.json()), 422
+            r.raise_for_status()
+            # per replica, so pipelines of different lengths compare fairly
+            PLACEMENT.observe(best, (time.perf_counter() - started) * 1000 / replicas)
+            resp = r.json()
+            nodes = resp.get("nodes") or [resp.get("node", "unknown")]
+            log(f"Forwarded {chunk_id} to {best} ({len(nodes)}/{replicas} replicas)", context="GLOBAL")
+            return jsonify({
+                "status":  "stored",
+                "cluster": best,
+                "node":    nodes[0],
+                "nodes":   nodes,
+                "chunk_id": chunk_id
+            }), 200
+        except Exception as e:
+            PLACEMENT.observe(best, DEFAULT_TIMEOUT * 1000)
+            log(f"Upload to cluster {best} failed: {e}", context="GLOBAL")
+            return jsonify({"error": str(e)}), 500
+    return jsonify({"error": "No available node outside exclude_nodes"}), 503
 
+@app.route('/place', methods=['POST'])
+def place():
+    """
+    Placement without the data, for clients that write chunks straight to
+    the nodes. Body: {"chunks": [chunk ids], "replicas": R, "file_id"}.
+    Clusters are chosen per chunk as for /upload_chunk, and each replica
+    level asks every cluster involved for its nodes in one call. Responds
+    {"placements": {chunk_id: {"cluster", "nodes", "tokens": {node: token}}}};
+    a chunk no node could take has empty "nodes".
+    """
+    body      = request.get_json(silent=True) or {}
+    chunk_ids = body.get("chunks")
+    if not isinstance(chunk_ids, list) or not all(isinstance(c, str) for c in chunk_ids):
+        return jsonify({"error": "Body must be {\"chunks\": [chunk ids], \"replicas\"}"}), 400
     try:
-        r = requests.post(
-            f"{target_url}/upload_chunk",
-            files={"chunk": (chunk.filename, chunk.stream, chunk.mimetype)},
-            data={"chunk_id": chunk_id},
-            timeout=DEFAULT_TIMEOUT
-        )
-        r.raise_for_status()
-        resp = r.json()
-        log(f"Forwarded {chunk_id} to {best}", context="GLOBAL")
-        return jsonify({
-            "status":  "stored",
-            "cluster": best,
-            "node":    resp.get("node", "unknown"),
-            "chunk_id": chunk_id
-        }), 200
-    except Exception as e:
-        log(f"Upload to cluster {best} failed: {e}", context="GLOBAL")
-        return jsonify({"error": str(e)}), 500
+        replicas = max(1, int(body.get("replicas", 1)))
+    except (TypeError, ValueError):
+        return jsonify({"error": "replicas must be an integer"}), 400
+    file_id = body.get("file_id", "")
+
+    loads = cluster_loads()
+    if not loads:
+        return jsonify({"error": "No available clusters"}), 503
+
+    pipelines = {}
+    for chunk_id in chunk_ids:
+        ranked = rank_clusters(chunk_id, loads, file_id)
+        pipelines[chunk_id] = [ranked[i % len(ranked)] for i in range(replicas)]
+        PLACEMENT.record(file_id, pipelines[chunk_id])
+
+    nodes = {chunk_id: [] for chunk_id in chunk_ids}
+    for level in range(replicas):
+        by_cluster = {}
+        for chunk_id, pipeline in pipelines.items():
+            by_cluster.setdefault(pipeline[level], []).append({"id": chunk_id, "exclude": nodes[chunk_id]})
+        for name, group in by_cluster.items():
+            try:
+                r = transport.post(f"{CLUSTERS[name]}/place",
+                                   json={"chunks": group, "file_id": file_id}, timeout=DEFAULT_TIMEOUT)
+                r.raise_for_status()
+                chosen = r.json().get("nodes", {})
+            except Exception as e:
+                log(f"Placement of {len(group)} chunk(s) in {name} failed: {e}", context="GLOBAL")
+                chosen = {}
+            for c in group:
+                if chosen.get(c["id"]):
+                    nodes[c["id"]].append(chosen[c["id"]])
+
+    log(f"Placed {len(chunk_ids)} chunk(s) × {replicas} for direct upload", context="GLOBAL")
+    return jsonify({"placements": {
+        chunk_id: {
+            "cluster": pipelines[chunk_id][0],
+            "nodes":   nodes[chunk_id],
+            "tokens":  {n: tokens.issue(n, chunk_id) for n in nodes[chunk_id]}
+        }
+        for chunk_id in chunk_ids
+    }}), 200
+
+@app.route('/heartbeat', methods=['POST'])
+def receive_heartbeat():
+    """
+    Push endpoint for cluster managers: their /status summary plus the
+    `url` they are listed under in CLUSTERS.
+    """
+    data = request.get_json(silent=True) or {}
+    name = cluster_name(data.get("url"))
+    if name is None:
+        return jsonify({"error": f"Unknown cluster: {data.get('url')}"}), 404
+    record_cluster_heartbeat(name, data, source="push")
+    return jsonify({"status": "ok"}), 200
 
 @app.route('/heartbeats', methods=['GET'])
 def heartbeats():
@@ -122,26 +425,71 @@ def heartbeats():
     """
     out = {}
     for name, info in CLUSTER_HEARTBEATS.items():
-        out[name] = {
-            "url":      CLUSTERS.get(name),
-            "status":   info["status"],
-            "free_mb":  info["free_mb"],
-            "last_seen": info["last_seen"]
-        }
+        out[name] = {"url": CLUSTERS.get(name), **info}
     return jsonify(out), 200
 
+@app.route('/ring', methods=['GET'])
+def ring():
+    """
+    Cluster and node membership with capacity weights: everything a client
+    needs to compute chunk locations (see dfs.core.hash_ring.Topology).
+    """
+    return jsonify(topology().data), 200
+
+@app.route('/locate', methods=['GET'])
+def locate():
+    """
+    Where a chunk's replicas live on the ring: ?chunk_id=...&replicas=R
+    """
+    chunk_id = request.args.get("chunk_id")
+    if not chunk_id:
+        return jsonify({"error": "Missing chunk_id"}), 400
+    try:
+        replicas = max(1, int(request.args.get("replicas", 1)))
+    except ValueError:
+        return jsonify({"error": "replicas must be an integer"}), 400
+    return jsonify({"chunk_id": chunk_id, "replicas": topology().locate(chunk_id, replicas)}), 200
+
+@app.route('/placement', methods=['GET'])
+def placement():
+    """
+    Reservations and latency EWMAs behind cluster selection.
+    """
+    return jsonify(PLACEMENT.stats()), 200
+
+@app.route('/rebalance', methods=['GET', 'POST'])
+def rebalance():
+    """
+    GET: migration counters and the last plan. POST: starts a round in the
+    background (poll GET for its outcome; "rounds" goes up when it ends).
+    """
+    if request.method == 'POST':
+        _rebalance_now.set()
+        return jsonify({**REBALANCE_STATS, "status": "started"}), 202
+    return jsonify(REBALANCE_STATS), 200
+
+@app.route('/pool_stats', methods=['GET'])
+def pool_stats():
+    """
+    Connection pool counters for calls to the cluster managers.
+    """
+    return jsonify(transport.pool_stats()), 200
+
 
 @app.route('/', methods=['GET'])
 def index():
     return "🌍 Global Load Balancer is running", 200
 
 if __name__ == '__main__':
-    # start our heartbeat monitor thread
-    threading.Thread(target=heartbeat_monitor, daemon=True).start()
-
     import argparse
     parser = argparse.ArgumentParser(description="Global Load Balancer")
     parser.add_argument('--port', type=int, default=6001)
     args = parser.parse_args()
 
+    # debug=True re-runs this script in a reloader child that does the
+    # serving; only that process monitors
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        threading.Thread(target=heartbeat_monitor, daemon=True).start()
+        threading.Thread(target=rebalancer, daemon=True).start()
+
     app.run(host='0.0.0.0', port=args.port, debug=True)
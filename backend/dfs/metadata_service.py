@@ -0,0 +1,175 @@
+# dfs/metadata_service.py
+
+import os
+import sys
+import time
+import threading
+
+from flask import Flask, request, jsonify
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from dfs.core.metadata_store import MetadataStore, SNAPSHOT_INTERVAL, valid_chunk_entry, valid_move, valid_metadata
+
+# The namespace (file → chunks → nodes, and shared chunk reference counts)
+# served from memory. Clients reach it through dfs.core.metadata when
+# DFS_METADATA_URL points here.
+
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+DATA_DIR = os.getenv("DFS_METADATA_DATA_DIR", os.path.join(BASE_DIR, "metadata_log"))  # WAL + snapshot
+
+app = Flask(__name__)
+store = None
+
+
+def _json_list(key):
+    body = request.get_json(silent=True) or {}
+    values = body.get(key)
+    return values if isinstance(values, list) else None
+
+
+def _chunk_list(key="chunks"):
+    """
+    The body's list of chunk entries, or None unless each has a string id.
+    """
+    chunks = _json_list(key)
+    return chunks if chunks is not None and all(map(valid_chunk_entry, chunks)) else None
+
+
+# ——— Files ———
+
+@app.route('/files', methods=['GET'])
+def list_files():
+    return jsonify({"files": store.list_files()}), 200
+
+@app.route('/files/<path:file_name>', methods=['GET'])
+def get_file(file_name):
+    metadata = store.get(file_name)
+    if metadata is None:
+        return jsonify({"error": f"No metadata for {file_name}"}), 404
+    return jsonify(metadata), 200
+
+@app.route('/files/lookup', methods=['POST'])
+def lookup_files():
+    """
+    Batched lookup. Body: {"files": [...]}; unknown files map to null.
+    """
+    names = _json_list("files")
+    if names is None:
+        return jsonify({"error": "Body must be {\"files\": [...]}"}), 400
+    return jsonify(store.get_many(names)), 200
+
+@app.route('/files/<path:file_name>', methods=['DELETE'])
+def delete_file(file_name):
+    if not store.delete(file_name):
+        return jsonify({"error": f"No metadata for {file_name}"}), 404
+    return jsonify({"status": "deleted"}), 200
+
+@app.route('/commit', methods=['POST'])
+def commit():
+    """
+    Atomically stores a file's metadata, with all its chunks, and with
+    "acquire" a reference to each chunk. With "replace" the previous
+    version's references are dropped in the same record. Body: {"file",
+    "metadata", "acquire", "replace"}; responds with the chunks no file
+    references any more.
+    """
+    body = request.get_json(silent=True) or {}
+    file_name, metadata = body.get("file"), body.get("metadata")
+    if not file_name or not isinstance(file_name, str) or not valid_metadata(metadata):
+        return jsonify({"error": "Body must be {\"file\", \"metadata\": {\"chunks\": [{\"id\", ...}, ...]}}"}), 400
+    unreferenced = store.commit(file_name, metadata, acquire=bool(body.get("acquire")),
+                                replace=bool(body.get("replace")))
+    return jsonify({"status": "committed", "file": file_name, "chunks": len(metadata["chunks"]),
+                    "unreferenced": unreferenced}), 200
+
+# ——— Chunks ———
+
+@app.route('/chunks/lookup', methods=['POST'])
+def lookup_chunks():
+    chunk_ids = _json_list("chunk_ids")
+    if chunk_ids is None or not all(isinstance(i, str) for i in chunk_ids):
+        return jsonify({"error": "Body must be {\"chunk_ids\": [...]}"}), 400
+    return jsonify(store.lookup_chunks(chunk_ids)), 200
+
+@app.route('/chunks/on', methods=['POST'])
+def chunks_on():
+    """
+    Chunks with a replica on any of the given nodes. Body: {"nodes": [...], "limit": n}.
+    """
+    body = request.get_json(silent=True) or {}
+    nodes = _json_list("nodes")
+    if nodes is None:
+        return jsonify({"error": "Body must be {\"nodes\": [...]}"}), 400
+    return jsonify({"chunks": store.chunks_on(nodes, body.get("limit"))}), 200
+
+@app.route('/chunks/relocate', methods=['POST'])
+def relocate_chunks():
+    """
+    Atomically records chunk moves. Body: {"moves": [{"id", "from", "to"}, ...]};
+    "from": null adds a replica.
+    """
+    moves = _json_list("moves")
+    if moves is None or not all(map(valid_move, moves)):
+        return jsonify({"error": "Body must be {\"moves\": [{\"id\", \"from\", \"to\"}, ...]}"}), 400
+    return jsonify({"files": store.relocate(moves)}), 200
+
+@app.route('/chunks/acquire', methods=['POST'])
+def acquire_chunks():
+    chunks = _chunk_list()
+    if chunks is None:
+        return jsonify({"error": "Body must be {\"chunks\": [{\"id\", ...}, ...]}"}), 400
+    store.acquire(chunks)
+    return jsonify({"status": "ok"}), 200
+
+@app.route('/chunks/unreferenced', methods=['POST'])
+def unreferenced_chunks():
+    """
+    The chunks a release would leave without references; changes nothing.
+    """
+    chunks = _chunk_list()
+    if chunks is None:
+        return jsonify({"error": "Body must be {\"chunks\": [{\"id\", ...}, ...]}"}), 400
+    return jsonify({"unreferenced": store.unreferenced(chunks)}), 200
+
+@app.route('/chunks/release', methods=['POST'])
+def release_chunks():
+    """
+    Drops a reference per chunk; returns the chunks no file uses any more.
+    """
+    chunks = _chunk_list()
+    if chunks is None:
+        return jsonify({"error": "Body must be {\"chunks\": [{\"id\", ...}, ...]}"}), 400
+    return jsonify({"unreferenced": store.release(chunks)}), 200
+
+# ——— Service ———
+
+@app.route('/status', methods=['GET'])
+def status():
+    return jsonify(store.stats()), 200
+
+@app.route('/snapshot', methods=['POST'])
+def snapshot():
+    store.snapshot()
+    return jsonify(store.stats()), 200
+
+@app.route('/', methods=['GET'])
+def index():
+    return "📇 Metadata service is running", 200
+
+
+def snapshotter():
+    while True:
+        time.sleep(min(SNAPSHOT_INTERVAL, 5))
+        store.snapshot_if_due()
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="DFS metadata service")
+    parser.add_argument('--port', type=int, default=6100)
+    parser.add_argument('--data-dir', default=DATA_DIR, help='WAL and snapshot directory')
+    args = parser.parse_args()
+
+    store = MetadataStore(args.data_dir)
+    threading.Thread(target=snapshotter, daemon=True).start()
+    app.run(host='0.0.0.0', port=args.port, threaded=True)
@@ -0,0 +1,418 @@
+import shutil
+import os
+import sys
+import json
+import atexit
+import asyncio
+import traceback
+from aiohttp import web
+
+# allow importing dfs.core when run as a script
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from dfs.core.ranges import parse_range, content_range
+from dfs.core.batch import frame_header, MAX_BATCH
+from dfs.core.heartbeat import RequestStats, start_pusher, system_load
+from dfs.core import tokens
+from dfs.client.batch import pull_chunks
+from dfs.nodes.storage_engine import (
+    create_engine, valid_chunk_id, ChecksumError, ENGINES, IO_BLOCK_SIZE, CHUNK_CACHE_MB
+)
+
+# Asyncio storage node with the same HTTP API as node_storage.py. Upload
+# bodies are read off the socket part by part and handed to the engine as
+# they arrive (no multipart spooling); chunks go back out with sendfile
+# straight from the chunk or pack file, or from memory for hot chunks
+# (see StorageEngine.hot_chunk). One event loop serves every
+# connection, so a node holds thousands of them without a thread each.
+# Engine commits, which take the engine lock, run in the default executor.
+
+STORAGE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'node_storage'))
+os.makedirs(STORAGE_DIR, exist_ok=True)
+
+STORAGE_ENGINE = os.getenv("DFS_STORAGE_ENGINE", "pack")  # "pack" or "file"
+BACKLOG = int(os.getenv("DFS_NODE_BACKLOG", "4096"))       # pending connections per listening socket
+HEARTBEAT_URL = os.getenv("DFS_HEARTBEAT_URL")             # cluster manager to push heartbeats to
+
+engine = None    # set in __main__ once the port is known
+node_url = None  # URL placement tokens are issued for, likewise
+stats = RequestStats()
+
+
+def init_engine(port, kind=STORAGE_ENGINE, cache_mb=CHUNK_CACHE_MB):
+    global engine
+    engine = create_engine(kind, os.path.join(STORAGE_DIR, f"node_{port}"), legacy_dir=STORAGE_DIR,
+                           cache_mb=cache_mb)
+    atexit.register(engine.close)
+    return engine
+
+
+def token_error(token, chunk_id):
+    """
+    Why a write of `chunk_id` is not allowed, or None. Only enforced when
+    the node has DFS_TOKEN_SECRET; see dfs.core.tokens.
+    """
+    if not tokens.SECRET:
+        return None
+    try:
+        tokens.verify(token, node_url, chunk_id)
+    except tokens.TokenError as e:
+        return str(e)
+    return None
+
+
+def status_payload():
+    """
+    What /status returns and heartbeats carry: free space, the engine's
+    counters, request load and latency.
+    """
+    total, used, free = shutil.disk_usage(engine.data_dir)
+    return {
+        "free_mb":     round(free / (1024 * 1024), 2),
+        "capacity_mb": round(total / (1024 * 1024), 2),
+        "load":        system_load(),
+        **engine.stats(),
+        **stats.snapshot()
+    }
+
+
+@web.middleware
+async def track_requests(request, handler):
+    started = stats.begin()
+    try:
+        return await handler(request)
+    finally:
+        stats.end(started)
+
+
+def _error(message, status, **extra):
+    return web.json_response({"error": message, **extra}, status=status)
+
+
+async def _receive(part, writer):
+    """
+    Streams one multipart part into a ChunkWriter. Writes may hit the disk
+    (file engine, or a pack upload past its memory buffer), so they run in
+    a worker thread, off the event loop.
+    """
+    while True:
+        block = await part.read_chunk(IO_BLOCK_SIZE)
+        if not block:
+            return
+        await asyncio.to_thread(writer.write, block)
+
+
+async def _sendfile(request, f, offset, count):
+    """
+    Sends `count` bytes of `f` from `offset` with sendfile(2); asyncio falls
+    back to executor reads where the transport cannot (e.g. TLS).
+    """
+    if count:
+        await asyncio.get_running_loop().sendfile(request.transport, f, offset, count)
+
+
+async def store_chunk(request):
+    """
+    Receives and stores a chunk.
+    Expects 'chunk_id' as form field and the file as 'chunk'; an optional
+    'checksum' (hex sha256) is verified while the chunk is written, and a
+    chunk that does not match is discarded with 422. With a token secret
+    configured, 'token' must be a placement token for this chunk and node.
+    """
+    fields, writer = {}, None
+    try:
+        async for part in await request.multipart():
+            if part.name == "chunk" and writer is None:
+                writer = engine.writer()
+                await _receive(part, writer)
+            elif part.name in ("chunk_id", "checksum", "token"):
+                fields[part.name] = await part.text()
+
+        chunk_id = fields.get("chunk_id")
+        if not chunk_id or writer is None:
+            return _error("Missing chunk_id or chunk", 400)
+        if not valid_chunk_id(chunk_id):
+            return _error("Invalid chunk_id", 400)
+        denied = token_error(fields.get("token"), chunk_id)
+        if denied:
+            return _error("Invalid placement token", 403, chunk_id=chunk_id, detail=denied)
+        try:
+            digest = await asyncio.to_thread(writer.commit, chunk_id, fields.get("checksum"))
+        except ChecksumError as e:
+            return _error("Checksum mismatch", 422, chunk_id=chunk_id, detail=str(e))
+        return web.json_response({"status": "stored", "chunk_id": chunk_id, "sha256": digest})
+    finally:
+        if writer is not None:
+            writer.discard()
+
+
+async def store_batch(request):
+    """
+    Stores several chunks in one request: each 'chunks' file part is named
+    after its chunk id, and an optional 'checksums' form field maps ids to
+    hex sha256 digests ('tokens' likewise to placement tokens). Chunks are
+    stored independently; the response lists which were stored and why
+    the others failed.
+    """
+    received, failed, checksums, write_tokens = [], {}, {}, {}
+    try:
+        async for part in await request.multipart():
+            if part.name in ("checksums", "tokens"):
+                try:
+                    field = json.loads(await part.text())
+                except ValueError:
+                    field = None
+                if not isinstance(field, dict):
+                    return _error("checksums and tokens must be JSON objects", 400)
+                if part.name == "checksums":
+                    checksums = field
+                else:
+                    write_tokens = field
+            elif part.name == "chunks":
+                chunk_id = part.filename
+                if not valid_chunk_id(chunk_id):
+                    failed[chunk_id or ""] = "invalid chunk_id"
+                    continue
+                if len(received) >= MAX_BATCH:
+                    return _error(f"At most {MAX_BATCH} chunks per batch", 413)
+                writer = engine.writer()
+                received.append((chunk_id, writer))
+                await _receive(part, writer)
+        if not received and not failed:
+            return _error("Missing chunks", 400)
+
+        stored = []
+        for chunk_id, writer in received:
+            denied = token_error(write_tokens.get(chunk_id), chunk_id)
+            if denied:
+                failed[chunk_id] = f"invalid placement token: {denied}"
+                continue
+            try:
+                await asyncio.to_thread(writer.commit, chunk_id, checksums.get(chunk_id))
+                stored.append(chunk_id)
+            except ChecksumError as e:
+                failed[chunk_id] = f"checksum mismatch: {e}"
+        return web.json_response({"stored": stored, "failed": failed}, status=200 if not failed else 207)
+    finally:
+        for _, writer in received:
+            writer.discard()
+
+
+async def node_status(request):
+    """
+    Returns current free disk space, number of stored chunks and request
+    load. Counts come from the engine's running counters, not a directory
+    scan.
+    """
+    try:
+        return web.json_response(status_payload())
+    except Exception as e:
+        traceback.print_exc()
+        return _error(f"Failed to retrieve status: {str(e)}", 500)
+
+
+async def _hot_chunk(chunk_id):
+    """
+    A hot chunk's bytes from the engine's cache, or None; the disk read
+    that admits one runs off the event loop.
+    """
+    data = engine.cache.get(chunk_id)
+    if data is None and engine.cache.admit(chunk_id):
+        data = await asyncio.to_thread(engine.cache_chunk, chunk_id)
+    return data
+
+
+async def get_chunk(request):
+    """
+    Serves a chunk back to the client.
+    Honours a single "Range: bytes=a-b" header with a 206 partial response.
+    """
+    chunk_id = request.match_info["chunk_id"]
+    data = await _hot_chunk(chunk_id) if valid_chunk_id(chunk_id) else None
+    opened = engine.open_raw(chunk_id) if data is None and valid_chunk_id(chunk_id) else None
+    if data is None and opened is None:
+        return _error("Chunk not found", 404)
+
+    size = len(data) if data is not None else opened[2]
+    try:
+        try:
+            byte_range = parse_range(request.headers.get("Range"), size)
+        except ValueError:
+            return web.Response(status=416, headers={"Content-Range": f"bytes */{size}"})
+        if byte_range is None:
+            start, length = 0, size
+            response = web.StreamResponse(headers={"Content-Disposition": f"attachment; filename={chunk_id}"})
+        else:
+            start, end = byte_range
+            length = end - start + 1
+            response = web.StreamResponse(status=206, headers={
+                "Content-Range": content_range(start, end, size),
+                "Accept-Ranges": "bytes"
+            })
+        response.content_type = "application/octet-stream"
+        response.content_length = length
+        await response.prepare(request)
+        if data is not None:
+            await response.write(data[start:start + length])
+        else:
+            f, base, _ = opened
+            await _sendfile(request, f, base + start, length)
+        await response.write_eof()
+        return response
+    finally:
+        if opened:
+            opened[0].close()
+
+
+async def delete_chunk(request):
+    """
+    Deletes a chunk from local storage.
+    """
+    chunk_id = request.match_info["chunk_id"]
+    if valid_chunk_id(chunk_id) and await asyncio.to_thread(engine.delete, chunk_id):
+        return web.json_response({"status": "deleted", "chunk_id": chunk_id})
+    return _error("Chunk not found", 404)
+
+
+async def _batch_ids(request):
+    try:
+        ids = (await request.json() or {}).get("ids")
+    except (ValueError, AttributeError):
+        return None
+    if not isinstance(ids, list):
+        return None
+    return ids
+
+
+async def fetch_batch(request):
+    """
+    Streams several chunks back in one response. Body: {"ids": [...]}.
+    The response is a length-prefixed frame per id, in request order
+    (see dfs.core.batch); chunks this node lacks get an empty frame.
+    """
+    ids = await _batch_ids(request)
+    if ids is None:
+        return _error("Body must be {\"ids\": [...]}", 400)
+    if len(ids) > MAX_BATCH:
+        return _error(f"At most {MAX_BATCH} chunks per batch", 413)
+
+    # every chunk is opened (or found in the cache) up front: the total
+    # length has to be known so the body is not chunk-encoded around the
+    # sendfile'd data
+    frames = []  # (header, cached bytes, opened file)
+    try:
+        for chunk_id in ids:
+            valid = valid_chunk_id(chunk_id)
+            data = await _hot_chunk(chunk_id) if valid else None
+            opened = engine.open_raw(chunk_id) if valid and data is None else None
+            if data is not None:
+                frames.append((frame_header(chunk_id, len(data)), data, None))
+            elif opened is None:
+                frames.append((frame_header(str(chunk_id), -1), None, None))
+            else:
+                frames.append((frame_header(chunk_id, opened[2]), None, opened))
+
+        response = web.StreamResponse()
+        response.content_type = "application/octet-stream"
+        response.content_length = sum(
+            len(head) + (len(data) if data is not None else opened[2] if opened else 0)
+            for head, data, opened in frames
+        )
+        await response.prepare(request)
+        for head, data, opened in frames:
+            await response.write(head)
+            if data:
+                await response.write(data)
+            elif opened:
+                f, base, size = opened
+                await _sendfile(request, f, base, size)
+        await response.write_eof()
+        return response
+    finally:
+        for _, _, opened in frames:
+            if opened:
+                opened[0].close()
+
+
+async def pull(request):
+    """
+    Copies chunks here from another node (rebalancing, re-replication).
+    Body: {"source": node_url, "ids": [...], "checksums": {id: sha256},
+    "tokens": {id: token}}; each copy is verified against its checksum
+    when one is given.
+    """
+    try:
+        body = await request.json() or {}
+    except ValueError:
+        body = {}
+    ids, source = body.get("ids"), body.get("source")
+    if not isinstance(ids, list) or not source:
+        return _error("Body must be {\"source\", \"ids\": [...]}", 400)
+    if len(ids) > MAX_BATCH:
+        return _error(f"At most {MAX_BATCH} chunks per batch", 413)
+    checksums, write_tokens = body.get("checksums") or {}, body.get("tokens") or {}
+    if not isinstance(checksums, dict) or not isinstance(write_tokens, dict):
+        return _error("checksums and tokens must be JSON objects", 400)
+    invalid = {str(i): "invalid chunk_id" for i in ids if not valid_chunk_id(i)}
+    errors = {i: token_error(write_tokens.get(i), i) for i in ids if valid_chunk_id(i)}
+    denied = {i: f"invalid placement token: {e}" for i, e in errors.items() if e}
+    ids = [i for i in errors if i not in denied]
+    stored, failed = await asyncio.to_thread(pull_chunks, source, ids, checksums, engine.put)
+    failed.update(denied)
+    failed.update(invalid)
+    return web.json_response({"stored": stored, "failed": failed}, status=200 if not failed else 207)
+
+
+async def delete_batch(request):
+    """
+    Deletes several chunks in one request. Body: {"ids": [...]}.
+    """
+    ids = await _batch_ids(request)
+    if ids is None:
+        return _error("Body must be {\"ids\": [...]}", 400)
+
+    def delete_all():
+        deleted, missing = [], []
+        for chunk_id in ids:
+            if valid_chunk_id(chunk_id) and engine.delete(chunk_id):
+                deleted.append(chunk_id)
+            else:
+                missing.append(chunk_id)
+        return deleted, missing
+
+    deleted, missing = await asyncio.to_thread(delete_all)
+    return web.json_response({"deleted": deleted, "missing": missing})
+
+
+def create_app():
+    app = web.Application(middlewares=[track_requests])
+    app.add_routes([
+        web.post('/store', store_chunk),
+        web.post('/store_batch', store_batch),
+        web.get('/status', node_status),
+        web.get('/chunk/{chunk_id}', get_chunk),
+        web.delete('/chunk/{chunk_id}', delete_chunk),
+        web.post('/fetch_batch', fetch_batch),
+        web.post('/delete_batch', delete_batch),
+        web.post('/pull', pull)
+    ])
+    return app
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=5001, help='Port for this node to run on')
+    parser.add_argument('--engine', choices=ENGINES, default=STORAGE_ENGINE,
+                        help='Chunk storage engine (default: $DFS_STORAGE_ENGINE or pack)')
+    parser.add_argument('--heartbeat-url', default=HEARTBEAT_URL,
+                        help='Cluster manager to push heartbeats to (default: $DFS_HEARTBEAT_URL)')
+    parser.add_argument('--url', help='URL the cluster manager knows this node by (default: http://localhost:<port>)')
+    parser.add_argument('--cache-mb', type=int, default=CHUNK_CACHE_MB,
+                        help='Hot-chunk cache size in MB, 0 to disable (default: $DFS_CHUNK_CACHE_MB or 64)')
+    args = parser.parse_args()
+
+    init_engine(args.port, args.engine, args.cache_mb)
+    node_url = args.url or f"http://localhost:{args.port}"
+    if args.heartbeat_url:
+        start_pusher(args.heartbeat_url, lambda: {"url": node_url, **status_payload()})
+    web.run_app(create_app(), host='0.0.0.0', port=args.port, backlog=BACKLOG, access_log=None)
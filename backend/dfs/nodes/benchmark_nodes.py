@@ -0,0 +1,136 @@
+import os
+import sys
+import time
+import shutil
+import asyncio
+import argparse
+import subprocess
+import aiohttp
+
+# Throughput comparison of the Flask node (node_storage.py) against the
+# asyncio node (async_node.py). Each server is started on its own port and
+# driven with the same workload at increasing concurrency: every client
+# stores chunks, reads them back, then deletes them.
+#
+#   python dfs/nodes/benchmark_nodes.py --chunk-kb 1024 --requests 400 --concurrency 8 64 512
+
+NODES_DIR = os.path.abspath(os.path.dirname(__file__))
+BACKEND_DIR = os.path.abspath(os.path.join(NODES_DIR, '..', '..'))
+STORAGE_DIR = os.path.abspath(os.path.join(NODES_DIR, '..', 'node_storage'))
+
+SERVERS = {"flask": "node_storage.py", "async": "async_node.py"}
+
+
+def start_node(server, port, engine):
+    env = os.environ.copy()
+    env["PYTHONPATH"] = BACKEND_DIR
+    return subprocess.Popen(
+        [sys.executable, os.path.join(NODES_DIR, SERVERS[server]), "--port", str(port), "--engine", engine],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+
+async def wait_ready(session, base, timeout=15):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            async with session.get(f"{base}/status") as r:
+                if r.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError(f"node at {base} did not come up")
+
+
+async def run_phase(concurrency, jobs, fn):
+    """
+    Runs fn(job) for every job with at most `concurrency` in flight.
+    Returns (seconds, errors).
+    """
+    queue = list(jobs)
+    errors = 0
+
+    async def worker():
+        nonlocal errors
+        while queue:
+            job = queue.pop()
+            try:
+                await fn(job)
+            except (aiohttp.ClientError, asyncio.TimeoutError, AssertionError):
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return time.perf_counter() - start, errors
+
+
+async def bench_node(base, payload, requests, concurrency):
+    connector = aiohttp.TCPConnector(limit=concurrency, limit_per_host=concurrency)
+    timeout = aiohttp.ClientTimeout(total=300)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        await wait_ready(session, base)
+        ids = [f"bench_c{concurrency}_{i:06d}" for i in range(requests)]
+
+        async def store(chunk_id):
+            form = aiohttp.FormData()
+            form.add_field("chunk_id", chunk_id)
+            form.add_field("chunk", payload, filename=chunk_id, content_type="application/octet-stream")
+            async with session.post(f"{base}/store", data=form) as r:
+                assert r.status == 200, r.status
+
+        async def fetch(chunk_id):
+            async with session.get(f"{base}/chunk/{chunk_id}") as r:
+                assert r.status == 200, r.status
+                assert len(await r.read()) == len(payload)
+
+        async def delete(chunk_id):
+            async with session.delete(f"{base}/chunk/{chunk_id}") as r:
+                assert r.status == 200, r.status
+
+        results = {}
+        for name, fn in (("store", store), ("fetch", fetch), ("delete", delete)):
+            results[name] = await run_phase(concurrency, ids, fn)
+        return results
+
+
+def report(server, concurrency, requests, chunk_bytes, results):
+    for phase, (seconds, errors) in results.items():
+        rate = requests / seconds
+        mb_s = rate * chunk_bytes / (1024 * 1024) if phase != "delete" else 0
+        print(f"{server:>6} {concurrency:>6} {phase:>7} {rate:>10.1f} req/s {mb_s:>9.1f} MB/s {errors:>6} errors")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare Flask and asyncio storage node throughput")
+    parser.add_argument("--servers", nargs="+", choices=SERVERS, default=list(SERVERS))
+    parser.add_argument("--engine", choices=("file", "pack"), default="pack")
+    parser.add_argument("--chunk-kb", type=int, default=1024, help="chunk size in KiB")
+    parser.add_argument("--requests", type=int, default=400, help="chunks per phase")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[8, 64, 512])
+    parser.add_argument("--port", type=int, default=15901, help="first port to use")
+    args = parser.parse_args()
+
+    payload = os.urandom(args.chunk_kb * 1024)
+    print(f"[INFO] {args.requests} x {args.chunk_kb} KiB chunks per phase, {args.engine} engine")
+    print(f"{'server':>6} {'conc':>6} {'phase':>7} {'throughput':>14} {'bandwidth':>14} {'errors':>13}")
+
+    for offset, server in enumerate(args.servers):
+        port = args.port + offset
+        data_dir = os.path.join(STORAGE_DIR, f"node_{port}")
+        if os.path.exists(data_dir):
+            print(f"[ERROR] {data_dir} already exists; pick another --port")
+            return
+        proc = start_node(server, port, args.engine)
+        try:
+            for concurrency in args.concurrency:
+                results = asyncio.run(bench_node(f"http://localhost:{port}", payload, args.requests, concurrency))
+                report(server, concurrency, args.requests, len(payload), results)
+        finally:
+            proc.terminate()
+            proc.wait()
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,46 +1,162 @@
 import shutil
 import os
+import sys
+import json
+import atexit
 import traceback
-from flask import Flask, request, send_file, jsonify
+from flask import Flask, Response, request, jsonify, g
+
+# allow importing dfs.core when run as a script
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from dfs.core.ranges import parse_range, content_range
+from dfs.core.batch import frame_header, MAX_BATCH
+from dfs.core.heartbeat import RequestStats, start_pusher, system_load
+from dfs.core import tokens
+from dfs.client.batch import pull_chunks
+from dfs.nodes.storage_engine import create_engine, valid_chunk_id, ChecksumError, ENGINES, CHUNK_CACHE_MB
 
 app = Flask(__name__)
 
-# Directory where chunks will be stored
+# Each node keeps its chunks in node_storage/node_<port>. Chunks written
+# before nodes had their own directory sit directly in node_storage and
+# stay readable (and deletable) from there.
 STORAGE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'node_storage'))
 os.makedirs(STORAGE_DIR, exist_ok=True)
 
+STORAGE_ENGINE = os.getenv("DFS_STORAGE_ENGINE", "pack")  # "pack" or "file"
+HEARTBEAT_URL = os.getenv("DFS_HEARTBEAT_URL")             # cluster manager to push heartbeats to
+
+engine = None    # set in __main__ once the port is known
+node_url = None  # URL placement tokens are issued for, likewise
+stats = RequestStats()
+
+
+def init_engine(port, kind=STORAGE_ENGINE, cache_mb=CHUNK_CACHE_MB):
+    global engine
+    engine = create_engine(kind, os.path.join(STORAGE_DIR, f"node_{port}"), legacy_dir=STORAGE_DIR,
+                           cache_mb=cache_mb)
+    atexit.register(engine.close)
+    return engine
+
+
+def token_error(token, chunk_id):
+    """
+    Why a write of `chunk_id` is not allowed, or None. Only enforced when
+    the node has DFS_TOKEN_SECRET; see dfs.core.tokens.
+    """
+    if not tokens.SECRET:
+        return None
+    try:
+        tokens.verify(token, node_url, chunk_id)
+    except tokens.TokenError as e:
+        return str(e)
+    return None
+
+
+def status_payload():
+    """
+    What /status returns and heartbeats carry: free space, the engine's
+    counters, request load and latency.
+    """
+    total, used, free = shutil.disk_usage(engine.data_dir)
+    return {
+        "free_mb":     round(free / (1024 * 1024), 2),
+        "capacity_mb": round(total / (1024 * 1024), 2),
+        "load":        system_load(),
+        **engine.stats(),
+        **stats.snapshot()
+    }
+
+
+@app.before_request
+def track_start():
+    g.started = stats.begin()
+
+
+@app.teardown_request
+def track_end(exc=None):
+    started = g.pop("started", None)
+    if started is not None:
+        stats.end(started)
+
 
 @app.route('/store', methods=['POST'])
 def store_chunk():
     """
     Receives and stores a chunk.
-    Expects 'chunk_id' as form field and the file as 'chunk'.
+    Expects 'chunk_id' as form field and the file as 'chunk'; an optional
+    'checksum' (hex sha256) is verified while the chunk is written, and a
+    chunk that does not match is discarded with 422. With a token secret
+    configured, 'token' must be a placement token for this chunk and node.
     """
     chunk_id = request.form.get('chunk_id')
     chunk = request.files.get('chunk')
+    expected = request.form.get('checksum')
 
     if not chunk_id or not chunk:
         return jsonify({"error": "Missing chunk_id or chunk"}), 400
+    if not valid_chunk_id(chunk_id):
+        return jsonify({"error": "Invalid chunk_id"}), 400
+    denied = token_error(request.form.get('token'), chunk_id)
+    if denied:
+        return jsonify({"error": "Invalid placement token", "chunk_id": chunk_id, "detail": denied}), 403
 
-    chunk.save(os.path.join(STORAGE_DIR, chunk_id))
-    return jsonify({"status": "stored", "chunk_id": chunk_id})
+    try:
+        digest = engine.put(chunk_id, chunk.stream, expected)
+    except ChecksumError as e:
+        return jsonify({"error": "Checksum mismatch", "chunk_id": chunk_id, "detail": str(e)}), 422
+    return jsonify({"status": "stored", "chunk_id": chunk_id, "sha256": digest})
+
+
+@app.route('/store_batch', methods=['POST'])
+def store_batch():
+    """
+    Stores several chunks in one request: each 'chunks' file part is named
+    after its chunk id, and an optional 'checksums' form field maps ids to
+    hex sha256 digests ('tokens' likewise to placement tokens). Chunks are
+    stored independently; the response lists which were stored and why
+    the others failed.
+    """
+    parts = request.files.getlist('chunks')
+    if not parts:
+        return jsonify({"error": "Missing chunks"}), 400
+    if len(parts) > MAX_BATCH:
+        return jsonify({"error": f"At most {MAX_BATCH} chunks per batch"}), 413
+    try:
+        checksums = json.loads(request.form.get('checksums', '{}'))
+        write_tokens = json.loads(request.form.get('tokens', '{}'))
+    except ValueError:
+        checksums = None
+    if not isinstance(checksums, dict) or not isinstance(write_tokens, dict):
+        return jsonify({"error": "checksums and tokens must be JSON objects"}), 400
+
+    stored, failed = [], {}
+    for part in parts:
+        chunk_id = part.filename
+        if not valid_chunk_id(chunk_id):
+            failed[chunk_id or ""] = "invalid chunk_id"
+            continue
+        denied = token_error(write_tokens.get(chunk_id), chunk_id)
+        if denied:
+            failed[chunk_id] = f"invalid placement token: {denied}"
+            continue
+        try:
+            engine.put(chunk_id, part.stream, checksums.get(chunk_id))
+            stored.append(chunk_id)
+        except ChecksumError as e:
+            failed[chunk_id] = f"checksum mismatch: {e}"
+    return jsonify({"stored": stored, "failed": failed}), 200 if not failed else 207
 
 
 @app.route('/status', methods=['GET'])
 def node_status():
     """
-    Returns current free disk space and number of stored chunks.
+    Returns current free disk space, number of stored chunks and request
+    load. Counts come from the engine's running counters, not a directory
+    scan.
     """
     try:
-        total, used, free = shutil.disk_usage(STORAGE_DIR)
-        chunks = [
-            name for name in os.listdir(STORAGE_DIR)
-            if os.path.isfile(os.path.join(STORAGE_DIR, name))
-        ]
-        return jsonify({
-            "free_mb": round(free / (1024 * 1024), 2),
-            "chunk_count": len(chunks)
-        })
+        return jsonify(status_payload())
     except Exception as e:
         traceback.print_exc()
         return jsonify({"error": f"Failed to retrieve status: {str(e)}"}), 500
@@ -50,11 +166,34 @@ def node_status():
 def get_chunk(chunk_id):
     """
     Serves a chunk back to the client.
+    Honours a single "Range: bytes=a-b" header with a 206 partial response.
     """
-    chunk_path = os.path.join(STORAGE_DIR, chunk_id)
-    if not os.path.exists(chunk_path):
+    size = engine.size(chunk_id)
+    if size is None:
+        return jsonify({"error": "Chunk not found"}), 404
+
+    try:
+        byte_range = parse_range(request.headers.get('Range'), size)
+    except ValueError:
+        return Response(status=416, headers={"Content-Range": f"bytes */{size}"})
+    if byte_range is None:
+        opened = engine.open_chunk(chunk_id)
+        if opened is None:
+            return jsonify({"error": "Chunk not found"}), 404
+        size, body = opened
+        return Response(body, mimetype='application/octet-stream', headers={
+            "Content-Length": str(size),
+            "Content-Disposition": f"attachment; filename={chunk_id}"
+        })
+
+    start, end = byte_range
+    data = engine.read(chunk_id, start, end - start + 1)
+    if data is None:
         return jsonify({"error": "Chunk not found"}), 404
-    return send_file(chunk_path, as_attachment=True)
+    return Response(data, status=206, mimetype='application/octet-stream', headers={
+        "Content-Range": content_range(start, end, size),
+        "Accept-Ranges": "bytes"
+    })
 
 
 @app.route('/chunk/<chunk_id>', methods=['DELETE'])
@@ -62,17 +201,103 @@ def delete_chunk(chunk_id):
     """
     Deletes a chunk from local storage.
     """
-    chunk_path = os.path.join(STORAGE_DIR, chunk_id)
-    if os.path.exists(chunk_path):
-        os.remove(chunk_path)
+    if engine.delete(chunk_id):
         return jsonify({"status": "deleted", "chunk_id": chunk_id})
     return jsonify({"error": "Chunk not found"}), 404
 
 
+def _batch_ids():
+    ids = (request.get_json(silent=True) or {}).get("ids")
+    if not isinstance(ids, list):
+        return None
+    return ids
+
+
+@app.route('/pull', methods=['POST'])
+def pull():
+    """
+    Copies chunks here from another node (rebalancing, re-replication).
+    Body: {"source": node_url, "ids": [...], "checksums": {id: sha256},
+    "tokens": {id: token}}; each copy is verified against its checksum
+    when one is given.
+    """
+    body = request.get_json(silent=True) or {}
+    ids, source = _batch_ids(), body.get("source")
+    if ids is None or not source:
+        return jsonify({"error": "Body must be {\"source\", \"ids\": [...]}"}), 400
+    if len(ids) > MAX_BATCH:
+        return jsonify({"error": f"At most {MAX_BATCH} chunks per batch"}), 413
+    checksums, write_tokens = body.get("checksums") or {}, body.get("tokens") or {}
+    if not isinstance(checksums, dict) or not isinstance(write_tokens, dict):
+        return jsonify({"error": "checksums and tokens must be JSON objects"}), 400
+    invalid = {str(i): "invalid chunk_id" for i in ids if not valid_chunk_id(i)}
+    errors = {i: token_error(write_tokens.get(i), i) for i in ids if valid_chunk_id(i)}
+    denied = {i: f"invalid placement token: {e}" for i, e in errors.items() if e}
+    ids = [i for i in errors if i not in denied]
+    stored, failed = pull_chunks(source, ids, checksums, engine.put)
+    failed.update(denied)
+    failed.update(invalid)
+    return jsonify({"stored": stored, "failed": failed}), 200 if not failed else 207
+
+
+@app.route('/fetch_batch', methods=['POST'])
+def fetch_batch():
+    """
+    Streams several chunks back in one response. Body: {"ids": [...]}.
+    The response is a length-prefixed frame per id, in request order
+    (see dfs.core.batch); chunks this node lacks get an empty frame.
+    """
+    ids = _batch_ids()
+    if ids is None:
+        return jsonify({"error": "Body must be {\"ids\": [...]}"}), 400
+    if len(ids) > MAX_BATCH:
+        return jsonify({"error": f"At most {MAX_BATCH} chunks per batch"}), 413
+
+    def generate():
+        for chunk_id in ids:
+            opened = engine.open_chunk(chunk_id) if valid_chunk_id(chunk_id) else None
+            if opened is None:
+                yield frame_header(str(chunk_id), -1)
+                continue
+            size, body = opened
+            yield frame_header(chunk_id, size)
+            yield from body
+
+    return Response(generate(), mimetype='application/octet-stream')
+
+
+@app.route('/delete_batch', methods=['POST'])
+def delete_batch():
+    """
+    Deletes several chunks in one request. Body: {"ids": [...]}.
+    """
+    ids = _batch_ids()
+    if ids is None:
+        return jsonify({"error": "Body must be {\"ids\": [...]}"}), 400
+    deleted, missing = [], []
+    for chunk_id in ids:
+        if valid_chunk_id(chunk_id) and engine.delete(chunk_id):
+            deleted.append(chunk_id)
+        else:
+            missing.append(chunk_id)
+    return jsonify({"deleted": deleted, "missing": missing})
+
+
 if __name__ == '__main__':
     import argparse
     parser = argparse.ArgumentParser()
     parser.add_argument('--port', type=int, default=5001, help='Port for this node to run on')
+    parser.add_argument('--engine', choices=ENGINES, default=STORAGE_ENGINE,
+                        help='Chunk storage engine (default: $DFS_STORAGE_ENGINE or pack)')
+    parser.add_argument('--heartbeat-url', default=HEARTBEAT_URL,
+                        help='Cluster manager to push heartbeats to (default: $DFS_HEARTBEAT_URL)')
+    parser.add_argument('--url', help='URL the cluster manager knows this node by (default: http://localhost:<port>)')
+    parser.add_argument('--cache-mb', type=int, default=CHUNK_CACHE_MB,
+                        help='Hot-chunk cache size in MB, 0 to disable (default: $DFS_CHUNK_CACHE_MB or 64)')
     args = parser.parse_args()
 
+    init_engine(args.port, args.engine, args.cache_mb)
+    node_url = args.url or f"http://localhost:{args.port}"
+    if args.heartbeat_url:
+        start_pusher(args.heartbeat_url, lambda: {"url": node_url, **status_payload()})
     app.run(host='0.0.0.0', port=args.port)
@@ -0,0 +1,606 @@
+import os
+import json
+import struct
+import hashlib
+import tempfile
+import threading
+from collections import defaultdict
+from dfs.core.cache import LRUCache
+
+# Storage engines for a node's chunks.
+#
+#   file  one file per chunk in the node's data directory
+#   pack  append-only pack files plus an in-memory index, persisted as a
+#         snapshot and rebuilt on start by replaying the packs' tails;
+#         deleted space is reclaimed by background compaction
+#
+# Both keep chunk/byte counters up to date on every write, so status
+# requests never scan the directory, and keep hot chunks in an in-memory
+# LRU cache (DFS_CHUNK_CACHE_MB) so repeated reads skip the disk.
+
+IO_BLOCK_SIZE = 256 * 1024                 # bytes read/written per step
+CHUNK_CACHE_MB = int(os.getenv("DFS_CHUNK_CACHE_MB", "64"))  # hot-chunk cache per node; 0 disables
+PACK_MAX_BYTES = 256 * 1024 * 1024         # active pack is sealed past this size
+PACK_BUFFER_BYTES = 4 * 1024 * 1024        # upload bytes held in memory before spilling to a temp file
+COMPACT_INTERVAL = 60                      # seconds between compaction passes
+COMPACT_DEAD_RATIO = 0.5                   # compact sealed packs at least this dead
+INDEX_SAVE_INTERVAL = 30                   # seconds between index snapshots
+
+ENGINES = ("file", "pack")
+
+
+class ChecksumError(ValueError):
+    pass
+
+
+def valid_chunk_id(chunk_id):
+    """
+    Chunk ids must be plain file names (batch requests carry ids in the
+    body, not the URL).
+    """
+    return (isinstance(chunk_id, str) and bool(chunk_id)
+            and os.path.basename(chunk_id) == chunk_id
+            and chunk_id not in (".", "..") and not chunk_id.startswith(".tmp-"))
+
+
+class ChunkWriter:
+    """
+    Receives one chunk block by block, hashing as it goes. commit() checks
+    the checksum and makes the chunk visible; discard() drops anything not
+    committed, so callers can always call it in a finally.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.hasher = hashlib.sha256()
+        self.length = 0
+
+    def write(self, block):
+        self.hasher.update(block)
+        self.length += len(block)
+        self._write(block)
+
+    def commit(self, chunk_id, expected=None):
+        """
+        Returns the hex sha256; raises ChecksumError on mismatch.
+        """
+        digest = self.hasher.hexdigest()
+        if expected and digest != expected:
+            raise ChecksumError(f"expected {expected}, got {digest}")
+        self._commit(chunk_id)
+        self.engine.cache.pop(chunk_id)
+        return digest
+
+    def discard(self):
+        pass
+
+
+def _atomic_write_json(path, data):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-", suffix=".json")
+    with os.fdopen(fd, "w") as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class StorageEngine:
+    """
+    Shared engine behaviour: writes through a ChunkWriter, reads through a
+    located (path, offset, size) byte range, a read-only fallback to the
+    legacy shared chunk directory, incremental counters and the hot-chunk
+    cache. Subclasses implement writer, _locate, _delete and ids.
+    """
+    name = None
+
+    def __init__(self, data_dir, legacy_dir=None, cache_mb=CHUNK_CACHE_MB):
+        self.data_dir = data_dir
+        self.legacy_dir = legacy_dir
+        os.makedirs(data_dir, exist_ok=True)
+        self.chunk_count = 0
+        self.stored_bytes = 0
+        self._lock = threading.RLock()
+        self.cache = LRUCache(cache_mb * 1024 * 1024)
+
+    def _count(self, chunks, nbytes):
+        self.chunk_count += chunks
+        self.stored_bytes += nbytes
+
+    def _legacy_path(self, chunk_id):
+        if not self.legacy_dir:
+            return None
+        path = os.path.join(self.legacy_dir, chunk_id)
+        return path if os.path.isfile(path) else None
+
+    def locate(self, chunk_id):
+        """
+        (path, offset, size) of a chunk's bytes, or None if not stored.
+        """
+        loc = self._locate(chunk_id)
+        if loc is None:
+            path = self._legacy_path(chunk_id)
+            if path:
+                return path, 0, os.path.getsize(path)
+        return loc
+
+    def size(self, chunk_id):
+        loc = self.locate(chunk_id)
+        return None if loc is None else loc[2]
+
+    def put(self, chunk_id, stream, expected=None):
+        """
+        Stores a chunk read from `stream`. Returns the hex sha256.
+        """
+        writer = self.writer()
+        try:
+            for block in iter(lambda: stream.read(IO_BLOCK_SIZE), b""):
+                writer.write(block)
+            return writer.commit(chunk_id, expected)
+        finally:
+            writer.discard()
+
+    def open_raw(self, chunk_id):
+        """
+        (open file, offset, size) of a chunk's bytes, or None if not
+        stored. The file is opened before returning, so a concurrent
+        compaction cannot pull it away mid-read; the caller closes it.
+        """
+        for _ in range(2):
+            loc = self.locate(chunk_id)
+            if loc is None:
+                return None
+            path, base, size = loc
+            try:
+                return open(path, "rb"), base, size
+            except FileNotFoundError:
+                continue  # pack compacted between lookup and open
+        return None
+
+    def hot_chunk(self, chunk_id):
+        """
+        A chunk's bytes from the hot-chunk cache, or None. A chunk read
+        again while its previous miss is still remembered is read into the
+        cache now (see LRUCache.admit); other misses are left to the
+        caller to stream from disk.
+        """
+        data = self.cache.get(chunk_id)
+        if data is None and self.cache.admit(chunk_id):
+            data = self.cache_chunk(chunk_id)
+        return data
+
+    def cache_chunk(self, chunk_id):
+        """
+        Reads a whole chunk from disk into the cache; returns its bytes, or
+        None if it is not stored.
+        """
+        since = self.cache.invalidations
+        opened = self._open_disk(chunk_id)
+        if opened is None:
+            return None
+        data = b"".join(opened[1])
+        self.cache.put(chunk_id, data, since=since)
+        return data
+
+    def open_chunk(self, chunk_id, start=0, length=None):
+        """
+        Returns (chunk size, generator over bytes [start, start + length)),
+        or None if the chunk is not stored. Hot chunks come from memory.
+        """
+        data = self.hot_chunk(chunk_id)
+        if data is not None:
+            end = len(data) if length is None else start + length
+            return len(data), iter((data[start:end],))
+        return self._open_disk(chunk_id, start, length)
+
+    def _open_disk(self, chunk_id, start=0, length=None):
+        opened = self.open_raw(chunk_id)
+        if opened is None:
+            return None
+        f, base, size = opened
+        remaining = size - start if length is None else length
+
+        def generate():
+            left = remaining
+            with f:
+                f.seek(base + start)
+                while left > 0:
+                    block = f.read(min(IO_BLOCK_SIZE, left))
+                    if not block:
+                        break
+                    left -= len(block)
+                    yield block
+        return size, generate()
+
+    def read(self, chunk_id, start=0, length=None):
+        opened = self.open_chunk(chunk_id, start, length)
+        return None if opened is None else b"".join(opened[1])
+
+    def delete(self, chunk_id):
+        """
+        Deletes a chunk; returns False if it was not stored.
+        """
+        self.cache.pop(chunk_id)
+        if self._delete(chunk_id):
+            return True
+        path = self._legacy_path(chunk_id)
+        if path:
+            os.remove(path)
+            return True
+        return False
+
+    def stats(self):
+        return {
+            "engine":       self.name,
+            "chunk_count":  self.chunk_count,
+            "stored_bytes": self.stored_bytes,
+            "chunk_cache":  self.cache.stats()
+        }
+
+    def close(self):
+        pass
+
+
+class FileEngine(StorageEngine):
+    """
+    One file per chunk. Counters come from a single scan at start-up.
+    """
+    name = "file"
+
+    def __init__(self, data_dir, legacy_dir=None, cache_mb=CHUNK_CACHE_MB):
+        super().__init__(data_dir, legacy_dir, cache_mb)
+        for entry in os.scandir(data_dir):
+            if entry.is_file() and valid_chunk_id(entry.name):
+                self._count(1, entry.stat().st_size)
+
+    def _path(self, chunk_id):
+        return os.path.join(self.data_dir, chunk_id)
+
+    def writer(self):
+        return _FileWriter(self)
+
+    def _locate(self, chunk_id):
+        path = self._path(chunk_id)
+        try:
+            return path, 0, os.stat(path).st_size
+        except FileNotFoundError:
+            return None
+
+    def _delete(self, chunk_id):
+        with self._lock:
+            loc = self._locate(chunk_id)
+            if loc is None:
+                return False
+            os.remove(loc[0])
+            self._count(-1, -loc[2])
+            return True
+
+    def ids(self):
+        return [e.name for e in os.scandir(self.data_dir) if e.is_file() and valid_chunk_id(e.name)]
+
+
+class _FileWriter(ChunkWriter):
+    """
+    Streams into a temp file that is renamed over the chunk on commit, so
+    a bad chunk never replaces a good one.
+    """
+
+    def __init__(self, engine):
+        super().__init__(engine)
+        fd, self.tmp_path = tempfile.mkstemp(dir=engine.data_dir, prefix=".tmp-")
+        self.out = os.fdopen(fd, "wb")
+
+    def _write(self, block):
+        self.out.write(block)
+
+    def _commit(self, chunk_id):
+        self.out.close()
+        engine = self.engine
+        with engine._lock:
+            old = engine._locate(chunk_id)
+            os.replace(self.tmp_path, engine._path(chunk_id))
+            engine._count(0 if old else 1, self.length - (old[2] if old else 0))
+
+    def discard(self):
+        self.out.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+# Pack record: flag | id length | data length, then id and data.
+_RECORD = struct.Struct(">BHQ")
+_PUT, _TOMBSTONE = 1, 2
+
+
+class PackEngine(StorageEngine):
+    """
+    Chunks are appended to pack-NNNNNN.dat files; the index maps each chunk
+    id to (pack, data offset, length). Deletes append a tombstone so a
+    rebuild cannot resurrect the chunk. Only the newest pack is written to;
+    once it passes PACK_MAX_BYTES it is sealed and a new one started.
+
+    The index is snapshotted to index.json together with how far into each
+    pack it is valid. On start the snapshot is loaded and only the pack
+    tails written after it are replayed (everything, if it is missing). A
+    torn record at the end of the newest pack is truncated away.
+    """
+    name = "pack"
+
+    def __init__(self, data_dir, legacy_dir=None, pack_max=PACK_MAX_BYTES, cache_mb=CHUNK_CACHE_MB):
+        super().__init__(data_dir, legacy_dir, cache_mb)
+        self.pack_max = pack_max
+        self.index_path = os.path.join(data_dir, "index.json")
+        self.index = {}                       # chunk_id → (pack, offset, length)
+        self.pack_size = {}                   # pack → bytes written
+        self.pack_live = defaultdict(int)     # pack → bytes of live chunk data
+        self._dirty = False
+        self._stop = threading.Event()
+        self._load()
+        self._active = max(self.pack_size, default=1)
+        self._open_active()
+        self._threads = [
+            threading.Thread(target=self._every, args=(INDEX_SAVE_INTERVAL, self._save_if_dirty), daemon=True),
+            threading.Thread(target=self._every, args=(COMPACT_INTERVAL, self.compact), daemon=True)
+        ]
+        for t in self._threads:
+            t.start()
+
+    # ——— pack files ———
+
+    def _pack_path(self, pack):
+        return os.path.join(self.data_dir, f"pack-{pack:06d}.dat")
+
+    def _packs_on_disk(self):
+        packs = []
+        for name in os.listdir(self.data_dir):
+            if name.startswith("pack-") and name.endswith(".dat"):
+                packs.append(int(name[5:-4]))
+        return sorted(packs)
+
+    def _open_active(self):
+        path = self._pack_path(self._active)
+        if not os.path.exists(path):
+            open(path, "wb").close()
+        self._file = open(path, "r+b")
+        self.pack_size.setdefault(self._active, os.path.getsize(path))
+
+    def _scan(self, pack, start=0):
+        """
+        Yields (flag, chunk_id, data offset, length) for a pack's records
+        from `start`; truncates a torn record at the end of the pack.
+        """
+        path = self._pack_path(pack)
+        end = os.path.getsize(path)
+        with open(path, "rb") as f:
+            pos = start
+            while pos < end:
+                f.seek(pos)
+                head = f.read(_RECORD.size)
+                if len(head) < _RECORD.size:
+                    break
+                flag, id_len, length = _RECORD.unpack(head)
+                data_off = pos + _RECORD.size + id_len
+                if flag not in (_PUT, _TOMBSTONE) or data_off + length > end:
+                    break
+                yield flag, f.read(id_len).decode("utf-8"), data_off, length
+                pos = data_off + length
+        if pos < end:
+            print(f"[WARN] Truncating torn record in {path} at byte {pos}")
+            os.truncate(path, pos)
+        self.pack_size[pack] = pos
+
+    def _apply(self, flag, chunk_id, pack, data_off, length):
+        old = self.index.pop(chunk_id, None)
+        if old:
+            self.pack_live[old[0]] -= old[2]
+            self._count(-1, -old[2])
+        if flag == _PUT:
+            self.index[chunk_id] = (pack, data_off, length)
+            self.pack_live[pack] += length
+            self._count(1, length)
+
+    def _load(self):
+        covered = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                snapshot = json.load(f)
+            covered = {int(p): n for p, n in snapshot["covered"].items()}
+            for chunk_id, (pack, off, length) in snapshot["index"].items():
+                if pack in covered:
+                    self._apply(_PUT, chunk_id, pack, off, length)
+        for pack in self._packs_on_disk():
+            start = covered.get(pack, 0)
+            self.pack_size[pack] = start
+            for flag, chunk_id, data_off, length in self._scan(pack, start):
+                self._apply(flag, chunk_id, pack, data_off, length)
+        # snapshot entries for packs removed since (compacted) are gone
+        for chunk_id in [c for c, loc in self.index.items() if loc[0] not in self.pack_size]:
+            self._apply(_TOMBSTONE, chunk_id, None, 0, 0)
+        print(f"[INFO] Pack engine: {self.chunk_count} chunk(s) in {len(self.pack_size)} pack(s)")
+
+    def _append(self, flag, chunk_id, blocks, length):
+        """
+        Appends a record to the active pack (caller holds the lock) and
+        returns the data offset.
+        """
+        raw_id = chunk_id.encode("utf-8")
+        start = self.pack_size[self._active]
+        self._file.seek(start)
+        self._file.write(_RECORD.pack(flag, len(raw_id), length) + raw_id)
+        for block in blocks:
+            self._file.write(block)
+        self._file.flush()
+        data_off = start + _RECORD.size + len(raw_id)
+        self.pack_size[self._active] = data_off + length
+        self._dirty = True
+        return data_off
+
+    def _sync_active(self):
+        """
+        fsyncs the active pack (caller holds the lock). Sealed packs were
+        synced when they were sealed, so after this every byte an index
+        snapshot covers is on disk.
+        """
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _rotate_if_full(self):
+        if self.pack_size[self._active] >= self.pack_max:
+            self._sync_active()
+            self._file.close()
+            self._active += 1
+            self._open_active()
+
+    # ——— engine API ———
+
+    def writer(self):
+        return _PackWriter(self)
+
+    def _locate(self, chunk_id):
+        loc = self.index.get(chunk_id)
+        if loc is None:
+            return None
+        pack, off, length = loc
+        return self._pack_path(pack), off, length
+
+    def _delete(self, chunk_id):
+        with self._lock:
+            if chunk_id not in self.index:
+                return False
+            self._append(_TOMBSTONE, chunk_id, [], 0)
+            self._apply(_TOMBSTONE, chunk_id, self._active, 0, 0)
+            self._rotate_if_full()
+            return True
+
+    def ids(self):
+        return list(self.index)
+
+    def stats(self):
+        total = sum(self.pack_size.values())
+        return {
+            **super().stats(),
+            "packs":      len(self.pack_size),
+            "pack_bytes": total,
+            "dead_bytes": total - self.stored_bytes
+        }
+
+    # ——— persistence & compaction ———
+
+    def save_index(self):
+        with self._lock:
+            # the snapshot marks pack bytes as covered, and covered bytes
+            # are not re-scanned on load: they must be durable first
+            self._sync_active()
+            snapshot = {
+                "covered": {str(p): n for p, n in self.pack_size.items()},
+                "index":   self.index
+            }
+            _atomic_write_json(self.index_path, snapshot)
+            self._dirty = False
+
+    def _save_if_dirty(self):
+        if self._dirty:
+            self.save_index()
+
+    def _every(self, interval, fn):
+        while not self._stop.wait(interval):
+            try:
+                fn()
+            except Exception as e:
+                print(f"[WARN] Pack engine {fn.__name__} failed: {e}")
+
+    def compact(self, dead_ratio=COMPACT_DEAD_RATIO):
+        """
+        Rewrites sealed packs that are mostly dead: live chunks are copied
+        to the active pack, tombstones carried over only while they can
+        still shadow a chunk in an older pack, then the pack is removed.
+        Returns the number of bytes reclaimed.
+        """
+        reclaimed = 0
+        for pack in sorted(self.pack_size):
+            if pack == self._active:
+                continue
+            size = self.pack_size[pack]
+            if size and self.pack_live[pack] / size > 1 - dead_ratio:
+                continue
+            oldest = pack == min(self.pack_size)
+            path = self._pack_path(pack)
+            for flag, chunk_id, data_off, length in list(self._scan(pack)):
+                if flag == _PUT:
+                    with open(path, "rb") as f:
+                        f.seek(data_off)
+                        data = f.read(length)
+                    with self._lock:
+                        if self.index.get(chunk_id) != (pack, data_off, length):
+                            continue  # overwritten or deleted since
+                        new_off = self._append(_PUT, chunk_id, [data], length)
+                        self._apply(_PUT, chunk_id, self._active, new_off, length)
+                        self._rotate_if_full()
+                elif not oldest:
+                    with self._lock:
+                        if chunk_id not in self.index:
+                            self._append(_TOMBSTONE, chunk_id, [], 0)
+                            self._rotate_if_full()
+            with self._lock:
+                self._sync_active()  # the copies must be durable before the original goes
+                os.remove(path)
+                reclaimed += self.pack_size.pop(pack) - self.pack_live.pop(pack, 0)
+                self.save_index()
+        if reclaimed:
+            print(f"[INFO] Compaction reclaimed {reclaimed} bytes")
+        return reclaimed
+
+    def close(self):
+        self._stop.set()
+        self.save_index()
+        self._file.close()
+
+
+class _PackWriter(ChunkWriter):
+    """
+    Collects the chunk and appends it in one go on commit, so concurrent
+    uploads never interleave inside the active pack and the lock is only
+    held for the append. Up to PACK_BUFFER_BYTES stay in memory; larger
+    chunks spill to an unnamed temp file, so memory per upload is bounded.
+    """
+
+    def __init__(self, engine):
+        super().__init__(engine)
+        self.blocks = []
+        self.spill = None
+
+    def _write(self, block):
+        if self.spill is None and self.length > PACK_BUFFER_BYTES:
+            self.spill = tempfile.TemporaryFile(dir=self.engine.data_dir, prefix=".tmp-")
+            self.spill.writelines(self.blocks)
+            self.blocks = []
+        if self.spill is None:
+            self.blocks.append(block)
+        else:
+            self.spill.write(block)
+
+    def _stored_blocks(self):
+        if self.spill is None:
+            return self.blocks
+        self.spill.seek(0)
+        return iter(lambda: self.spill.read(IO_BLOCK_SIZE), b"")
+
+    def _commit(self, chunk_id):
+        engine = self.engine
+        with engine._lock:
+            data_off = engine._append(_PUT, chunk_id, self._stored_blocks(), self.length)
+            engine._apply(_PUT, chunk_id, engine._active, data_off, self.length)
+            engine._rotate_if_full()
+
+    def discard(self):
+        self.blocks = []
+        if self.spill is not None:
+            self.spill.close()
+            self.spill = None
+
+
+def create_engine(kind, data_dir, legacy_dir=None, cache_mb=CHUNK_CACHE_MB):
+    if kind == "file":
+        return FileEngine(data_dir, legacy_dir, cache_mb=cache_mb)
+    if kind == "pack":
+        return PackEngine(data_dir, legacy_dir, cache_mb=cache_mb)
+    raise ValueError(f"Unknown storage engine: {kind} (expected one of {ENGINES})")
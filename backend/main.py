@@ -1,7 +1,6 @@
 import os
 import json
 import pickle
-import requests
 import numpy as np
 from pathlib import Path
 
@@ -10,12 +9,14 @@ import sys
 # so we can import dfs modules by path
 sys.path.append(str(Path(__file__).resolve().parents[1] / "dfs"))
 from dfs.client.upload import upload_file
-from dfs.core.chunker import reconstruct_file
+from dfs.client.download import iter_file_chunks, download_batched
+from dfs.core.metadata import load_metadata_batch
 from dfs.client.delete import delete_file
 
 # ---- Search Engine imports ----
 from search_engine.indexer import index_pdf
 from search_engine.search import load_index, calculate_cosine_similarity, character_level_match
+from search_engine.quantize import quantized_available, approximate_scores, rescore
 
 # ---- Semantic Model imports ----
 from sentence_transformers import SentenceTransformer
@@ -29,83 +30,170 @@ INDEX_DIR     = BASE_DIR / "search_engine" / "index"
 EMB_FILE      = INDEX_DIR / "corpus_embeddings.pkl"   # your SBERT embeddings
 SCORE_THRESHOLD = 0.2                                  # minimum combined score to keep
 
+# "none" scores against the float pickle; "int8" / "binary" scan a quantized
+# copy held in memory and rescore the best candidates at full precision
+EMBEDDING_QUANTIZATION = os.getenv("EMBEDDING_QUANTIZATION", "none").lower()
+RESCORE_CANDIDATES     = 50                            # exact rescoring depth
+
 # load SBERT model once
 SBERT_MODEL = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
 
 
 def index_and_upload_pdf(pdf_path):
     print(f"[INFO] Indexing and uploading: {pdf_path}")
-    index_pdf(pdf_path)
+    result = index_pdf(pdf_path)
+    if result and result["status"] == "duplicate":
+        # same paper under another name: don't chunk it into the DFS again
+        print(f"[INFO] Skipping upload, near-duplicate of {result['duplicate_of']}")
+        return result
     upload_file(pdf_path)
+    return result
 
 
-def search_query(query, top_k=3):
+def _lexical_scores(query, corpus):
     """
-    Hybrid semantic + lexical search:
-      1. Lexical: BM25/Tf-IDF cosine + character‐level boosts
-      2. Semantic: SBERT cosine
-      3. Combine 50/50, threshold, and return top_k hits.
-    Returns: list of (basename, metadata_dict)
+    BM25/Tf-IDF cosine with character-level boosts, one score per document.
     """
-    # 1) load lexical index
-    corpus, docs = load_index()
-    if corpus is None:
-        return []
+    char_scores = [character_level_match(query, doc) for doc in corpus]
+    lex_cos     = calculate_cosine_similarity(query, corpus)
+
+    scores = []
+    for ch, lx in zip(char_scores, lex_cos):
+        # boost exact/partial substring
+        if ch == 1.0:
+            scores.append(1.0)
+        elif ch > 0:
+            scores.append(0.8 * lx + 0.2 * ch)
+        else:
+            scores.append(lx)
+    return scores
+
+
+def _semantic_scores(query):
+    """
+    SBERT cosine between the query and every document embedding.
+    """
+    if EMBEDDING_QUANTIZATION != "none" and quantized_available(EMBEDDING_QUANTIZATION):
+        return _quantized_semantic_scores(query)
 
-    # 2) load semantic embeddings
     if not EMB_FILE.exists():
         raise FileNotFoundError(f"Missing embeddings file: {EMB_FILE}")
     corpus_emb = pickle.loads(EMB_FILE.read_bytes())          # shape (N, d)
 
-    # 3) encode query semantically
     q_emb = SBERT_MODEL.encode(query, convert_to_numpy=True)  # shape (d,)
 
     # normalize both for cosine
     corpus_norm = corpus_emb / np.linalg.norm(corpus_emb, axis=1, keepdims=True)
     q_norm      = q_emb      / np.linalg.norm(q_emb)
-    sem_scores  = (corpus_norm @ q_norm).tolist()            # length N
+    return (corpus_norm @ q_norm).tolist()                   # length N
 
-    # 4) lexical scores
-    char_scores = [character_level_match(query, doc) for doc in corpus]
-    lex_cos     = calculate_cosine_similarity(query, corpus)
 
-    # 5) combine and threshold
-    hits = []
-    for i, (ch, lx, sm) in enumerate(zip(char_scores, lex_cos, sem_scores)):
-        # boost exact/partial substring
-        if ch == 1.0:
-            lexical_score = 1.0
-        elif ch > 0:
-            lexical_score = 0.8 * lx + 0.2 * ch
-        else:
-            lexical_score = lx
-
-        # final hybrid score (50% lexical, 50% semantic)
-        score = 0.5 * lexical_score + 0.5 * sm
-        if score < SCORE_THRESHOLD:
-            continue
-
-        entry   = docs[i]
-        basename= entry["file_name"]
-        relpath = entry["relative_path"]
-        # load DFS metadata for download/view
-        md_file = BASE_DIR / "dfs" / "metadata" / f"{basename}.json"
-        md      = json.loads(md_file.read_text()) if md_file.exists() else {}
-        hits.append((score, basename, entry["title"], entry["author"], md))
-
-    # 6) sort, take top_k
+def _quantized_semantic_scores(query):
+    """
+    First pass over the int8/binary corpus matrix, then exact cosine for
+    the top RESCORE_CANDIDATES rows. Other documents keep their estimate.
+    """
+    q_emb  = SBERT_MODEL.encode(query, convert_to_numpy=True)
+    scores = approximate_scores(q_emb, EMBEDDING_QUANTIZATION).astype(np.float64)
+
+    k = min(RESCORE_CANDIDATES, len(scores))
+    candidates = np.argpartition(-scores, k - 1)[:k] if k else []
+    if k:
+        scores[candidates] = rescore(q_emb, candidates)
+    return scores.tolist()
+
+
+def _top_hits(scores, docs, top_k, threshold=0.0):
+    """
+    Returns the top_k (score, doc_index) pairs with score >= threshold.
+    """
+    hits = [(sc, i) for i, sc in enumerate(scores) if sc >= threshold]
     hits.sort(key=lambda x: x[0], reverse=True)
-    hits = hits[:top_k]
+    return hits[:top_k]
+
+
+def _load_dfs_metadata(basenames):
+    """
+    {basename: metadata} for all hits in one lookup; files without
+    metadata get an empty chunk list.
+    """
+    found = load_metadata_batch(basenames)
+    return {bn: found.get(bn) or {"chunks": []} for bn in basenames}
+
+
+def search_query_stages(query, top_k=3):
+    """
+    Progressive version of search_query. Yields (stage, hits) as soon as
+    each stage is ready:
+      "lexical"  - ranked by lexical score only (cheap, no SBERT)
+      "ranked"   - final 50/50 hybrid ranking, thresholded
+      "metadata" - the final hits enriched with a snippet and DFS chunk count
+    Each hit is a dict with basename, title, author and score.
+    """
+    corpus, docs = load_index()
+    if corpus is None:
+        yield "ranked", []
+        return
+
+    def as_dicts(hits):
+        return [{
+            "basename": docs[i]["file_name"],
+            "title":    docs[i]["title"],
+            "author":   docs[i]["author"],
+            "score":    round(float(sc), 4)
+        } for sc, i in hits]
+
+    lexical = _lexical_scores(query, corpus)
+    yield "lexical", as_dicts(_top_hits(lexical, docs, top_k, threshold=1e-9))
+
+    semantic = _semantic_scores(query)
+    combined = [0.5 * lx + 0.5 * sm for lx, sm in zip(lexical, semantic)]
+    ranked   = _top_hits(combined, docs, top_k, SCORE_THRESHOLD)
+    results  = as_dicts(ranked)
+    yield "ranked", results
+
+    metadata = _load_dfs_metadata([hit["basename"] for hit in results])
+    for hit, (_, i) in zip(results, ranked):
+        text = corpus[i].replace("\n", " ")
+        hit["snippet"]     = (text[:200].strip() + "…") if text else ""
+        hit["chunk_count"] = len(metadata[hit["basename"]]["chunks"])
+    yield "metadata", results
+
 
-    # 7) print for CLI and return just (basename, metadata)
+def search_query(query, top_k=3):
+    """
+    Hybrid semantic + lexical search:
+      1. Lexical: BM25/Tf-IDF cosine + character‐level boosts
+      2. Semantic: SBERT cosine
+      3. Combine 50/50, threshold, and return top_k hits.
+    Returns: list of (basename, metadata_dict)
+    """
+    # 1) load lexical index
+    corpus, docs = load_index()
+    if corpus is None:
+        return []
+
+    # 2) lexical + semantic scores
+    lexical  = _lexical_scores(query, corpus)
+    semantic = _semantic_scores(query)
+
+    # 3) final hybrid score (50% lexical, 50% semantic), threshold, top_k
+    combined = [0.5 * lx + 0.5 * sm for lx, sm in zip(lexical, semantic)]
+    hits = [
+        (sc, docs[i]["file_name"], docs[i]["title"], docs[i]["author"])
+        for sc, i in _top_hits(combined, docs, top_k, SCORE_THRESHOLD)
+    ]
+
+    # 4) print for CLI and return (basename, DFS metadata for download/view)
     if hits:
         print(f"\nTop {len(hits)} results (score ≥ {SCORE_THRESHOLD:.2f}):")
-        for idx, (sc, bn, ti, au, _) in enumerate(hits, start=1):
+        for idx, (sc, bn, ti, au) in enumerate(hits, start=1):
             print(f"{idx}. {ti}\n   Authors: {au}\n   Score: {sc:.3f}\n   Path: {bn}")
     else:
         print(f"[INFO] No documents scored ≥ {SCORE_THRESHOLD:.2f}")
 
-    return [(bn, md) for _, bn, _, _, md in hits]
+    metadata = _load_dfs_metadata([bn for _, bn, _, _ in hits])
+    return [(bn, metadata[bn]) for _, bn, _, _ in hits]
 
 
 def download_submenu(matched):
@@ -123,21 +211,19 @@ def download_submenu(matched):
 
     basename, metadata = matched[idx]
     print(f"[INFO] Downloading {basename} from DFS...")
-    chunk_dir = BASE_DIR / "chunks"
-    chunk_dir.mkdir(exist_ok=True)
-    for chunk_id, node_url in metadata.items():
-        url = f"{node_url}/chunk/{chunk_id}"
-        try:
-            r = requests.get(url, timeout=5)
-            r.raise_for_status()
-            (chunk_dir / chunk_id).write_bytes(r.content)
-            print(f"  ▷ got {chunk_id}")
-        except Exception as e:
-            print(f"  ⚠️ failed {chunk_id}: {e}")
-            return
-
     out_path = DOWNLOAD_DIR / basename
-    reconstruct_file(list(metadata.keys()), str(out_path), input_dir=str(chunk_dir))
+    try:
+        with open(out_path, "wb") as out:
+            if metadata.get("size") is None:
+                for data in iter_file_chunks(metadata):
+                    out.write(data)
+            else:
+                # whole file: one batch stream per node
+                download_batched(metadata, out)
+    except Exception as e:
+        print(f"  ⚠️ download failed: {e}")
+        out_path.unlink(missing_ok=True)
+        return
     print(f"[SUCCESS] Reconstructed to {out_path}")
 
 
@@ -0,0 +1,149 @@
+import re
+import json
+import zlib
+import hashlib
+import numpy as np
+from pathlib import Path
+
+# ---------------------- Directory Setup ----------------------
+
+BASE_DIR = Path(__file__).resolve().parents[1]
+INDEX_DIR = BASE_DIR / "search_engine" / "index"
+INDEX_DIR.mkdir(parents=True, exist_ok=True)
+
+DEDUP_FILE = INDEX_DIR / "minhash_index.json"
+
+# ---------------------- MinHash / LSH Parameters ----------------------
+
+SHINGLE_SIZE = 5            # words per shingle
+NUM_PERM = 128              # MinHash signature length
+LSH_BANDS = 16              # 16 bands x 8 rows -> candidates from ~0.7 Jaccard
+LSH_ROWS = NUM_PERM // LSH_BANDS
+DUPLICATE_THRESHOLD = 0.85  # estimated Jaccard above which a document is a near-duplicate
+
+_PRIME = (1 << 31) - 1
+_rng = np.random.RandomState(42)  # fixed seed: signatures must be stable across runs
+_PERM_A = _rng.randint(1, _PRIME, size=NUM_PERM).astype(np.uint64)
+_PERM_B = _rng.randint(0, _PRIME, size=NUM_PERM).astype(np.uint64)
+
+# ---------------------- Signatures ----------------------
+
+def _shingles(text):
+    words = re.findall(r"\w+", text.lower())
+    if len(words) <= SHINGLE_SIZE:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+def compute_signature(text):
+    """
+    Computes the MinHash signature of a document's text over word shingles.
+    """
+    shingles = _shingles(text)
+    if not shingles:
+        return np.full(NUM_PERM, _PRIME, dtype=np.uint64)
+    hashes = np.fromiter(
+        (zlib.crc32(s.encode("utf-8")) % _PRIME for s in shingles),
+        dtype=np.uint64, count=len(shingles)
+    )
+    # (a * x + b) mod p for every permutation/shingle pair, then min per permutation
+    permuted = (np.outer(_PERM_A, hashes) + _PERM_B[:, None]) % _PRIME
+    return permuted.min(axis=1)
+
+
+def estimate_similarity(sig_a, sig_b):
+    """
+    Estimated Jaccard similarity of two MinHash signatures.
+    """
+    return float(np.mean(np.asarray(sig_a) == np.asarray(sig_b)))
+
+
+def _band_keys(signature):
+    sig = np.asarray(signature, dtype=np.uint64)
+    return [
+        f"{b}:{hashlib.md5(sig[b * LSH_ROWS:(b + 1) * LSH_ROWS].tobytes()).hexdigest()[:16]}"
+        for b in range(LSH_BANDS)
+    ]
+
+# ---------------------- LSH Index ----------------------
+
+def load_dedup_index():
+    """
+    Loads the signature store and LSH buckets.
+    """
+    if not DEDUP_FILE.exists():
+        return {"signatures": {}, "buckets": {}}
+    with open(DEDUP_FILE, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_dedup_index(index):
+    with open(DEDUP_FILE, 'w', encoding='utf-8') as f:
+        json.dump(index, f)
+
+
+def find_duplicate(signature, threshold=DUPLICATE_THRESHOLD, index=None, exclude=None):
+    """
+    Looks up near-duplicates of `signature` through the LSH buckets, so only
+    documents sharing at least one band are compared. `exclude` (the file
+    being indexed, when it replaces an earlier version) is never a match.
+    Returns (file_name, similarity) of the closest match above `threshold`,
+    or None.
+    """
+    index = index or load_dedup_index()
+    candidates = set()
+    for key in _band_keys(signature):
+        candidates.update(index["buckets"].get(key, []))
+    candidates.discard(exclude)
+
+    best = None
+    for name in candidates:
+        sim = estimate_similarity(signature, index["signatures"][name])
+        if sim >= threshold and (best is None or sim > best[1]):
+            best = (name, sim)
+    return best
+
+
+def add_signature(file_name, signature):
+    index = load_dedup_index()
+    _add(index, file_name, signature)
+    save_dedup_index(index)
+
+
+def backfill_signatures(documents):
+    """
+    Adds signatures for the (file_name, text) pairs that have none yet,
+    i.e. documents indexed before deduplication existed. Returns the index.
+    """
+    index = load_dedup_index()
+    missing = [(name, text) for name, text in documents if name not in index["signatures"]]
+    for name, text in missing:
+        _add(index, name, compute_signature(text))
+    if missing:
+        save_dedup_index(index)
+        print(f"[INFO] Added near-duplicate signatures for {len(missing)} indexed document(s).")
+    return index
+
+
+def remove_signature(file_name):
+    index = load_dedup_index()
+    if file_name in index["signatures"]:
+        _drop(index, file_name)
+        save_dedup_index(index)
+
+
+def _add(index, file_name, signature):
+    if file_name in index["signatures"]:
+        _drop(index, file_name)
+    index["signatures"][file_name] = [int(v) for v in signature]
+    for key in _band_keys(signature):
+        index["buckets"].setdefault(key, []).append(file_name)
+
+
+def _drop(index, file_name):
+    for key in _band_keys(index["signatures"].pop(file_name)):
+        bucket = [n for n in index["buckets"].get(key, []) if n != file_name]
+        if bucket:
+            index["buckets"][key] = bucket
+        else:
+            index["buckets"].pop(key, None)
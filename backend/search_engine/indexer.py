@@ -13,6 +13,9 @@ import numpy as np
 import platform
 from dfs.client.upload import upload_file
 from sentence_transformers import SentenceTransformer
+from search_engine.neighbors import add_document
+from search_engine.dedup import compute_signature, find_duplicate, add_signature, backfill_signatures
+from search_engine.quantize import save_quantized
 
 # ---------------------- Ensure punkt tokenizer is available ----------------------
 # (existing punkt setup unchanged)
@@ -86,6 +89,11 @@ def extract_pdf_text(pdf_path):
 # (existing save_index, load_index, index_pdf unchanged except save_index extended below)
 
 def save_index(corpus, doc_info, tfidf_matrix=None):
+    """
+    Writes the corpus, document info and TF-IDF cache, then rebuilds the
+    semantic embeddings. Returns the embeddings, or None if they failed.
+    """
+    embeddings = None
     try:
         with open(INDEX_FILE, 'w', encoding='utf-8') as f:
             json.dump({"corpus": corpus}, f, indent=2)
@@ -101,11 +109,14 @@ def save_index(corpus, doc_info, tfidf_matrix=None):
             embeddings = model.encode(corpus, show_progress_bar=True, convert_to_numpy=True)
             with open(EMBEDDING_CACHE, 'wb') as ef:
                 pickle.dump(embeddings, ef)
+            save_quantized(embeddings)
             print(f"[SUCCESS] Semantic embeddings saved at: {EMBEDDING_CACHE}")
         except Exception as e:
             print(f"[WARN] Failed to build embeddings: {e}")
+            embeddings = None
     except Exception as e:
         print(f"[ERROR] Failed to save index: {e}")
+    return embeddings
 
 
 def load_index():
@@ -127,27 +138,54 @@ def load_index():
         print(f"[ERROR] Failed to load index: {e}")
         return None, None, None, None
 
+def load_corpus():
+    """
+    The indexed texts and their document info, without building BM25.
+    """
+    if not INDEX_FILE.exists() or not DOCS_FILE.exists():
+        return [], []
+    with open(INDEX_FILE, 'r', encoding='utf-8') as f:
+        corpus = json.load(f)["corpus"]
+    with open(DOCS_FILE, 'r', encoding='utf-8') as f:
+        doc_info = json.load(f)
+    return corpus, doc_info
+
 # ---------------------- Indexing Function ----------------------
 # (existing index_pdf unchanged)
 
 def index_pdf(pdf_path):
+    """
+    Indexes a PDF. Returns {"status": "indexed"} on success,
+    {"status": "duplicate", "duplicate_of": ..., "similarity": ...} when the
+    text is a near-duplicate of an indexed document, or None on failure.
+    """
     pdf_path = Path(pdf_path).resolve()
     if not pdf_path.exists():
         print(f"[ERROR] File not found: {pdf_path}")
         return
     print(f"[INFO] Indexing file: {pdf_path.name}")
-    title, author = extract_title_author_grobid(pdf_path)
-    if not title or not author:
-        print("[WARN] Skipping file due to metadata extraction failure.")
-        return
     full_text = extract_pdf_text(pdf_path)
     if not full_text:
         print("[WARN] Skipping file due to full text extraction failure.")
         return
-    bm25, corpus, doc_info, tfidf_matrix = load_index()
-    if corpus is None:
-        corpus, doc_info = [], []
-        tfidf_matrix = None
+    corpus, doc_info = load_corpus()
+    # near-duplicate check before any GROBID / embedding work; a file
+    # uploaded again under its name is compared against everything else
+    dedup_index = backfill_signatures(zip((d["file_name"] for d in doc_info), corpus))
+    signature = compute_signature(full_text)
+    duplicate = find_duplicate(signature, index=dedup_index, exclude=pdf_path.name)
+    if duplicate:
+        name, similarity = duplicate
+        print(f"[WARN] {pdf_path.name} is a near-duplicate of {name} (similarity {similarity:.2f}), skipping.")
+        return {"status": "duplicate", "duplicate_of": name, "similarity": similarity}
+    title, author = extract_title_author_grobid(pdf_path)
+    if not title or not author:
+        print("[WARN] Skipping file due to metadata extraction failure.")
+        return
+    # a new version replaces the document's old entry
+    previous = [i for i, d in enumerate(doc_info) if d["file_name"] == pdf_path.name]
+    for i in reversed(previous):
+        del corpus[i], doc_info[i]
     corpus.append(full_text)
     doc_info.append({
         "title": title,
@@ -159,7 +197,14 @@ def index_pdf(pdf_path):
     bm25 = BM25Okapi(tokenized_corpus)
     vectorizer = TfidfVectorizer()
     tfidf_matrix = vectorizer.fit_transform(corpus)
-    save_index(corpus, doc_info, tfidf_matrix)
+    embeddings = save_index(corpus, doc_info, tfidf_matrix)
+    if embeddings is not None:
+        try:
+            add_document(doc_info, embeddings)
+        except Exception as e:
+            print(f"[WARN] Failed to update related documents: {e}")
+    add_signature(pdf_path.name, signature)
+    return {"status": "indexed"}
 
 
 def upload_indexed_file_to_dfs(pdf_path: Path):
@@ -172,7 +217,10 @@ if __name__ == "__main__":
     parser.add_argument("pdf_file", type=str, help="Path to the PDF file to index")
     args = parser.parse_args()
     try:
-        index_pdf(args.pdf_file)
-        upload_indexed_file_to_dfs(Path(args.pdf_file))
+        result = index_pdf(args.pdf_file)
+        if result and result["status"] == "duplicate":
+            print(f"[INFO] Not uploading, already stored as {result['duplicate_of']}")
+        else:
+            upload_indexed_file_to_dfs(Path(args.pdf_file))
     except Exception as e:
         print(f"[FATAL] Unexpected error during indexing: {e}")
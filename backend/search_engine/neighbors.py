@@ -0,0 +1,138 @@
+import json
+import numpy as np
+from pathlib import Path
+
+# ---------------------- Directory Setup ----------------------
+
+BASE_DIR = Path(__file__).resolve().parents[1]
+INDEX_DIR = BASE_DIR / "search_engine" / "index"
+INDEX_DIR.mkdir(parents=True, exist_ok=True)
+
+RELATED_FILE = INDEX_DIR / "related_docs.json"  # file_name -> [[neighbour, score], ...]
+
+RELATED_K = 5             # neighbours kept per document
+
+# in-memory copy of RELATED_FILE, reloaded only when the file changes
+_GRAPH_CACHE = {"mtime": None, "graph": {}}
+
+# ---------------------- Load / Save ----------------------
+
+def load_related():
+    """
+    Loads the nearest-neighbour graph from disk.
+    """
+    if not RELATED_FILE.exists():
+        return {}
+    with open(RELATED_FILE, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_related(graph):
+    """
+    Saves the nearest-neighbour graph to disk.
+    """
+    with open(RELATED_FILE, 'w', encoding='utf-8') as f:
+        json.dump(graph, f, indent=2)
+
+
+def get_related(file_name):
+    """
+    Returns the precomputed neighbours of `file_name` as a list of
+    (file_name, score) pairs. The graph is kept in memory between calls,
+    so a lookup is a single dict access.
+    """
+    try:
+        mtime = RELATED_FILE.stat().st_mtime
+    except FileNotFoundError:
+        return []
+    if _GRAPH_CACHE["mtime"] != mtime:
+        _GRAPH_CACHE["graph"] = load_related()
+        _GRAPH_CACHE["mtime"] = mtime
+    return [tuple(entry) for entry in _GRAPH_CACHE["graph"].get(file_name, [])]
+
+# ---------------------- Similarity ----------------------
+
+def _similarity_row(i, embeddings):
+    """
+    Embedding cosine similarity of document `i` against every document.
+    The document itself gets -inf so it is never its own neighbour.
+
+    TF-IDF is left out on purpose: the indexer re-fits it on every add,
+    which shifts every document's weights, so scores already stored in
+    the graph would no longer compare with new ones. A document's
+    embedding never changes, so neither do its stored scores.
+    """
+    emb = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(emb, axis=1)
+    norms[norms == 0] = 1.0
+    sims = ((emb @ emb[i]) / (norms * norms[i])).astype(np.float64)
+    sims[i] = -np.inf
+    return sims
+
+
+def _top_k(sims, names, k):
+    order = np.argsort(-sims)[:k]
+    return [[names[j], round(float(sims[j]), 4)] for j in order if np.isfinite(sims[j])]
+
+# ---------------------- Incremental Updates ----------------------
+
+def add_document(doc_info, embeddings, k=RELATED_K):
+    """
+    Adds the last document in `doc_info` to the neighbour graph.
+
+    Only the new document's similarity row is computed; existing lists are
+    patched in place when the new document beats their current k-th entry.
+    Documents that have no list yet (indexed before the graph existed), or
+    that listed an earlier version of a re-uploaded document, get a full
+    row computed.
+    """
+    names = [d["file_name"] for d in doc_info]
+    if len(names) != len(embeddings):
+        print("[WARN] Embeddings and documents are out of sync, skipping neighbour update.")
+        return
+
+    known = set(names)
+    graph = {n: v for n, v in load_related().items() if n in known}
+    new = len(names) - 1
+    sims = _similarity_row(new, embeddings)
+    graph[names[new]] = _top_k(sims, names, k)
+
+    for j, name in enumerate(names[:-1]):
+        entries = graph.get(name)
+        if entries is None or any(e[0] == names[new] for e in entries):
+            # no list yet, or it holds an earlier version of the new document
+            graph[name] = _top_k(_similarity_row(j, embeddings), names, k)
+            continue
+        if len(entries) < k or sims[j] > entries[-1][1]:
+            entries.append([names[new], round(float(sims[j]), 4)])
+            entries.sort(key=lambda e: e[1], reverse=True)
+            entries = entries[:k]
+        graph[name] = entries
+
+    save_related(graph)
+    print(f"[SUCCESS] Related documents updated for: {names[new]}")
+
+
+def remove_document(file_name, doc_info, embeddings, k=RELATED_K):
+    """
+    Removes `file_name` from the neighbour graph. `doc_info` and
+    `embeddings` describe the corpus *after* the removal. Only documents
+    that listed the removed one as a neighbour are recomputed.
+    """
+    graph = load_related()
+    if not graph:
+        return
+    graph.pop(file_name, None)
+
+    names = [d["file_name"] for d in doc_info]
+    aligned = embeddings is not None and len(names) == len(embeddings) and len(names) > 0
+    for j, name in enumerate(names):
+        entries = graph.get(name, [])
+        if not any(e[0] == file_name for e in entries):
+            continue
+        if aligned:
+            graph[name] = _top_k(_similarity_row(j, embeddings), names, k)
+        else:
+            graph[name] = [e for e in entries if e[0] != file_name]
+
+    save_related(graph)
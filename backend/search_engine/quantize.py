@@ -0,0 +1,100 @@
+import numpy as np
+from pathlib import Path
+
+# ---------------------- Directory Setup ----------------------
+
+BASE_DIR = Path(__file__).resolve().parents[1]
+INDEX_DIR = BASE_DIR / "search_engine" / "index"
+INDEX_DIR.mkdir(parents=True, exist_ok=True)
+
+FULL_FILE   = INDEX_DIR / "corpus_embeddings_f32.npy"    # normalised float32, read lazily (mmap)
+INT8_FILE   = INDEX_DIR / "corpus_embeddings_int8.npy"   # int8 codes, one row per document
+SCALE_FILE  = INDEX_DIR / "corpus_embeddings_scale.npy"  # per-row int8 scale
+BINARY_FILE = INDEX_DIR / "corpus_embeddings_bin.npy"    # packed sign bits
+
+# in-memory quantized matrices, reloaded only when the files change
+_CACHE = {}
+
+# ---------------------- Quantization ----------------------
+
+def _normalise(embeddings):
+    emb = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(emb, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return emb / norms
+
+
+def quantize_int8(embeddings):
+    """
+    Symmetric per-row int8 quantization. Returns (codes, scales) with
+    row ≈ codes * scale.
+    """
+    emb = _normalise(embeddings)
+    scales = np.abs(emb).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.round(emb / scales[:, None]).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def quantize_binary(embeddings):
+    """
+    1-bit sign quantization, packed 8 dimensions per byte.
+    """
+    return np.packbits(_normalise(embeddings) > 0, axis=1)
+
+
+def save_quantized(embeddings):
+    """
+    Writes the full-precision (normalised) matrix plus its int8 and binary
+    forms next to the pickle cache.
+    """
+    codes, scales = quantize_int8(embeddings)
+    np.save(FULL_FILE, _normalise(embeddings))
+    np.save(INT8_FILE, codes)
+    np.save(SCALE_FILE, scales)
+    np.save(BINARY_FILE, quantize_binary(embeddings))
+
+# ---------------------- Scoring ----------------------
+
+def _load(path, mmap_mode=None):
+    mtime = path.stat().st_mtime
+    cached = _CACHE.get((path, mmap_mode))
+    if cached is None or cached[0] != mtime:
+        cached = (mtime, np.load(path, mmap_mode=mmap_mode))
+        _CACHE[(path, mmap_mode)] = cached
+    return cached[1]
+
+
+def quantized_available(mode):
+    files = {"int8": (INT8_FILE, SCALE_FILE), "binary": (BINARY_FILE,)}.get(mode)
+    return bool(files) and FULL_FILE.exists() and all(f.exists() for f in files)
+
+
+def approximate_scores(q_emb, mode):
+    """
+    First-pass cosine estimates for every document from the quantized
+    matrix kept in memory.
+    """
+    q = _normalise(q_emb[None, :])[0]
+    if mode == "int8":
+        codes, scales = _load(INT8_FILE), _load(SCALE_FILE)
+        # the query is quantized too and the dot products accumulate in
+        # int32 straight off the int8 codes, without a float copy of the corpus
+        q_codes, q_scale = quantize_int8(q[None, :])
+        dots = np.einsum("ij,j->i", codes, q_codes[0], dtype=np.int32)
+        return dots * scales * q_scale[0]
+    bits = _load(BINARY_FILE)
+    q_bits = np.packbits(q > 0)
+    dims = q.shape[0]
+    hamming = np.unpackbits(np.bitwise_xor(bits, q_bits), axis=1)[:, :dims].sum(axis=1)
+    return 1.0 - 2.0 * hamming / dims
+
+
+def rescore(q_emb, indices):
+    """
+    Exact cosine for the given document rows (same order as `indices`),
+    read lazily from the memory-mapped full-precision file.
+    """
+    q = _normalise(q_emb[None, :])[0]
+    full = _load(FULL_FILE, mmap_mode="r")
+    return np.asarray(full[np.asarray(indices)]) @ q
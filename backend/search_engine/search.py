@@ -32,7 +32,6 @@ INDEX_DIR.mkdir(parents=True, exist_ok=True)
 
 INDEX_FILE = INDEX_DIR / "bm25_index.json"
 DOCS_FILE = INDEX_DIR / "docs.json"
-SIMILARITY_FILE = INDEX_DIR / "similarity_cache.npy"  # Cache for cosine similarities
 
 # ---------------------- Load Index ----------------------
 
@@ -52,22 +51,8 @@ def load_index():
 
     return corpus, doc_info
 
-# ---------------------- Cosine Similarity Cache ----------------------
-
-def load_cosine_similarity():
-    """
-    Loads cached cosine similarities from disk.
-    """
-    if SIMILARITY_FILE.exists():
-        return np.load(SIMILARITY_FILE)
-    else:
-        return None
-
-def save_cosine_similarity(cosine_similarities):
-    """
-    Saves the computed cosine similarities to disk for future use.
-    """
-    np.save(SIMILARITY_FILE, cosine_similarities)
+# Document-to-document similarity is precomputed as a k-nearest-neighbour
+# graph by the indexer, see search_engine/neighbors.py.
 
 # ---------------------- Cosine Similarity Calculation ----------------------
 
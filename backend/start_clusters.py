@@ -3,12 +3,17 @@ import os
 import subprocess
 import time
 import json
+import secrets
 import sys
 import threading
 import requests
 
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
 
+# "flask" runs nodes/node_storage.py, "async" the aiohttp node (same API)
+NODE_SERVER = os.getenv("DFS_NODE_SERVER", "flask")
+NODE_SCRIPTS = {"flask": "node_storage.py", "async": "async_node.py"}
+
 def start_process(cmd, cwd=None, env=None):
     try:
         env = env or os.environ.copy()
@@ -21,11 +26,14 @@ def start_process(cmd, cwd=None, env=None):
 def get_free_ports(start, count):
     return [start + i for i in range(count)]
 
-def launch_nodes(cluster_id, node_ports):
+def launch_nodes(cluster_id, node_ports, cluster_port=None):
     procs = []
+    env = os.environ.copy()
+    if cluster_port:
+        env["DFS_HEARTBEAT_URL"] = f"http://localhost:{cluster_port}"  # nodes push heartbeats to their manager
     for port in node_ports:
         print(f"Starting storage node on port {port}...")
-        p = start_process(["python", "dfs/nodes/node_storage.py", "--port", str(port)])
+        p = start_process(["python", "dfs/nodes/" + NODE_SCRIPTS[NODE_SERVER], "--port", str(port)], env=env)
         if p: procs.append(p)
         else: print(f"[WARN] Node on port {port} did not start.")
     return procs
@@ -34,6 +42,7 @@ def launch_cluster_manager(cluster_port, node_ports):
     node_urls = json.dumps([f"http://localhost:{p}" for p in node_ports])
     env = os.environ.copy()
     env["NODES"] = node_urls
+    env["DFS_HEARTBEAT_URL"] = "http://localhost:6001"  # managers push heartbeats to the global balancer
     env["PYTHONPATH"] = BASE_DIR
     print(f"Starting cluster manager on port {cluster_port}...")
     return start_process(
@@ -49,6 +58,17 @@ def launch_global_balancer(cluster_map):
     
     return start_process(["python", "dfs/load_balancers/global_balancer.py", "--port", "6001"], env=env)
 
+def launch_metadata_service():
+    """
+    Starts the metadata service when DFS_METADATA_URL names one.
+    """
+    url = os.getenv("DFS_METADATA_URL", "").rstrip("/")
+    if not url:
+        return None
+    port = url.rsplit(":", 1)[-1]
+    print(f"Starting metadata service on port {port}...")
+    return start_process(["python", "dfs/metadata_service.py", "--port", port])
+
 def monitor_heartbeats(cluster_map, interval=10):
     """
     Periodically polls the global balancer and each cluster manager for status.
@@ -93,6 +113,12 @@ def start_clusters_and_nodes():
     cluster_mgr_procs = []
     cluster_map = {}
 
+    # nodes accept direct writes signed by the balancers with this secret
+    os.environ.setdefault("DFS_TOKEN_SECRET", secrets.token_hex(32))
+
+    # 0) Metadata service (optional; clients need DFS_METADATA_URL too)
+    md = launch_metadata_service()
+
     # 1) Launch clusters
     for c in range(clusters):
         node_ports = get_free_ports(node_base_port + c*nodes_per_cluster, nodes_per_cluster)
@@ -101,7 +127,7 @@ def start_clusters_and_nodes():
         cm = launch_cluster_manager(cluster_port, node_ports)
         if cm: cluster_mgr_procs.append(cm)
 
-        nodes = launch_nodes(c, node_ports)
+        nodes = launch_nodes(c, node_ports, cluster_port)
         all_node_procs.extend(nodes)
 
         cluster_map[f"cluster_{c+1}"] = f"http://localhost:{cluster_port}"
@@ -127,7 +153,7 @@ def start_clusters_and_nodes():
     except KeyboardInterrupt:
         print("\nShutting down all processes...")
     finally:
-        for p in all_node_procs + cluster_mgr_procs + ([gb] if gb else []):
+        for p in all_node_procs + cluster_mgr_procs + ([gb] if gb else []) + ([md] if md else []):
             if p:
                 print(f"Terminating PID {p.pid}...")
                 p.terminate()